@@ -0,0 +1,118 @@
+#! /usr/bin/env python
+
+'''Long-lived "adb shell" sessions, one per device.
+
+Starting an adb process costs a host fork/exec plus a round trip to the adb
+server; a trial used to pay that roughly ten times. An AdbSession keeps one
+shell open and frames each command's output with a marker line carrying the
+command's exit status, so commands cost a single round trip.
+'''
+
+import os
+import time
+import uuid
+import select
+import logging
+import threading
+import subprocess
+
+ADB = '/usr/bin/env adb'
+
+
+class AdbError(Exception):
+    pass
+
+
+class AdbSession(object):
+    def __init__(self, device, adb=ADB):
+        self.device = device
+        cmd = adb.split() + ['-s', device, 'shell']
+        logging.debug(' '.join(cmd))
+        self._proc = subprocess.Popen(cmd, stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+        self._buffer = ''
+        # in case adb gave us a pty, don't let it echo our commands back
+        self.run('stty -echo 2>/dev/null', check=False)
+
+    def _get_alive(self):
+        return self._proc is not None and self._proc.poll() is None
+    alive = property(_get_alive)
+
+    def run(self, command, check=True, timeout=60):
+        '''Run command in the session's shell and return its output. Raises
+        AdbError if the session breaks, the command takes longer than timeout
+        seconds, or (if check) the command exits with a non-zero status.'''
+        if not self.alive:
+            raise AdbError('adb shell session to %s is closed' % self.device)
+
+        # the marker is split in two on the command line so that, if the
+        # shell echoes the line back, the echo doesn't look like the marker
+        token = uuid.uuid4().hex
+        marker = '__ADB_DONE_%s' % token
+        line = '( %s ) < /dev/null 2>&1; echo "__ADB_DONE_""%s" $?\n' % (command, token)
+        logging.debug('[%s] %s', self.device, command)
+        try:
+            self._proc.stdin.write(line)
+            self._proc.stdin.flush()
+        except (IOError, OSError) as e:
+            self.close()
+            raise AdbError('adb shell session to %s failed: %s' % (self.device, e))
+
+        deadline = time.time() + timeout
+        fd = self._proc.stdout.fileno()
+        while marker not in self._buffer:
+            remaining = deadline - time.time()
+            ready = select.select([fd], [], [], max(remaining, 0))[0] if remaining > 0 else []
+            if not ready:
+                self.close()
+                raise AdbError('timed out after %is running "%s" on %s' % (timeout, command, self.device))
+            data = os.read(fd, 65536)
+            if not data:
+                self.close()
+                raise AdbError('adb shell session to %s ended' % self.device)
+            self._buffer += data.replace('\r', '')
+
+        output, rest = self._buffer.split(marker, 1)
+        status, self._buffer = rest.split('\n', 1) if '\n' in rest else (rest, '')
+        status = int(status.strip() or 0)
+        if check and status != 0:
+            raise AdbError('"%s" exited with status %i on %s: %s' %
+                (command, status, self.device, output.strip()))
+        return output
+
+    def close(self):
+        if self._proc is None:
+            return
+        try:
+            if self._proc.poll() is None:
+                self._proc.stdin.close()
+                self._proc.kill()
+            self._proc.wait()
+        except (IOError, OSError):
+            pass
+        self._proc = None
+
+
+_sessions = {}
+_sessions_lock = threading.Lock()
+
+def get_session(device, adb=ADB):
+    '''Return the open session for device, starting one if needed'''
+    with _sessions_lock:
+        session = _sessions.get(device)
+        if session is None or not session.alive:
+            session = AdbSession(device, adb)
+            _sessions[device] = session
+        return session
+
+def close_session(device):
+    with _sessions_lock:
+        session = _sessions.pop(device, None)
+    if session is not None:
+        session.close()
+
+def close_sessions():
+    with _sessions_lock:
+        for session in _sessions.values():
+            session.close()
+        _sessions.clear()
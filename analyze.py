@@ -2,132 +2,847 @@
 
 import os
 import sys
+import time
 import logging
 import argparse
+import itertools
 import numpy
+from multiprocessing import Pool, cpu_count
 
-sys.path.append('pt4utils')
-from pt4_filereader import Pt4FileReader
+import pt4
 
-def last_line(filepath):
-    with open(filepath, "rb") as f:
-        f.seek(-2, 2)            # Jump to the second last byte.
-        while f.read(1) != "\n": # Until EOL is found...
-            f.seek(-2, 1)        # ...jump back the read byte plus one more.
-        last = f.readline()      # Read last line.
-    return last
+CSV_CACHE_VERSION = 1
+CSV_INDEX_VERSION = 1
+DEFAULT_INDEX_STRIDE = 10000  # CSV rows between time index entries
+DEFAULT_CHUNK_SAMPLES = 1000000
+PYRAMID_VERSION = 1
+PYRAMID_MIN_LEVEL = 4      # finest envelope buckets hold 2**4 samples
+PYRAMID_MIN_BUCKETS = 256  # coarsest envelope level has about this many
+DEFAULT_MEDIAN_ERROR_MA = 0.05
+DEFAULT_FOLLOW_INTERVAL = 5  # seconds between summaries in follow mode
 
-class PowerMonitorLog(object):
+# loadpages.sh/loadobjects.sh frame their loads with signal_spikes (see
+# loadcommon.sh): SPIKE_BURSTS bursts of CPU work, each followed by
+# SPIKE_PAUSE_SECONDS of sleep. The scripts sleep SCRIPT_GAP_SECONDS more
+# between the opening bookend and the first load, and between the last load
+# and the closing bookend.
+SPIKE_BURSTS = 3
+SPIKE_PAUSE_SECONDS = 2
+SCRIPT_GAP_SECONDS = 5
+SPIKE_SMOOTH_SECONDS = 0.25  # moving average window for finding bursts
+SPIKE_MERGE_SECONDS = 1.0    # high-current runs closer than this are one burst
+# the scripts log whole-second timestamps, so each load boundary is only good
+# to about a second; loads shorter than SHORT_SEGMENT_SECONDS get a warning
+SCRIPT_LOG_RESOLUTION_SECONDS = 1
+SHORT_SEGMENT_SECONDS = 5
+# the last load should last about as long as a typical one; if the bookends
+# leave it more (or less) time than this, they and the script log disagree
+SPAN_TOLERANCE_SECONDS = 3
+
+SEGMENT_DTYPE = numpy.dtype([
+    ('url', 'O'),
+    ('trial', 'i4'),            # n-th load of url in the run
+    ('start', 'f8'),            # seconds into the power log
+    ('duration', 'f8'),         # seconds
+    ('samples', 'i8'),
+    ('charge_mC', 'f8'),
+    ('energy_uAh', 'f8'),
+    ('above_baseline_energy_uAh', 'f8'),
+])
+
+
+def _seconds_per_unit(units):
+    return 60 if units == 'min' else 1
+
+def _parse_csv_careful(lines):
+    '''Line-by-line fallback for CSVs with malformed rows (skips them)'''
+    rows = []
+    for line in lines:
+        fields = line.split(',')
+        if len(fields) < 2:
+            continue
+        try:
+            rows.append((float(fields[0]), float(fields[1])))
+        except ValueError:
+            continue
+    return numpy.array(rows, dtype=numpy.float64).reshape(-1, 2)
+
+def _parse_csv_body(body, ncols):
+    '''Parse CSV rows (no header) into an Nx2 array of (time, current)'''
+    body = body.replace('\r', '').strip()
+    nrows = body.count('\n') + 1 if body else 0
+    values = numpy.fromstring(body.replace('\n', ','), dtype=numpy.float64, sep=',') \
+        if body else numpy.empty(0)
+    if len(values) == nrows * ncols:
+        return values.reshape(nrows, ncols)[:, :2]
+    logging.debug('Malformed CSV rows; parsing line by line')
+    return _parse_csv_careful(body.split('\n'))
+
+def _parse_csv_header(header):
+    '''Return (units, number of columns) from a CSV header line'''
+    units = header.split('(')[1].split(')')[0] if '(' in header else ''
+    return units, header.count(',') + 1
+
+def read_csv_samples(filepath):
+    '''Parse a power monitor CSV in one bulk pass. Returns (times, currents,
+    units): times in seconds, currents in mA, units as written in the header.'''
+    with open(filepath, 'r') as f:
+        header = f.readline()
+        body = f.read()
+    units, ncols = _parse_csv_header(header)
+    values = _parse_csv_body(body, ncols)
+
+    times = values[:, 0] * _seconds_per_unit(units)
+    currents = values[:, 1].copy()
+    return times, currents, units
+
+def iter_csv_chunks(filepath, chunk_samples=DEFAULT_CHUNK_SAMPLES):
+    '''Yield (times, currents) from a power monitor CSV, at most
+    chunk_samples rows at a time'''
+    with open(filepath, 'r') as f:
+        units, ncols = _parse_csv_header(f.readline())
+        seconds_per_unit = _seconds_per_unit(units)
+        while True:
+            lines = list(itertools.islice(f, chunk_samples))
+            if len(lines) == 0:
+                break
+            values = _parse_csv_body(''.join(lines), ncols)
+            yield values[:, 0] * seconds_per_unit, values[:, 1].copy()
+    f.closed
+
+def iter_pt4_chunks(filepath, chunk_samples=DEFAULT_CHUNK_SAMPLES):
+    '''Yield (times, main currents) from a PT4 file, chunk_samples at a time'''
+    for samples in pt4.iter_samples(filepath, chunk_samples):
+        yield samples['time'], samples['main'].astype(numpy.float64)
+
+def _csv_cache_path(filepath):
+    return filepath + '.cache.npz'
+
+def load_csv_samples(filepath, use_cache=True):
+    '''Like read_csv_samples, but keeps the parsed arrays in a .npz sidecar
+    next to the CSV, keyed by the CSV's size and mtime.'''
+    if not use_cache:
+        return read_csv_samples(filepath)
+
+    st = os.stat(filepath)
+    cache_path = _csv_cache_path(filepath)
+    if os.path.isfile(cache_path):
+        try:
+            cached = numpy.load(cache_path)
+            if int(cached['version']) == CSV_CACHE_VERSION and \
+                    int(cached['size']) == st.st_size and \
+                    float(cached['mtime']) == st.st_mtime:
+                logging.debug('Using cached samples for %s', filepath)
+                return cached['times'], cached['currents'], str(cached['units'])
+        except Exception as e:
+            logging.debug('Ignoring unreadable cache %s: %s', cache_path, e)
+
+    times, currents, units = read_csv_samples(filepath)
+    try:
+        with open(cache_path, 'wb') as f:
+            numpy.savez(f, version=CSV_CACHE_VERSION, size=st.st_size,
+                mtime=st.st_mtime, times=times, currents=currents, units=units)
+        f.closed
+    except Exception as e:
+        logging.debug('Could not write cache %s: %s', cache_path, e)
+    return times, currents, units
+
+def _csv_index_path(filepath):
+    return filepath + '.index.npz'
+
+def build_csv_index(filepath, stride=DEFAULT_INDEX_STRIDE, block_bytes=1 << 24):
+    '''Return a sparse time index of a power monitor CSV: the timestamps and
+    byte offsets of every stride-th row and of the last row, plus what's
+    needed to parse rows on their own (see read_csv_window). Only the
+    indexed rows are parsed; the rest of the file is just scanned for line
+    breaks.'''
+    size = os.path.getsize(filepath)
+    with open(filepath, 'rb') as f:
+        units, ncols = _parse_csv_header(f.readline())
+        seconds_per_unit = _seconds_per_unit(units)
+
+        # offsets of the rows to index: rows start at the top of the body
+        # and after every line break
+        offsets = []
+        rows = 0
+        last = None
+        block_start = f.tell()
+        starts = numpy.array([block_start], dtype=numpy.int64)
+        while True:
+            block = f.read(block_bytes)
+            if len(block) > 0:
+                newlines = numpy.flatnonzero(numpy.frombuffer(block, dtype=numpy.uint8) == 10)
+                starts = numpy.concatenate((starts, newlines + block_start + 1))
+                block_start += len(block)
+            starts = starts[starts < size]
+            if len(starts) > 0:
+                offsets.append(starts[(numpy.arange(len(starts)) + rows) % stride == 0])
+                rows += len(starts)
+                last = starts[-1]
+            if len(block) == 0:
+                break
+            starts = numpy.empty(0, dtype=numpy.int64)
+        offsets = numpy.concatenate(offsets) if len(offsets) > 0 else numpy.empty(0, dtype=numpy.int64)
+        if last is not None and (len(offsets) == 0 or offsets[-1] != last):
+            offsets = numpy.append(offsets, last)
+
+        times = numpy.empty(len(offsets))
+        for i, offset in enumerate(offsets):
+            f.seek(offset)
+            try:
+                times[i] = float(f.readline().split(',')[0]) * seconds_per_unit
+            except ValueError:
+                times[i] = numpy.nan  # malformed row (or blank line)
+    f.closed
+
+    keep = ~numpy.isnan(times)
+    return dict(units=units, ncols=ncols, size=size, rows=rows,
+        times=times[keep], offsets=offsets[keep])
+
+def load_csv_index(filepath, use_cache=True):
+    '''Like build_csv_index, but keeps the index in a .index.npz sidecar
+    next to the CSV, keyed by the CSV's size and mtime.'''
+    if not use_cache:
+        return build_csv_index(filepath)
+
+    st = os.stat(filepath)
+    index_path = _csv_index_path(filepath)
+    if os.path.isfile(index_path):
+        try:
+            cached = numpy.load(index_path)
+            if int(cached['version']) == CSV_INDEX_VERSION and \
+                    int(cached['size']) == st.st_size and \
+                    float(cached['mtime']) == st.st_mtime:
+                logging.debug('Using time index for %s', filepath)
+                return dict(units=str(cached['units']), ncols=int(cached['ncols']),
+                    size=int(cached['size']), rows=int(cached['rows']),
+                    times=cached['times'], offsets=cached['offsets'])
+        except Exception as e:
+            logging.debug('Ignoring unreadable index %s: %s', index_path, e)
+
+    index = build_csv_index(filepath)
+    try:
+        with open(index_path, 'wb') as f:
+            numpy.savez(f, version=CSV_INDEX_VERSION, mtime=st.st_mtime, **index)
+        f.closed
+    except Exception as e:
+        logging.debug('Could not write index %s: %s', index_path, e)
+    return index
+
+def read_csv_window(filepath, t0, t1, index):
+    '''Return (times, currents) of the rows of a CSV with t0 <= time < t1,
+    reading only the bytes between the index entries around the window'''
+    i = max(numpy.searchsorted(index['times'], t0, side='right') - 1, 0)
+    j = numpy.searchsorted(index['times'], t1, side='right')
+    if len(index['offsets']) == 0:
+        return numpy.empty(0), numpy.empty(0)
+    start = index['offsets'][i]
+    end = index['offsets'][j] if j < len(index['offsets']) else index['size']
+    with open(filepath, 'rb') as f:
+        f.seek(start)
+        body = f.read(end - start)
+    f.closed
+
+    values = _parse_csv_body(body, index['ncols'])
+    times = values[:, 0] * _seconds_per_unit(index['units'])
+    inside = (times >= t0) & (times < t1)
+    return times[inside], values[inside, 1]
+
+def seconds_per_sample(duration_seconds, num_samples):
+    '''The average sample spacing uniform integration charges each sample:
+    a log's duration (first to last sample) over its number of positive
+    samples, as counted in PowerMonitorLog.num_samples'''
+    return duration_seconds / float(max(num_samples, 1))
+
+def _read_window_samples(filepath, t0, t1, use_cache):
+    '''Return (times, currents, duration_seconds) of read_window: the
+    samples in the window and the whole log's duration'''
+    if filepath[-4:] == '.pt4':
+        f = pt4.Pt4File(filepath)
+        try:
+            start, stop = numpy.clip(numpy.ceil(numpy.array([t0, t1]) * f.sample_rate),
+                0, f.num_samples).astype(numpy.int64)
+            samples = f.samples(start, stop)
+            duration = f.duration_seconds
+        finally:
+            f.close()
+        return samples['time'], samples['main'].astype(numpy.float64), duration
+    elif filepath[-4:] == '.csv':
+        index = load_csv_index(filepath, use_cache)
+        times, currents = read_csv_window(filepath, t0, t1, index)
+        duration = index['times'][-1] - index['times'][0] if len(index['times']) > 0 else 0
+        return times, currents, duration
+    raise ValueError('unsupported log format (need .pt4 or .csv): %s' % filepath)
+
+def read_window(filepath, t0, t1, use_cache=True, pyramid=None):
+    '''Return (times, currents, seconds_per_sample) of the samples of a log
+    with t0 <= time < t1, without reading the rest of the file: PT4 samples
+    are at fixed offsets, and CSVs are found through their time index
+    (load_csv_index). seconds_per_sample is the whole log's, as
+    PowerMonitorLog integrates it (see seconds_per_sample); the number of
+    positive samples comes from the log's EnvelopePyramid (load_pyramid,
+    which only reads the log if the pyramid isn't cached yet).'''
+    times, currents, duration = _read_window_samples(filepath, t0, t1, use_cache)
+    if pyramid is None:
+        pyramid = load_pyramid(filepath, use_cache)
+    return times, currents, seconds_per_sample(duration, pyramid.num_samples)
+
+def read_log(filepath, use_cache=True):
+    '''Return (times, currents, duration_seconds) for a log (PT4 or CSV),
+    keeping only the positive samples.'''
+    if filepath[-4:] == '.pt4':
+        samples = pt4.read_samples(filepath)
+        times, currents = samples['time'], samples['main'].astype(numpy.float64)
+    elif filepath[-4:] == '.csv':
+        times, currents, units = load_csv_samples(filepath, use_cache)
+    else:
+        raise ValueError('unsupported log format (need .pt4 or .csv): %s' % filepath)
+    duration = times[-1] - times[0] if len(times) > 0 else 0
+    positive = _positive(currents)
+    return times[positive], currents[positive], duration
+
+def baseline_path(filepath):
+    '''Where the baseline log for a power log is: "<name>-baseline.<ext>"'''
+    return '%s-baseline%s' % os.path.splitext(filepath)
+
+def window_stats(times, currents, seconds_per_sample, baseline=0, integration='uniform'):
+    '''Summarize the samples of a time window like a whole log: returns a
+    dict of samples, min, max, mean, median and stddev current (mA), and
+    charge_mC, energy_uAh and above_baseline_energy_uAh. Only positive
+    samples count. Uniform integration charges each sample
+    seconds_per_sample; trapezoid integration uses the timestamps.'''
+    positive = _positive(currents)
+    times, currents = times[positive], currents[positive]
+    n = len(currents)
+    stats = dict(samples=n)
+    if n == 0:
+        for key in ('min', 'max', 'mean', 'median', 'stddev'):
+            stats[key] = numpy.nan
+        stats['charge_mC'] = stats['energy_uAh'] = stats['above_baseline_energy_uAh'] = 0.0
+        return stats
+
+    stats['min'] = numpy.min(currents)
+    stats['max'] = numpy.max(currents)
+    stats['mean'] = numpy.mean(currents)
+    stats['median'] = numpy.median(currents)
+    stats['stddev'] = numpy.std(currents)
+    if integration == 'trapezoid' and n > 1:
+        stats['charge_mC'] = numpy.trapz(currents, times)
+        span = times[-1] - times[0]
+    else:
+        stats['charge_mC'] = numpy.sum(currents, dtype=numpy.float64) * seconds_per_sample
+        span = n * seconds_per_sample
+    stats['energy_uAh'] = stats['charge_mC'] * (10.0/36.0)
+    stats['above_baseline_energy_uAh'] = (stats['charge_mC'] - baseline * span) * (10.0/36.0)
+    return stats
+
+def _pyramid_path(filepath):
+    return filepath + '.pyramid.npz'
+
+class EnvelopePyramid(object):
+    '''Min/max/mean envelopes of a log's current at power-of-two decimation
+    levels: level k has one bucket per 2**(PYRAMID_MIN_LEVEL + k) samples,
+    down to about PYRAMID_MIN_BUCKETS buckets. Each bucket keeps the time of
+    its first sample, the min and max current, and the sum and count of its
+    samples (for the mean).'''
+    def __init__(self, steps, offsets, times, mins, maxs, sums, counts):
+        # level k is [offsets[k], offsets[k+1]) of the bucket arrays
+        self.steps = steps
+        self._offsets = offsets
+        self._times = times
+        self._mins = mins
+        self._maxs = maxs
+        self._sums = sums
+        self._counts = counts
+
+    def _level(self, k):
+        lo, hi = self._offsets[k], self._offsets[k + 1]
+        return self._times[lo:hi], self._mins[lo:hi], self._maxs[lo:hi], \
+            self._sums[lo:hi], self._counts[lo:hi]
+
+    def pick_level(self, t0, t1, width):
+        '''The coarsest level with at least width buckets in [t0, t1), or
+        None if even the finest level has fewer (use the raw samples).'''
+        for k in reversed(range(len(self.steps))):
+            times = self._level(k)[0]
+            lo, hi = numpy.searchsorted(times, (t0, t1))
+            if hi - lo >= width:
+                return k
+        return None
+
+    def _get_num_samples(self):
+        return int(self._counts[self._offsets[0]:self._offsets[1]].sum())
+    num_samples = property(_get_num_samples)
+
+    def envelope(self, k, t0, t1):
+        '''Return (times, mins, maxs, means) of the level k buckets that
+        start in [t0, t1)'''
+        times, mins, maxs, sums, counts = self._level(k)
+        lo, hi = numpy.searchsorted(times, (t0, t1))
+        return times[lo:hi], mins[lo:hi], maxs[lo:hi], sums[lo:hi] / counts[lo:hi]
+
+    def save(self, f, **extra):
+        numpy.savez(f, steps=self.steps, offsets=self._offsets, times=self._times,
+            mins=self._mins, maxs=self._maxs, sums=self._sums, counts=self._counts, **extra)
+
+def build_pyramid(times, currents):
+    '''Build an EnvelopePyramid of a log's samples'''
+    step = 2 ** PYRAMID_MIN_LEVEL
+    starts = numpy.arange(0, len(currents), step)
+    if len(starts) == 0:
+        starts = numpy.zeros(1, dtype=numpy.int64)
+        times = numpy.zeros(1)
+        currents = numpy.full(1, numpy.nan)
+    level = (times[starts],
+        numpy.minimum.reduceat(currents, starts).astype(numpy.float32),
+        numpy.maximum.reduceat(currents, starts).astype(numpy.float32),
+        numpy.add.reduceat(currents, starts, dtype=numpy.float64),
+        numpy.diff(numpy.append(starts, len(currents))).astype(numpy.int32))
+    levels = [level]
+    steps = [step]
+    while len(level[0]) > PYRAMID_MIN_BUCKETS:
+        # merge pairs of buckets
+        pairs = numpy.arange(0, len(level[0]), 2)
+        level = (level[0][pairs],
+            numpy.minimum.reduceat(level[1], pairs),
+            numpy.maximum.reduceat(level[2], pairs),
+            numpy.add.reduceat(level[3], pairs),
+            numpy.add.reduceat(level[4], pairs))
+        levels.append(level)
+        step *= 2
+        steps.append(step)
+
+    offsets = numpy.cumsum([0] + [len(level[0]) for level in levels])
+    return EnvelopePyramid(numpy.array(steps), offsets,
+        *[numpy.concatenate([level[i] for level in levels]) for i in range(5)])
+
+def load_pyramid(filepath, use_cache=True, samples=None):
+    '''Like build_pyramid, but for a log file, keeping the pyramid in a
+    .pyramid.npz sidecar next to it, keyed by the log's size and mtime.
+    samples, if given, are the log's (times, currents) (positive only, as
+    read_log returns them), to save reading the log again.'''
+    st = os.stat(filepath)
+    pyramid_path = _pyramid_path(filepath)
+    if use_cache and os.path.isfile(pyramid_path):
+        try:
+            cached = numpy.load(pyramid_path)
+            if int(cached['version']) == PYRAMID_VERSION and \
+                    int(cached['size']) == st.st_size and \
+                    float(cached['mtime']) == st.st_mtime:
+                logging.debug('Using cached envelope pyramid for %s', filepath)
+                return EnvelopePyramid(cached['steps'], cached['offsets'],
+                    cached['times'], cached['mins'], cached['maxs'],
+                    cached['sums'], cached['counts'])
+        except Exception as e:
+            logging.debug('Ignoring unreadable pyramid %s: %s', pyramid_path, e)
+
+    if samples is None:
+        samples = read_log(filepath, use_cache)[:2]
+    pyramid = build_pyramid(*samples)
+    if use_cache:
+        try:
+            with open(pyramid_path, 'wb') as f:
+                pyramid.save(f, version=PYRAMID_VERSION, size=st.st_size, mtime=st.st_mtime)
+            f.closed
+        except Exception as e:
+            logging.debug('Could not write pyramid %s: %s', pyramid_path, e)
+    return pyramid
+
+def read_envelope(filepath, t0, t1, width, use_cache=True, pyramid=None):
+    '''Return (times, mins, maxs, means) of a log file's current from t0 to
+    t1 seconds, at about width points or more, without loading the whole
+    log: from its EnvelopePyramid (load_pyramid, which only reads the log
+    if the pyramid isn't cached yet), or, zoomed in below the pyramid's
+    finest level, from the raw samples in the window (read_window), as
+    mins, maxs and means.'''
+    if pyramid is None:
+        pyramid = load_pyramid(filepath, use_cache)
+    k = pyramid.pick_level(t0, t1, width)
+    if k is not None:
+        return pyramid.envelope(k, t0, t1)
+    times, currents, _ = _read_window_samples(filepath, t0, t1, use_cache)
+    positive = _positive(currents)
+    return times[positive], currents[positive], currents[positive], currents[positive]
+
+def read_script_log(filepath, run=-1):
+    '''Return (epochs, urls) of the loads in a loadpages.log or
+    loadobjects.log. The scripts append to their logs, so a log may hold
+    several runs (each starts with a "Script Launched" line); run picks one.'''
+    runs = [[]]
+    with open(filepath, 'r') as f:
+        for line in f:
+            fields = line.rstrip('\r\n').split('\t', 1)
+            if len(fields) < 2:
+                continue
+            if fields[1].startswith('=========='):
+                runs.append([])
+                continue
+            try:
+                runs[-1].append((float(fields[0]), fields[1]))
+            except ValueError:
+                continue
+    f.closed
+    runs = [loads for loads in runs if len(loads) > 0]
+    if len(runs) == 0:
+        raise ValueError('no loads in %s' % filepath)
+    loads = runs[run]
+    return numpy.array([epoch for epoch, _ in loads]), [url for _, url in loads]
+
+def find_spike_bursts(times, currents, threshold_mA=None):
+    '''Return (starts, ends), in seconds, of the bursts of high current in a
+    log. Current is smoothed with a SPIKE_SMOOTH_SECONDS moving average; a
+    burst is a run above threshold_mA (default: halfway between the median
+    and the 99.9th percentile), with runs under SPIKE_MERGE_SECONDS apart
+    merged.'''
+    if len(times) < 2:
+        return numpy.empty(0), numpy.empty(0)
+    sample_seconds = numpy.median(numpy.diff(times))
+    window = max(int(round(SPIKE_SMOOTH_SECONDS / sample_seconds)), 1) if sample_seconds > 0 else 1
+    window = min(window, len(currents))
+    cumulative = numpy.concatenate(([0.0], numpy.cumsum(currents, dtype=numpy.float64)))
+    smoothed = (cumulative[window:] - cumulative[:-window]) / window
+    centers = times[window // 2:window // 2 + len(smoothed)]
+
+    if threshold_mA is None:
+        level = numpy.median(smoothed)
+        threshold_mA = level + (numpy.percentile(smoothed, 99.9) - level) / 2.0
+    active = numpy.concatenate(([0], (smoothed > threshold_mA).astype(numpy.int8), [0]))
+    edges = numpy.diff(active)
+    starts = centers[numpy.flatnonzero(edges == 1)]
+    ends = centers[numpy.flatnonzero(edges == -1) - 1]
+    if len(starts) == 0:
+        return starts, ends
+
+    separate = starts[1:] - ends[:-1] >= SPIKE_MERGE_SECONDS
+    return numpy.concatenate((starts[:1], starts[1:][separate])), \
+        numpy.concatenate((ends[:-1][separate], ends[-1:]))
+
+def summarize_segments(segments):
+    '''Per-URL means of segmented loads. Returns (urls, loads, mean
+    duration, mean above-baseline energy in uAh), in order of first load.'''
+    urls, first, codes = numpy.unique(segments['url'], return_index=True, return_inverse=True)
+    loads = numpy.bincount(codes)
+    durations = numpy.bincount(codes, weights=segments['duration']) / loads
+    energies = numpy.bincount(codes, weights=segments['above_baseline_energy_uAh']) / loads
+    order = numpy.argsort(first)
+    return urls[order], loads[order], durations[order], energies[order]
+
+def _positive(currents):
+    '''Mask of samples with a positive current (NaN, i.e., missing, is not)'''
+    with numpy.errstate(invalid='ignore'):
+        return currents > 0
+
+
+class RunningStats(object):
+    '''Summary statistics of current samples, accumulated chunk by chunk in
+    bounded memory. The median comes from a histogram with bins of width
+    2*median_error_mA, so it is within median_error_mA of the exact value.'''
+    def __init__(self, median_error_mA=DEFAULT_MEDIAN_ERROR_MA):
+        self.median_error_mA = median_error_mA
+        self._bin_width = 2.0 * median_error_mA
+        self._bin_counts = numpy.zeros(0, dtype=numpy.int64)
+        self.count = 0
+        self.sum = 0.0
+        self.min = numpy.inf
+        self.max = -numpy.inf
+        self._mean = 0.0
+        self._m2 = 0.0   # sum of squared deviations from the mean
+        self.trapz_mC = 0.0
+        self.first_time = None
+        self.last_time = None
+        self._last_current = None
+
+    def add(self, times, currents):
+        '''Fold in a chunk of samples; times may be None'''
+        n = len(currents)
+        if n == 0:
+            return
+
+        # combine mean and variance with the chunk's (Chan et al.)
+        chunk_mean = numpy.mean(currents)
+        chunk_m2 = numpy.sum(numpy.square(currents - chunk_mean))
+        delta = chunk_mean - self._mean
+        total = self.count + n
+        self._mean += delta * n / float(total)
+        self._m2 += chunk_m2 + delta * delta * self.count * n / float(total)
+        self.count = total
+        self.sum += numpy.sum(currents, dtype=numpy.float64)
+        self.min = min(self.min, numpy.min(currents))
+        self.max = max(self.max, numpy.max(currents))
+
+        bins = numpy.bincount((currents / self._bin_width).astype(numpy.int64))
+        if len(bins) > len(self._bin_counts):
+            bins[:len(self._bin_counts)] += self._bin_counts
+            self._bin_counts = bins
+        else:
+            self._bin_counts[:len(bins)] += bins
+
+        if times is not None:
+            # integrate across the seam with the previous chunk, too
+            if self.last_time is not None:
+                times = numpy.concatenate(([self.last_time], times))
+                currents = numpy.concatenate(([self._last_current], currents))
+            else:
+                self.first_time = times[0]
+            self.trapz_mC += numpy.trapz(currents, times)
+            self.last_time = times[-1]
+            self._last_current = currents[-1]
+
+    def _get_mean(self):
+        return self._mean
+    mean = property(_get_mean)
+
+    def _get_stddev(self):
+        return numpy.sqrt(self._m2 / self.count)
+    stddev = property(_get_stddev)
+
+    def _get_median(self):
+        # midpoint of the bin(s) holding the middle sample(s)
+        cumulative = numpy.cumsum(self._bin_counts)
+        lo = numpy.searchsorted(cumulative, (self.count - 1) // 2, side='right')
+        hi = numpy.searchsorted(cumulative, self.count // 2, side='right')
+        median = (lo + hi + 1) / 2.0 * self._bin_width
+        return min(max(median, self.min), self.max)
+    median = property(_get_median)
+
+class CsvTail(object):
+    '''Reads a power monitor CSV that is still being written, returning only
+    the complete rows added since the last read.'''
     def __init__(self, filepath):
+        self.filepath = filepath
+        self._offset = 0
+        self._units = self._ncols = None
+
+    def read(self):
+        '''Return (times, currents) of the rows appended since the last call'''
+        size = os.path.getsize(self.filepath)
+        if size < self._offset:
+            logging.warn('%s shrank; reading it from the start', self.filepath)
+            self._offset = 0
+            self._units = self._ncols = None
+        with open(self.filepath, 'rb') as f:
+            f.seek(self._offset)
+            data = f.read(size - self._offset)
+        f.closed
+
+        # leave a partly written last row for next time
+        end = data.rfind('\n') + 1
+        data = data[:end]
+        self._offset += end
+        if self._ncols is None and end > 0:
+            header, data = data.split('\n', 1)
+            self._units, self._ncols = _parse_csv_header(header)
+        if len(data) == 0:
+            return numpy.empty(0), numpy.empty(0)
+        values = _parse_csv_body(data, self._ncols)
+        return values[:, 0] * _seconds_per_unit(self._units), values[:, 1].copy()
+
+def follow_log(filepath, interval=DEFAULT_FOLLOW_INTERVAL, baseline=0,
+               median_error_mA=DEFAULT_MEDIAN_ERROR_MA, idle_timeout=None):
+    '''Follow a CSV log as it is written: every interval seconds, fold the
+    new rows into running statistics (see RunningStats) and, if there were
+    any, yield a summary dict: samples, seconds (of log), mean, median
+    (within median_error_mA), min and max current for the whole log so far,
+    recent_samples and recent_mean/recent_min/recent_max for just the new
+    rows (to watch the baseline drift), and energy_uAh and
+    above_baseline_energy_uAh (uniform integration, as PowerMonitorLog
+    does). Each read costs in proportion to the new rows, not the file.
+    Stops once the log hasn't grown for idle_timeout seconds (if given).'''
+    tail = CsvTail(filepath)
+    running = RunningStats(median_error_mA)
+    first = last = None
+    last_growth = time.time()
+    while True:
+        times, currents = tail.read()
+        if len(times) > 0:
+            last_growth = time.time()
+            if first is None:
+                first = times[0]
+            last = times[-1]
+            positive = _positive(currents)
+            currents = currents[positive]
+            running.add(times[positive], currents)
+            if running.count > 0 and len(currents) > 0:
+                seconds = last - first
+                charge_mC = running.sum * seconds / float(running.count)
+                yield dict(samples=running.count, seconds=seconds,
+                    mean=running.mean, median=running.median,
+                    min=running.min, max=running.max,
+                    recent_samples=len(currents), recent_mean=numpy.mean(currents),
+                    recent_min=numpy.min(currents), recent_max=numpy.max(currents),
+                    energy_uAh=charge_mC * (10.0/36.0),
+                    above_baseline_energy_uAh=(charge_mC - baseline * seconds) * (10.0/36.0))
+        elif idle_timeout is not None and time.time() - last_growth > idle_timeout:
+            logging.info('%s stopped growing', filepath)
+            return
+        time.sleep(interval)
+
+
+class PowerMonitorLog(object):
+    def __init__(self, filepath, integration='uniform', use_cache=True,
+                 streaming=False, chunk_samples=DEFAULT_CHUNK_SAMPLES,
+                 median_error_mA=DEFAULT_MEDIAN_ERROR_MA):
+        '''integration is 'uniform' (assume evenly spaced samples spanning
+        the log's duration) or 'trapezoid' (integrate over the samples' real
+        timestamps; falls back to uniform if the log has none). If use_cache,
+        parsed CSVs are saved to (and reloaded from) a .npz sidecar file.
+
+        If streaming, the log is read chunk_samples at a time and samples are
+        not kept in memory; the median (and baseline) is then approximate,
+        within median_error_mA of the exact value.'''
         self.filename = os.path.split(filepath)[1]
+        self._filepath = filepath
+        self._integration = integration
+        self._use_cache = use_cache
+        self._chunk_samples = chunk_samples
+        self._median_error_mA = median_error_mA
+        self._stats = None
+        self._running = None
+        self._num_samples = None
+        self._segments = {}  # segment() arguments -> result
+        self._pyramid = None
 
         # read current samples from file
-        self._currents = self._get_currents_as_array(filepath)
-        self._duration_seconds = self._read_duration(filepath)
+        if streaming:
+            self._times = self._currents = None
+            self._running, self._duration_seconds = self._stream_log(filepath)
+        else:
+            self._times, self._currents, self._duration_seconds = self._read_log(filepath)
 
         # look for a file named "<filepath>-baseline.csv"; if it exists, take
         # the median current in this file as the baseline
-        fields = os.path.splitext(filepath)
-        baseline_file = '%s-baseline%s' % fields
+        baseline_file = baseline_path(filepath)
         if os.path.isfile(baseline_file):
-            baseline_currents = self._get_currents_as_array(baseline_file)
-            self._baseline = numpy.median(baseline_currents)
+            if streaming:
+                self._baseline = self._stream_log(baseline_file)[0].median
+            else:
+                _, baseline_currents, _ = self._read_log(baseline_file)
+                self._baseline = numpy.median(baseline_currents)
         else:
             self._baseline = 0
 
         
 
-    def _get_currents_as_array(self, filepath):
-        currents = []
-        for current in self._read_currents(filepath):
-            if current > 0:
-                currents.append(current)
-        return numpy.array(currents)
-
-    def _read_currents(self, filepath):
-        if filepath[-4:] == '.pt4':
-            for smpl in Pt4FileReader.readAsVector(filepath):
-                yield smpl[2].mainCurrent
-        elif filepath[-4:] == '.csv':
-            with open(filepath, 'r') as f:
-                for line in f:
-                    try:
-                        current = float(line.split(',')[1])
-                    except:
-                        continue
-                    yield current
-            f.closed
+    def _read_log(self, filepath):
+        return read_log(filepath, self._use_cache)
 
-    def _read_duration(self, filepath):
+    def _stream_log(self, filepath):
+        '''Like _read_log, but folds the positive samples into a RunningStats
+        chunk by chunk. Returns (RunningStats, duration_seconds).'''
+        running = RunningStats(self._median_error_mA)
         if filepath[-4:] == '.pt4':
-            logging.warn('Time from PT4 file not supported')
-            return -1
+            chunks = iter_pt4_chunks(filepath, self._chunk_samples)
         elif filepath[-4:] == '.csv':
-            # get first timestamp
-            with open(filepath, 'r') as f:
-                count = 0
-                for line in f:
-                    if count == 0:
-                        units = line.split('(')[1].split(')')[0]
-                    elif count == 1:
-                        first = float(line.split(',')[0])
-                    else:
-                        break
-                    count += 1
-            f.closed
-
-            # get last timestamp
-            lastline = last_line(filepath)
-            last = float(lastline.split(',')[0])
+            chunks = iter_csv_chunks(filepath, self._chunk_samples)
+        else:
+            raise ValueError('unsupported log format (need .pt4 or .csv): %s' % filepath)
 
-            # adjust to seconds
-            if units == 'min':
-                duration = (last-first)*60
-            else:
-                duration = last-first
+        first = last = None
+        for times, currents in chunks:
+            positive = _positive(currents)
+            if times is not None and len(times) > 0:
+                if first is None:
+                    first = times[0]
+                last = times[-1]
+                times = times[positive]
+            running.add(times, currents[positive])
 
-            return duration
-        
+        duration = last - first if first is not None else 0
+        return running, duration
 
 
     def _get_num_samples(self):
+        if self._running is not None:
+            return self._running.count
+        if self._currents is None:
+            return self._num_samples
         return len(self._currents)
     num_samples = property(_get_num_samples)
 
+    def _get_seconds_per_sample(self):
+        return seconds_per_sample(self.duration_seconds, self.num_samples)
+    seconds_per_sample = property(_get_seconds_per_sample)
+
     def _get_baseline(self):
         return self._baseline
     baseline = property(_get_baseline)
     
+    def _summarize(self):
+        '''Compute all summary statistics in one go and cache them'''
+        if self._stats is not None:
+            return self._stats
+
+        stats = {}
+        if self._running is not None:
+            running = self._running
+            stats['min'] = running.min
+            stats['max'] = running.max
+            stats['sum'] = running.sum
+            stats['mean'] = running.mean
+            stats['stddev'] = running.stddev
+            stats['median'] = running.median
+            have_times = running.first_time is not None
+        else:
+            currents = self._currents
+            stats['min'] = numpy.min(currents)
+            stats['max'] = numpy.max(currents)
+            stats['sum'] = numpy.sum(currents, dtype=numpy.float64)
+            stats['mean'] = stats['sum'] / len(currents)
+            stats['stddev'] = numpy.std(currents)
+            stats['median'] = numpy.median(currents)
+            have_times = self._times is not None
+
+        # charge (mA*s) for zero baseline; a constant baseline b removes
+        # b * (time spanned), so other baselines don't need another pass
+        if self._integration == 'trapezoid' and have_times and self.num_samples > 1:
+            if self._running is not None:
+                stats['charge_mC'] = self._running.trapz_mC
+                stats['span_seconds'] = self._running.last_time - self._running.first_time
+            else:
+                stats['charge_mC'] = numpy.trapz(self._currents, self._times)
+                stats['span_seconds'] = self._times[-1] - self._times[0]
+        else:
+            if self._integration == 'trapezoid':
+                logging.warn('No sample timestamps in %s; assuming uniform spacing', self.filename)
+            stats['charge_mC'] = stats['sum'] * self.seconds_per_sample
+            stats['span_seconds'] = self.duration_seconds
+
+        self._stats = stats
+        return stats
+
     def _get_min_current(self):
-        return numpy.min(self._currents)
+        return self._summarize()['min']
     min_current = property(_get_min_current)
     
     def _get_max_current(self):
-        return numpy.max(self._currents)
+        return self._summarize()['max']
     max_current = property(_get_max_current)
 
     def _get_mean_current(self):
-        return numpy.mean(self._currents)
+        return self._summarize()['mean']
     mean_current = property(_get_mean_current)
     
     def _get_median_current(self):
-        return numpy.median(self._currents)
+        return self._summarize()['median']
     median_current = property(_get_median_current)
     
     def _get_stddev_current(self):
-        return numpy.std(self._currents)
+        return self._summarize()['stddev']
     stddev_current = property(_get_stddev_current)
 
+    def _get_median_error_mA(self):
+        # bound on |median_current - exact median|
+        return self._median_error_mA if self._running is not None else 0
+    median_error_mA = property(_get_median_error_mA)
+
     def _get_duration_seconds(self):
         return self._duration_seconds
     duration_seconds = property(_get_duration_seconds)
 
     def _get_energy_uAh(self, baseline=0):
         # charge = current * time
-        seconds_per_sample = self.duration_seconds / float(self.num_samples)
-        total_charge_mC = 0
-        for current in self._currents:
-            total_charge_mC += ((current-baseline) * seconds_per_sample)
+        stats = self._summarize()
+        total_charge_mC = stats['charge_mC'] - baseline * stats['span_seconds']
 
         # 1 mC = 10^4/3600 * 10^-7 Ah
         #      = 10^4/3600 * 10^-7 * 10^6 uAh 
@@ -144,6 +859,122 @@ class PowerMonitorLog(object):
         return self._get_energy_uAh(self.baseline)
     above_baseline_energy_uAh = property(_get_above_baseline_energy_uAh)
 
+    def segment(self, script_log, run=-1, threshold_mA=None):
+        '''Split the log into the loads listed in a loadpages.log or
+        loadobjects.log (see read_script_log) and return one SEGMENT_DTYPE
+        row per load.
+
+        The signal_spikes bursts at either end of the run are found in the
+        current samples (find_spike_bursts). The first load starts
+        SPIKE_PAUSE_SECONDS + SCRIPT_GAP_SECONDS after the end of the
+        opening bookend, and script timestamps are offset to match; each
+        load lasts until the next one starts, and the last until
+        SCRIPT_GAP_SECONDS before the closing bookend. A warning is logged
+        if that leaves the last load a duration more than
+        SPAN_TOLERANCE_SECONDS off the median load's, i.e., the bookends
+        and the script log's span disagree. Charge is integrated like the
+        whole-log totals (uniform sample spacing). Script timestamps are
+        whole seconds, so each boundary may be off by up to
+        SCRIPT_LOG_RESOLUTION_SECONDS; a warning is logged if any load is
+        shorter than SHORT_SEGMENT_SECONDS.
+
+        Results are remembered, so a compact()ed log can still return
+        segments computed before it dropped its samples.'''
+        key = (script_log, run, threshold_mA)
+        if key in self._segments:
+            return self._segments[key]
+        if self._currents is None:
+            raise ValueError('segmenting %s needs its samples; don\'t stream or compact it' % self.filename)
+        epochs, urls = read_script_log(script_log, run)
+        times, currents = self._times, self._currents
+
+        starts, ends = find_spike_bursts(times, currents, threshold_mA)
+        if len(starts) < 2 * SPIKE_BURSTS:
+            raise ValueError('found %i current spikes in %s; need %i at each end' %
+                (len(starts), self.filename, SPIKE_BURSTS))
+        loads_start = ends[SPIKE_BURSTS - 1] + SPIKE_PAUSE_SECONDS + SCRIPT_GAP_SECONDS
+        loads_end = starts[-SPIKE_BURSTS] - SCRIPT_GAP_SECONDS
+
+        bounds = numpy.append(epochs - epochs[0] + loads_start, loads_end)
+        if bounds[-2] >= loads_end:
+            logging.warn('%s runs past the end of %s; are they from the same run?',
+                script_log, self.filename)
+            bounds[-1] = bounds[-2]
+        elif len(epochs) > 1:
+            typical = numpy.median(numpy.diff(epochs))
+            if abs(loads_end - bounds[-2] - typical) > SPAN_TOLERANCE_SECONDS:
+                logging.warn('the bookends in %s leave the last load of %s %.1f s, but loads typically take %.1f s; are they from the same run?',
+                    self.filename, script_log, loads_end - bounds[-2], typical)
+
+        # samples [idx[k], idx[k+1]) belong to load k
+        idx = numpy.searchsorted(times, bounds)
+        counts = numpy.diff(idx)
+        sums = numpy.add.reduceat(numpy.append(currents, 0), idx)[:-1]
+        sums[counts == 0] = 0
+
+        segments = numpy.zeros(len(urls), dtype=SEGMENT_DTYPE)
+        trials = {}
+        for i, url in enumerate(urls):
+            segments['url'][i] = url
+            segments['trial'][i] = trials.get(url, 0)
+            trials[url] = segments['trial'][i] + 1
+        segments['start'] = bounds[:-1]
+        segments['duration'] = numpy.diff(bounds)
+        segments['samples'] = counts
+        segments['charge_mC'] = sums * self.seconds_per_sample
+        segments['energy_uAh'] = segments['charge_mC'] * (10.0/36.0)
+        segments['above_baseline_energy_uAh'] = \
+            (segments['charge_mC'] - self.baseline * segments['duration']) * (10.0/36.0)
+        short = numpy.sum(segments['duration'] < SHORT_SEGMENT_SECONDS)
+        if short > 0:
+            logging.warn('%i of %i loads in %s last under %g seconds; %s has whole-second timestamps, so their start and end may each be off by up to %g s, shifting energy between neighboring loads',
+                short, len(urls), self.filename, SHORT_SEGMENT_SECONDS, script_log,
+                SCRIPT_LOG_RESOLUTION_SECONDS)
+        self._segments[key] = segments
+        return segments
+
+    def window(self, t0, t1):
+        '''Current and energy statistics (see window_stats) of the samples
+        with t0 <= time < t1, in seconds of the log's own timestamps. Uses
+        the samples in memory if the log has them; otherwise (streamed or
+        compact()ed) reads just that window from the file (see
+        read_window).'''
+        if self._currents is not None:
+            lo, hi = numpy.searchsorted(self._times, (t0, t1))
+            times, currents = self._times[lo:hi], self._currents[lo:hi]
+        else:
+            times, currents, _ = _read_window_samples(self._filepath, t0, t1, self._use_cache)
+        return window_stats(times, currents, self.seconds_per_sample,
+            self.baseline, self._integration)
+
+    def envelope(self, t0, t1, width):
+        '''Return (times, mins, maxs, means) of the current from t0 to t1
+        seconds, at about width points or more (e.g., pixels across a plot):
+        from the coarsest level of the log's EnvelopePyramid (built on first
+        use, and saved next to the log if use_cache) with at least width
+        buckets in the range, or the raw samples (as mins, maxs and means)
+        if there are too few. See read_envelope to do the same without
+        loading the log.'''
+        if self._pyramid is None:
+            samples = (self._times, self._currents) if self._currents is not None else None
+            self._pyramid = load_pyramid(self._filepath, self._use_cache, samples)
+        if self._currents is None or self._pyramid.pick_level(t0, t1, width) is not None:
+            return read_envelope(self._filepath, t0, t1, width, self._use_cache, self._pyramid)
+
+        lo, hi = numpy.searchsorted(self._times, (t0, t1))
+        times, currents = self._times[lo:hi], self._currents[lo:hi]
+        return times, currents, currents, currents
+
+    def compact(self):
+        '''Compute the summary statistics, then drop the samples (all
+        properties keep working; only new segment() calls don't). Returns
+        self.'''
+        self._summarize()
+        if self._currents is not None:
+            self._num_samples = len(self._currents)
+        self._times = self._currents = None
+        return self
+
     def __repr__(self):
         return self.__str__()
 
@@ -157,23 +988,125 @@ class PowerMonitorLog(object):
         s += '\n  Max:\t\t%f mA' % self.max_current
         s += '\n  Mean:\t\t%f mA' % self.mean_current
         s += '\n  Median:\t%f mA' % self.median_current
+        if self.median_error_mA > 0:
+            s += ' (+/- %f mA)' % self.median_error_mA
 
         return s
 
 
 
-def main():
-    
+def _load_log(job):
+    path, kwargs, segment_args, keep_samples = job
+    log = PowerMonitorLog(path, **kwargs)
+    if segment_args is not None:
+        log.segment(*segment_args)
+    return log if keep_samples else log.compact()
+
+def load_many(paths, keep_samples=False, segment_args=None, processes=None, **kwargs):
+    '''Load several logs in parallel, one per process, and return their
+    PowerMonitorLogs in the order of paths. kwargs are passed to
+    PowerMonitorLog. Unless keep_samples, logs come back compact()ed, so only
+    their summaries cross between processes; segment_args maps a path to the
+    arguments of a segment() call to make before that.'''
+    segment_args = segment_args or {}
+    jobs = [(path, kwargs, segment_args.get(path), keep_samples) for path in paths]
+    if len(jobs) <= 1 or processes == 1:
+        return map(_load_log, jobs)
+
+    pool = Pool(processes or min(len(jobs), cpu_count()))
+    try:
+        return pool.map_async(_load_log, jobs).get(0xFFFF)
+    finally:
+        pool.close()
+        pool.join()
+
+
+def print_windows():
+    '''Summarize --window of each log, reading only that part of it'''
+    t0, t1 = args.window
     for logfile in args.logs:
-        log = PowerMonitorLog(logfile)
+        baseline = 0
+        if os.path.isfile(baseline_path(logfile)):
+            _, currents, _ = _read_window_samples(baseline_path(logfile), -numpy.inf, numpy.inf,
+                not args.no_cache)
+            baseline = numpy.median(currents[_positive(currents)])
+        times, currents, seconds_per_sample = read_window(logfile, t0, t1, not args.no_cache)
+        stats = window_stats(times, currents, seconds_per_sample, baseline, args.integration)
+        print '========== %s [%f, %f) ==========' % (os.path.split(logfile)[1], t0, t1)
+        print '%i samples' % stats['samples']
+        print 'ENERGY\n  W/o Baseline:\t%f uAh\n  Total:\t%f uAh' % \
+            (stats['above_baseline_energy_uAh'], stats['energy_uAh'])
+        print 'CURRENT\n  Baseline:\t%f mA' % baseline
+        print '  Min:\t\t%f mA\n  Max:\t\t%f mA' % (stats['min'], stats['max'])
+        print '  Mean:\t\t%f mA\n  Median:\t%f mA' % (stats['mean'], stats['median'])
+
+def print_follow():
+    '''Print running summaries of a log as it is written (--follow)'''
+    if len(args.logs) != 1 or args.logs[0][-4:] != '.csv':
+        logging.error('--follow takes one CSV log')
+        sys.exit(-1)
+    logfile = args.logs[0]
+    baseline = 0
+    if os.path.isfile(baseline_path(logfile)):
+        _, currents, _ = read_log(baseline_path(logfile), not args.no_cache)
+        baseline = numpy.median(currents)
+    try:
+        for stats in follow_log(logfile, args.interval, baseline, args.median_error,
+                args.idle_timeout):
+            print '%10.1f s  %9i samples  mean %8.3f mA  median %8.3f mA  ' \
+                'recent mean %8.3f mA  recent min %8.3f mA  energy %10.3f uAh (%10.3f above baseline)' % \
+                (stats['seconds'], stats['samples'], stats['mean'], stats['median'],
+                stats['recent_mean'], stats['recent_min'], stats['energy_uAh'],
+                stats['above_baseline_energy_uAh'])
+            sys.stdout.flush()
+    except KeyboardInterrupt:
+        pass
+
+def main():
+    if args.follow:
+        print_follow()
+        return
+    if args.window:
+        print_windows()
+        return
+
+    segment_args = None
+    if args.segment:
+        segment_args = dict((logfile, (args.segment, args.run, args.threshold))
+            for logfile in args.logs)
+    logs = load_many(args.logs, segment_args=segment_args, processes=args.processes,
+        integration=args.integration, use_cache=not args.no_cache,
+        streaming=args.stream, chunk_samples=args.chunk_samples,
+        median_error_mA=args.median_error)
+
+    for log in logs:
         print log
 
+        if args.segment:
+            segments = log.segment(args.segment, args.run, args.threshold)
+            print 'LOADS (%s)' % args.segment
+            for url, loads, seconds, energy in zip(*summarize_segments(segments)):
+                print '  %s\t%i loads\t%f s\t%f uAh' % (url, loads, seconds, energy)
+
 
 if __name__ == "__main__":
     # set up command line args
     parser = argparse.ArgumentParser(formatter_class=argparse.ArgumentDefaultsHelpFormatter,\
                                      description='Analyze power monitor logs.')
     parser.add_argument('logs', nargs='+', help='Power monitor file(s) to analyze (PT4 or CSV).')
+    parser.add_argument('-i', '--integration', choices=['uniform', 'trapezoid'], default='uniform', help='How to integrate current over time: assume evenly spaced samples, or use the samples\' timestamps.')
+    parser.add_argument('--no_cache', action='store_true', default=False, help='Don\'t read or write .cache.npz sidecar files of parsed CSV samples.')
+    parser.add_argument('--stream', action='store_true', default=False, help='Read logs in fixed-size chunks in bounded memory (median is approximate).')
+    parser.add_argument('--chunk_samples', type=int, default=DEFAULT_CHUNK_SAMPLES, help='Samples per chunk in --stream mode.')
+    parser.add_argument('--median_error', type=float, default=DEFAULT_MEDIAN_ERROR_MA, help='Maximum error (mA) of the median in --stream mode.')
+    parser.add_argument('-j', '--processes', type=int, help='Number of logs to load at once. Defaults to one per CPU.')
+    parser.add_argument('-s', '--segment', help='loadpages.log or loadobjects.log of the run the log(s) recorded; report energy and duration per URL. Its timestamps are whole seconds, so each load\'s boundaries are only good to about a second; short loads (under %i seconds) are flagged.' % SHORT_SEGMENT_SECONDS)
+    parser.add_argument('--run', type=int, default=-1, help='Which run in the --segment log to use (0 is the first; negative counts from the end).')
+    parser.add_argument('--threshold', type=float, help='Current (mA) above which the signal_spikes bursts are detected (--segment). Defaults to halfway between the median and peak.')
+    parser.add_argument('-w', '--window', nargs=2, type=float, metavar=('T0', 'T1'), help='Only summarize the samples from T0 to T1 seconds into each log, reading just that part of the file (through a .index.npz time index for CSVs).')
+    parser.add_argument('-f', '--follow', action='store_true', default=False, help='Follow a CSV log while it is being written, printing running statistics and energy every --interval seconds (until interrupted).')
+    parser.add_argument('--interval', type=float, default=DEFAULT_FOLLOW_INTERVAL, help='Seconds between summaries in --follow mode.')
+    parser.add_argument('--idle_timeout', type=float, help='In --follow mode, stop once the log hasn\'t grown for this many seconds.')
     parser.add_argument('-q', '--quiet', action='store_true', default=False, help='only print errors')
     parser.add_argument('-v', '--verbose', action='store_true', default=False, help='print debug info. --quiet wins if both are present')
     args = parser.parse_args()
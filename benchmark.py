@@ -0,0 +1,269 @@
+#! /usr/bin/env python
+
+'''Time the analysis stages on synthetic inputs of increasing size.
+
+Inputs come from synthetic.py, so runs are repeatable and need no device.
+Each stage runs --repeat times at each scale; the timings (and the commit,
+Python and NumPy versions they were taken with) are written as JSON, and a
+previous run's JSON can be given with --compare to print speedups.
+'''
+
+import os
+import time
+import json
+import glob
+import shutil
+import logging
+import argparse
+import platform
+import tempfile
+import subprocess
+import numpy
+
+import probe
+import analyze
+import synthetic
+from pcap import PcapTrace
+from analyze import PowerMonitorLog
+from functools import partial
+from results import RESULTS_FILE, TRACE_CACHE_FILE, ResultStore
+from completion import FixedWait
+from transport import SimulatedTransport
+
+# synthetic input sizes at scale 1
+TRACE_FLOWS = 20
+TRACE_FLOW_BYTES = 200000
+CAMPAIGN_TRACES = 8
+COMPARE_URLS = 50
+COMPARE_TRIALS = 10
+SIM_DEVICES = 50
+SIM_URLS = 10
+SIM_TRIALS = 5
+POWER_RATE = 5000
+POWER_SECONDS = 60
+
+
+def _trace(workdir, scale):
+    path = os.path.join(workdir, 'trace-%i.pcap' % scale)
+    packets = synthetic.write_pcap(path, num_flows=TRACE_FLOWS * scale,
+        bytes_per_flow=TRACE_FLOW_BYTES, seed=scale)
+    return path, packets
+
+def _campaign(workdir, scale):
+    tracedir = os.path.join(workdir, 'traces-%i' % scale)
+    os.makedirs(tracedir)
+    for i in range(CAMPAIGN_TRACES * scale):
+        synthetic.write_pcap(os.path.join(tracedir, 'page%i.com-0.pcap' % i),
+            num_flows=TRACE_FLOWS, bytes_per_flow=TRACE_FLOW_BYTES, seed=i)
+    return tracedir
+
+def _result_store(workdir, scale, name, seed):
+    rng = numpy.random.RandomState(seed)
+    path = os.path.join(workdir, '%s-%i.sqlite' % (name, scale))
+    rows = [('page%i.com' % url, trial, rng.lognormal(1, 0.5), int(rng.lognormal(13, 1)), None)
+        for url in range(COMPARE_URLS * scale) for trial in range(COMPARE_TRIALS)]
+    store = ResultStore(path)
+    store.replace_campaign(name, rows)
+    store.close()
+    return path, len(rows)
+
+
+def bench_pcap(workdir, scale):
+    path, packets = _trace(workdir, scale)
+    return (lambda: PcapTrace(path).total_bytes), packets, 'packets'
+
+def bench_analyze_trace(workdir, scale):
+    path, packets = _trace(workdir, scale)
+    return (lambda: probe.analyze_trace(path)), packets, 'packets'
+
+def bench_analyze_traces(workdir, scale):
+    tracedir = _campaign(workdir, scale)
+    traces = glob.glob(os.path.join(tracedir, '*.pcap'))
+    def run():
+        # from scratch: no cached results
+        for name in (TRACE_CACHE_FILE, RESULTS_FILE):
+            if os.path.exists(os.path.join(tracedir, name)):
+                os.remove(os.path.join(tracedir, name))
+        probe.args.tracedir = tracedir
+        probe.analyze_traces(traces, 'bench')
+    return run, len(traces), 'traces'
+
+def bench_analyze_traces_cached(workdir, scale):
+    tracedir = _campaign(workdir, scale)
+    traces = glob.glob(os.path.join(tracedir, '*.pcap'))
+    probe.args.tracedir = tracedir
+    probe.analyze_traces(traces, 'bench')
+    def run():
+        probe.args.tracedir = tracedir
+        probe.analyze_traces(traces, 'bench')
+    return run, len(traces), 'traces'
+
+def bench_compare_results(workdir, scale):
+    first, first_rows = _result_store(workdir, scale, 'first', seed=scale)
+    second, second_rows = _result_store(workdir, scale, 'second', seed=scale + 1000)
+    return (lambda: probe.compare_results([first, second])), first_rows + second_rows, 'rows'
+
+def bench_campaign_sim(workdir, scale):
+    # scheduler and per-trial overhead: virtual devices whose operations
+    # and page loads take no time
+    devices = ['sim-%i' % i for i in range(SIM_DEVICES * scale)]
+    urls = ['http://page%i.com/' % i for i in range(SIM_URLS * scale)]
+    os.makedirs(os.path.join(workdir, 'traces'))
+    transport_class = partial(SimulatedTransport, latency=0)
+    def run():
+        probe.args.outdir = workdir
+        probe.run_campaign(urls, devices, SIM_TRIALS, detector=FixedWait(0),
+            transport_class=transport_class)
+    return run, len(urls) * SIM_TRIALS, 'trials'
+
+def _power_csv(workdir, scale):
+    path = os.path.join(workdir, 'power-%i.csv' % scale)
+    samples = synthetic.write_power_csv(path, rate=POWER_RATE,
+        seconds=POWER_SECONDS * scale, seed=scale)
+    return path, samples
+
+def bench_power_csv(workdir, scale):
+    path, samples = _power_csv(workdir, scale)
+    return (lambda: PowerMonitorLog(path, use_cache=False).above_baseline_energy_uAh), \
+        samples, 'samples'
+
+def bench_power_csv_cached(workdir, scale):
+    path, samples = _power_csv(workdir, scale)
+    PowerMonitorLog(path)  # writes the cache
+    return (lambda: PowerMonitorLog(path).above_baseline_energy_uAh), samples, 'samples'
+
+def bench_power_csv_stream(workdir, scale):
+    path, samples = _power_csv(workdir, scale)
+    return (lambda: PowerMonitorLog(path, streaming=True).above_baseline_energy_uAh), \
+        samples, 'samples'
+
+def bench_power_csv_window(workdir, scale):
+    path, samples = _power_csv(workdir, scale)
+    analyze.load_csv_index(path)  # writes the index
+    analyze.load_pyramid(path)  # and the pyramid read_window counts samples with
+    # a 10-second window in the middle of the log
+    t0 = POWER_SECONDS * scale / 2.0
+    return (lambda: analyze.read_window(path, t0, t0 + 10)), samples, 'samples'
+
+def bench_power_envelope(workdir, scale):
+    path, samples = _power_csv(workdir, scale)
+    log = PowerMonitorLog(path)
+    log.envelope(0, numpy.inf, 1)  # builds the pyramid
+    return (lambda: log.envelope(0, numpy.inf, 2000)), samples, 'samples'
+
+def bench_power_pt4(workdir, scale):
+    path = os.path.join(workdir, 'power-%i.pt4' % scale)
+    samples = synthetic.write_power_pt4(path, rate=POWER_RATE,
+        seconds=POWER_SECONDS * scale, seed=scale)
+    return (lambda: PowerMonitorLog(path).above_baseline_energy_uAh), samples, 'samples'
+
+# name -> setup(workdir, scale) returning (function to time, input size, unit)
+STAGES = [
+    ('pcap', bench_pcap),
+    ('analyze_trace', bench_analyze_trace),
+    ('analyze_traces', bench_analyze_traces),
+    ('analyze_traces_cached', bench_analyze_traces_cached),
+    ('compare_results', bench_compare_results),
+    ('campaign_sim', bench_campaign_sim),
+    ('power_csv', bench_power_csv),
+    ('power_csv_cached', bench_power_csv_cached),
+    ('power_csv_stream', bench_power_csv_stream),
+    ('power_csv_window', bench_power_csv_window),
+    ('power_envelope', bench_power_envelope),
+    ('power_pt4', bench_power_pt4),
+]
+
+
+def _git_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', 'HEAD'],
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+            stderr=open(os.devnull, 'w')).strip()
+    except Exception:
+        return None
+
+def run_benchmarks(stages, scales, repeat, workdir):
+    '''Time each stage at each scale; returns a list of result dicts'''
+    results = []
+    for name, setup in STAGES:
+        if name not in stages:
+            continue
+        for scale in scales:
+            stagedir = os.path.join(workdir, '%s-%i' % (name, scale))
+            os.makedirs(stagedir)
+            fn, size, unit = setup(stagedir, scale)
+            seconds = []
+            for _ in range(repeat):
+                start = time.time()
+                fn()
+                seconds.append(time.time() - start)
+            result = dict(stage=name, scale=scale, size=size, unit=unit,
+                seconds=seconds, best=min(seconds), median=float(numpy.median(seconds)))
+            logging.info('%-22s scale %-3i %9i %-8s best %8.4f s  (%.0f %s/s)', name, scale,
+                size, unit, result['best'], size / max(result['best'], 1e-9), unit)
+            results.append(result)
+    return results
+
+def compare(results, baseline):
+    '''Log each result's speedup over the same stage and scale in baseline'''
+    before = dict(((r['stage'], r['scale']), r) for r in baseline['results'])
+    for result in results:
+        old = before.get((result['stage'], result['scale']))
+        if old is None:
+            continue
+        logging.info('%-22s scale %-3i %8.4f s -> %8.4f s  (%.2fx)', result['stage'],
+            result['scale'], old['best'], result['best'], old['best'] / max(result['best'], 1e-9))
+
+
+def main():
+    workdir = tempfile.mkdtemp(prefix='probe-benchmark-', dir=args.workdir)
+    # probe's analysis functions read their directories from its args
+    probe.args = argparse.Namespace(tracedir=None, outdir=os.path.join(workdir, 'plots'))
+    os.makedirs(probe.args.outdir)
+    try:
+        results = run_benchmarks(args.stages, args.scales, args.repeat, workdir)
+    finally:
+        if not args.workdir:
+            shutil.rmtree(workdir)
+
+    report = dict(commit=_git_commit(), time=time.time(),
+        python=platform.python_version(), numpy=numpy.__version__,
+        machine=platform.platform(), repeat=args.repeat, results=results)
+    with open(args.output, 'w') as f:
+        json.dump(report, f, indent=1, sort_keys=True)
+    f.closed
+    logging.info('Wrote %s', args.output)
+
+    if args.compare:
+        with open(args.compare, 'r') as f:
+            compare(results, json.load(f))
+        f.closed
+
+
+if __name__ == "__main__":
+    # set up command line args
+    parser = argparse.ArgumentParser(formatter_class=argparse.ArgumentDefaultsHelpFormatter,\
+                                     description='Benchmark trace and power log analysis on synthetic inputs.')
+    parser.add_argument('-s', '--stages', nargs='+', choices=[name for name, _ in STAGES], default=[name for name, _ in STAGES], help='Stages to time.')
+    parser.add_argument('--scales', nargs='+', type=int, default=[1, 2, 4], help='Input size multipliers.')
+    parser.add_argument('-n', '--repeat', default=3, type=int, help='Times to run each stage at each scale.')
+    parser.add_argument('-o', '--output', default='benchmark.json', help='Where to write the results (JSON).')
+    parser.add_argument('-c', '--compare', help='Results of an earlier run (JSON) to compare against.')
+    parser.add_argument('-w', '--workdir', help='Keep the generated inputs in a new directory under this one (by default they go in a temporary directory that is removed).')
+    parser.add_argument('-q', '--quiet', action='store_true', default=False, help='only print errors')
+    parser.add_argument('-v', '--verbose', action='store_true', default=False, help='print debug info. --quiet wins if both are present')
+    args = parser.parse_args()
+
+    # set up logging
+    if args.quiet:
+        level = logging.WARNING
+    elif args.verbose:
+        level = logging.DEBUG
+    else:
+        level = logging.INFO
+    logging.basicConfig(
+        format = "%(levelname) -10s %(asctime)s %(module)s:%(lineno) -7s %(message)s",
+        level = level
+    )
+
+    main()
@@ -0,0 +1,135 @@
+#! /usr/bin/env python
+
+'''Packet capture on the phone.
+
+Each capture mode records one trial's traffic with tcpdump on the phone and
+leaves the finished trace at a path on the host:
+
+  pull:   tcpdump writes to the phone's flash; the trace is pulled and removed
+          once capture stops
+  stream: tcpdump writes to stdout, which "adb exec-out" streams straight
+          into the host trace file; nothing is stored on the phone
+
+Either mode can keep only the first snaplen bytes of each packet. Analysis
+only needs timestamps and headers (byte counts come from the original wire
+length and IP lengths), so HEADERS_SNAPLEN makes traces much smaller at no
+cost in accuracy.
+'''
+
+import os
+import time
+import logging
+import subprocess
+
+from adb import ADB, get_session
+
+TCPDUMP = '/data/local/tmp/tcpdump_armv7'   # location of tcpdump binary on phone
+REMOTE_TRACEDIR = '/data/local/tmp/traces'  # temp dir on phone for storing pcap traces
+INTERFACE = 'rmnet0'
+CAPTURE_FILTER = 'port 80 or port 443 or port 10750'
+# link, IP and TCP headers (with options) and the first payload byte, which
+# flows.py reads to spot TLS records
+HEADERS_SNAPLEN = 128
+
+
+def tcpdump_command(output, snaplen=None):
+    '''tcpdump command line (to run as root) writing packets to output,
+    truncated to snaplen bytes if given'''
+    snap = '-s %i ' % snaplen if snaplen else ''
+    return '%s -i %s %s-U -w %s %s' % (TCPDUMP, INTERFACE, snap, output, CAPTURE_FILTER)
+
+def kill_tcpdump(device):
+    get_session(device).run('su -c "killall %s" || true' % os.path.basename(TCPDUMP))
+
+
+class PulledCapture(object):
+    name = 'pull'
+
+    def __init__(self, device, trace_file, adb=ADB, snaplen=None):
+        self.device = device
+        self.trace_file = trace_file
+        self.remote_trace_file = os.path.join(REMOTE_TRACEDIR, os.path.basename(trace_file))
+        self._adb = adb
+        self._snaplen = snaplen
+
+    def start(self):
+        # run in the background of the device's shell session
+        get_session(self.device).run('mkdir -p %s && { su -c "%s" > /dev/null 2>&1 & }' %
+            (REMOTE_TRACEDIR, tcpdump_command(self.remote_trace_file, self._snaplen)))
+
+    def captured_bytes(self):
+        '''Bytes captured so far, or None if unknown'''
+        try:
+            output = get_session(self.device).run('stat -c %%s %s' % self.remote_trace_file)
+            return int(output.split()[-1])
+        except Exception:
+            return None
+
+    def stop(self):
+        kill_tcpdump(self.device)
+
+    def fetch(self):
+        '''Copy the trace to the host and remove it from the phone'''
+        cmd = '%s -s %s pull %s %s' % (self._adb, self.device, self.remote_trace_file, self.trace_file)
+        logging.debug(cmd)
+        subprocess.check_output(cmd.split())
+        get_session(self.device).run('rm %s' % self.remote_trace_file)
+
+    def discard(self):
+        get_session(self.device).run('rm -f %s' % self.remote_trace_file)
+
+
+class StreamedCapture(object):
+    name = 'stream'
+
+    def __init__(self, device, trace_file, adb=ADB, snaplen=None):
+        self.device = device
+        self.trace_file = trace_file
+        self._adb = adb
+        self._snaplen = snaplen
+        self._out = None
+        self._proc = None
+
+    def start(self):
+        cmd = self._adb.split() + ['-s', self.device, 'exec-out',
+            'su -c "%s" 2>/dev/null' % tcpdump_command('-', self._snaplen)]
+        logging.debug(' '.join(cmd))
+        self._out = open(self.trace_file, 'wb')
+        self._proc = subprocess.Popen(cmd, stdout=self._out)
+
+    def captured_bytes(self):
+        try:
+            return os.path.getsize(self.trace_file)
+        except OSError:
+            return None
+
+    def stop(self, timeout=5):
+        '''Stop tcpdump and wait for the stream to drain into the trace file'''
+        try:
+            kill_tcpdump(self.device)
+        finally:
+            if self._proc is not None:
+                deadline = time.time() + timeout
+                while self._proc.poll() is None and time.time() < deadline:
+                    time.sleep(0.05)
+                if self._proc.poll() is None:
+                    logging.warn('[%s] adb exec-out did not exit; killing it', self.device)
+                    self._proc.kill()
+                    self._proc.wait()
+            if self._out is not None:
+                self._out.close()
+
+    def fetch(self):
+        # the trace is already on the host
+        if not os.path.isfile(self.trace_file) or os.path.getsize(self.trace_file) == 0:
+            raise IOError('no packets streamed to %s' % self.trace_file)
+
+    def discard(self):
+        if os.path.isfile(self.trace_file):
+            os.remove(self.trace_file)
+
+
+CAPTURES = {
+    PulledCapture.name: PulledCapture,
+    StreamedCapture.name: StreamedCapture,
+}
@@ -0,0 +1,75 @@
+#! /usr/bin/env python
+
+'''Decide when a page load is complete.
+
+A detector's wait() blocks until the page is considered loaded and returns the
+condition that ended the wait (one of the *_REASON constants), so trials can
+record why they stopped.
+'''
+
+import time
+import logging
+
+FIXED_REASON = 'fixed'      # waited a fixed amount of time
+IDLE_REASON = 'idle'        # network went quiet
+TIMEOUT_REASON = 'timeout'  # hit the hard timeout first
+
+
+class FixedWait(object):
+    '''Wait a fixed number of seconds (the probe's original behavior)'''
+    name = 'fixed'
+
+    def __init__(self, seconds=15):
+        self.seconds = seconds
+
+    def wait(self, captured_bytes=None):
+        time.sleep(self.seconds)
+        return FIXED_REASON
+
+
+class NetworkQuiescence(object):
+    '''Wait until the capture has grown by less than idle_rate bytes/second
+    over the last idle_seconds. Never stops before min_wait seconds and always
+    stops after timeout seconds.'''
+    name = 'network'
+
+    def __init__(self, min_wait=3, idle_seconds=2, idle_rate=0, timeout=30,
+                 poll_interval=0.5):
+        self.min_wait = min_wait
+        self.idle_seconds = idle_seconds
+        self.idle_rate = idle_rate
+        self.timeout = timeout
+        self.poll_interval = poll_interval
+
+    def wait(self, captured_bytes):
+        '''captured_bytes() returns the number of bytes captured so far (or
+        None if it can't be read right now)'''
+        start = time.time()
+        history = []  # (time, bytes) samples, oldest first
+        while True:
+            now = time.time()
+            elapsed = now - start
+            if elapsed >= self.timeout:
+                return TIMEOUT_REASON
+
+            n = captured_bytes()
+            if n is not None:
+                history.append((now, n))
+                while len(history) > 1 and now - history[1][0] >= self.idle_seconds:
+                    history.pop(0)
+
+            if elapsed >= self.min_wait and len(history) > 1:
+                window_start, window_bytes = history[0]
+                window = now - window_start
+                if window >= self.idle_seconds and \
+                        (history[-1][1] - window_bytes) <= self.idle_rate * window:
+                    logging.debug('Network idle after %.1f seconds', elapsed)
+                    return IDLE_REASON
+
+            time.sleep(self.poll_interval)
+
+
+DETECTORS = {
+    FixedWait.name: FixedWait,
+    NetworkQuiescence.name: NetworkQuiescence,
+}
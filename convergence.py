@@ -0,0 +1,96 @@
+#! /usr/bin/env python
+
+'''Decide when a URL has been loaded enough times.
+
+Instead of a fixed number of trials per URL, keep loading a URL until the
+bootstrap confidence intervals of its page load time and its byte count are
+narrow enough, relative to their means (never fewer than min_trials loads,
+never more than max_trials).
+'''
+
+import logging
+import threading
+import numpy
+
+DEFAULT_RESAMPLES = 2000
+
+
+def bootstrap_ci(samples, confidence=0.95, resamples=DEFAULT_RESAMPLES, rng=numpy.random):
+    '''Percentile bootstrap confidence interval (low, high) of the mean of
+    samples. All resamples are drawn and averaged as one NumPy array.'''
+    samples = numpy.asarray(samples, dtype=numpy.float64)
+    picks = rng.randint(0, len(samples), size=(resamples, len(samples)))
+    means = samples[picks].mean(axis=1)
+    tail = (1.0 - confidence) / 2 * 100
+    low, high = numpy.percentile(means, [tail, 100 - tail])
+    return low, high
+
+def relative_ci_width(samples, confidence=0.95, resamples=DEFAULT_RESAMPLES, rng=numpy.random):
+    '''Width of the bootstrap CI of the mean, as a fraction of the mean'''
+    mean = numpy.mean(samples)
+    if mean == 0:
+        return 0.0 if numpy.all(numpy.asarray(samples) == 0) else numpy.inf
+    low, high = bootstrap_ci(samples, confidence, resamples, rng)
+    return (high - low) / abs(mean)
+
+
+class ConvergenceTracker(object):
+    '''Hands out trial numbers for each URL until its PLT and byte CIs are
+    within target_width (relative) or max_trials have been issued. Safe to
+    use from several scheduler threads.'''
+    def __init__(self, min_trials=5, max_trials=30, target_width=0.1,
+                 confidence=0.95, resamples=DEFAULT_RESAMPLES, seed=None):
+        self.min_trials = min_trials
+        self.max_trials = max_trials
+        self.target_width = target_width
+        self.confidence = confidence
+        self.resamples = resamples
+        self._rng = numpy.random.RandomState(seed)
+        self._lock = threading.Lock()
+        self._issued = {}       # url -> number of trials handed out
+        self._outstanding = {}  # url -> trials handed out but not finished
+        self._samples = {}      # url -> list of (plt, bytes)
+        self.widths = {}        # url -> (plt width, bytes width) at last check
+
+    def start(self, url):
+        '''Return the first batch of (url, trial) jobs for url'''
+        with self._lock:
+            self._issued[url] = self.min_trials
+            self._outstanding[url] = self.min_trials
+            self._samples[url] = []
+        return [(url, i) for i in range(0, self.min_trials)]
+
+    def _converged(self, url):
+        samples = self._samples[url]
+        if len(samples) < max(self.min_trials, 2):
+            return False
+        plts, sizes = numpy.array(samples, dtype=numpy.float64).T
+        self.widths[url] = (
+            relative_ci_width(plts, self.confidence, self.resamples, self._rng),
+            relative_ci_width(sizes, self.confidence, self.resamples, self._rng))
+        return max(self.widths[url]) <= self.target_width
+
+    def finish(self, url, trial, result=None):
+        '''Note that a trial of url is done; result is its (plt, bytes), or
+        None if it failed. Returns the (url, trial) jobs to run next.'''
+        with self._lock:
+            self._outstanding[url] -= 1
+            if result is not None:
+                self._samples[url].append(result)
+
+            # wait for the rest of a batch before judging the URL
+            if self._outstanding[url] > 0:
+                return []
+            if self._converged(url):
+                logging.info('%s converged after %i trials (PLT CI %.1f%%, bytes CI %.1f%% of mean)',
+                    url, len(self._samples[url]), self.widths[url][0] * 100,
+                    self.widths[url][1] * 100)
+                return []
+            if self._issued[url] >= self.max_trials:
+                logging.info('%s did not converge in %i trials', url, self.max_trials)
+                return []
+
+            trial = self._issued[url]
+            self._issued[url] += 1
+            self._outstanding[url] += 1
+            return [(url, trial)]
@@ -0,0 +1,304 @@
+#! /usr/bin/env python
+
+'''Per-flow breakdown of a page-load trace.
+
+One pass over a trace's packets builds a flow table -- one row per TCP
+connection or UDP exchange, keyed by (protocol, client address and port,
+server address and port) -- with its bytes in each direction and the timing of
+its phases:
+
+  dns:       UDP port 53 query to first response
+  handshake: client SYN to server SYN/ACK
+  tls:       ClientHello to the client's first TLS application data record
+  ttfb:      client's first request bytes (first application data record, for
+             TLS) to the server's first payload bytes after it
+
+Headers are decoded with NumPy over all packets at once, straight from the
+memory-mapped trace (see pcap.PcapTrace), so no packet becomes a Python
+object. Payload lengths come from the IP header, which makes byte counts
+independent of the capture's snap length; TLS timing needs the first payload
+byte of each segment and is NaN when it wasn't captured.
+'''
+
+import socket
+import numpy
+
+from pcap import PcapTrace
+
+TCP = 6
+UDP = 17
+
+DNS_PORT = 53
+TLS_PORT = 443
+PROXY_PORT = 10750  # compression proxy
+SERVER_PORTS = (DNS_PORT, 80, TLS_PORT, PROXY_PORT)
+
+# TCP flags
+SYN = 0x02
+ACK = 0x10
+
+# TLS record content types
+TLS_HANDSHAKE = 0x16
+TLS_APPLICATION_DATA = 0x17
+
+# link-layer header length and offset of the ethertype (None: the IP version
+# nibble tells v4 from v6) for each LINKTYPE_* we understand
+LINK_HEADERS = {
+    0: (4, None),       # BSD loopback
+    1: (14, 12),        # Ethernet
+    12: (0, None),      # raw IP (DLT_RAW on some platforms)
+    14: (0, None),      # raw IP (DLT_RAW on others)
+    101: (0, None),     # raw IP
+    108: (4, None),     # OpenBSD loopback
+    113: (16, 14),      # Linux cooked capture
+    276: (20, 0),       # Linux cooked capture v2
+}
+ETHERTYPE_VLAN = 0x8100
+ETHERTYPES_IP = (0x0800, 0x86dd)
+
+FLOW_DTYPE = numpy.dtype([
+    ('proto', 'u1'),        # TCP or UDP
+    ('client_port', 'u2'),
+    ('server', 'S39'),      # server address, as text
+    ('server_port', 'u2'),
+    ('start', 'f8'),        # first packet, seconds since the trace's first
+    ('end', 'f8'),          # last packet, seconds since the trace's first
+    ('packets', 'u4'),
+    ('bytes_up', 'u8'),     # wire bytes, client to server
+    ('bytes_down', 'u8'),   # wire bytes, server to client
+    ('dns', 'f8'),          # phase durations in seconds; NaN if not seen
+    ('handshake', 'f8'),
+    ('tls', 'f8'),
+    ('ttfb', 'f8'),
+])
+
+
+def _u8(data, idx, end):
+    '''Byte at each index, and a mask of which indices were captured'''
+    ok = idx < end
+    return data[numpy.where(ok, idx, 0)].astype(numpy.int64), ok
+
+def _u16(data, idx, end):
+    hi, ok = _u8(data, idx, end - 1)
+    lo, _ = _u8(data, idx + 1, end)
+    return (hi << 8) | lo, ok
+
+def _bytes(data, idx, length, end):
+    '''length bytes starting at each index, as an (n, length) array (zeros
+    where not captured)'''
+    cols = idx[:, None] + numpy.arange(length)
+    ok = cols < end[:, None]
+    return numpy.where(ok, data[numpy.where(ok, cols, 0)], 0).astype(numpy.uint8)
+
+def _first(ids, times, mask, nflows):
+    '''Time of the first masked packet of each flow (NaN if none)'''
+    out = numpy.empty(nflows)
+    out.fill(numpy.inf)
+    numpy.minimum.at(out, ids[mask], times[mask])
+    out[numpy.isinf(out)] = numpy.nan
+    return out
+
+def _address(raw, v4):
+    if v4:
+        return socket.inet_ntoa(raw[12:].tostring())
+    return socket.inet_ntop(socket.AF_INET6, raw.tostring())
+
+
+def decode_packets(trace):
+    '''Decode the IP and TCP/UDP headers of every packet of a PcapTrace
+    opened with keep_data. Returns a dict of per-packet arrays; packets that
+    aren't TCP/UDP over IP have transport False.'''
+    return decode_records(trace.records, trace.data)
+
+def decode_records(records, data):
+    '''Like decode_packets, for record headers (pcap.RECORD_DTYPE) and the
+    bytes of the file they index (e.g., a chunk from pcap.iter_records)'''
+    n = len(records)
+    start = records['offset'].astype(numpy.int64)
+    end = start + records['caplen'].astype(numpy.int64)
+
+    # link layer
+    l3 = numpy.empty(n, dtype=numpy.int64)
+    l3.fill(-1)
+    for linktype in numpy.unique(records['linktype']):
+        if linktype not in LINK_HEADERS:
+            continue
+        mask = records['linktype'] == linktype
+        length, type_offset = LINK_HEADERS[linktype]
+        l3[mask] = start[mask] + length
+        if type_offset is not None:
+            ethertype, _ = _u16(data, start + type_offset, end)
+            if linktype == 1:
+                vlan = mask & (ethertype == ETHERTYPE_VLAN)
+                l3[vlan] += 4
+                ethertype[vlan], _ = _u16(data, start[vlan] + 16, end[vlan])
+            l3[mask & ~numpy.in1d(ethertype, ETHERTYPES_IP)] = -1
+    linked = l3 >= 0
+    l3 = numpy.where(linked, l3, start)
+
+    # network layer
+    first, ok = _u8(data, l3, end)
+    version = numpy.where(linked & ok, first >> 4, 0)
+    v4 = version == 4
+    v6 = version == 6
+    ihl = (first & 0xf) * 4
+    v4_len, _ = _u16(data, l3 + 2, end)
+    v6_len, _ = _u16(data, l3 + 4, end)
+    v4_proto, _ = _u8(data, l3 + 9, end)
+    v6_proto, _ = _u8(data, l3 + 6, end)   # extension headers aren't followed
+    proto = numpy.where(v4, v4_proto, numpy.where(v6, v6_proto, 0))
+    l4 = l3 + numpy.where(v4, ihl, 40)
+    l4_len = numpy.where(v4, v4_len - ihl, v6_len)
+
+    # addresses as 16 bytes each; IPv4 as IPv4-mapped IPv6
+    src = _bytes(data, l3 + 8, 16, end)
+    dst = _bytes(data, l3 + 24, 16, end)
+    mapped = numpy.zeros((int(v4.sum()), 16), dtype=numpy.uint8)
+    mapped[:, 10:12] = 0xff
+    mapped[:, 12:] = _bytes(data, l3[v4] + 12, 4, end[v4])
+    src[v4] = mapped
+    mapped[:, 12:] = _bytes(data, l3[v4] + 16, 4, end[v4])
+    dst[v4] = mapped
+
+    # transport layer
+    tcp = proto == TCP
+    udp = proto == UDP
+    sport, ok = _u16(data, l4, end)
+    dport, ok2 = _u16(data, l4 + 2, end)
+    transport = (v4 | v6) & (tcp | udp) & ok & ok2
+    doff, _ = _u8(data, l4 + 12, end)
+    flags, _ = _u8(data, l4 + 13, end)
+    header_len = numpy.where(tcp, (doff >> 4) * 4, 8)
+    payload = numpy.maximum(l4_len - header_len, 0)
+    payload_first, payload_captured = _u8(data, l4 + header_len, end)
+
+    return dict(time=records['timestamp'],
+        wirelen=records['wirelen'].astype(numpy.int64),
+        transport=transport, v4=v4, proto=proto, src=src, dst=dst,
+        sport=sport, dport=dport, flags=numpy.where(tcp, flags, 0),
+        payload=payload, payload_first=numpy.where(payload_captured, payload_first, -1))
+
+
+def is_downstream(sport, dport):
+    '''Mask of packets sent by the server: the server is the end on a
+    well-known port (or else the lower port)'''
+    src_known = numpy.in1d(sport, SERVER_PORTS)
+    dst_known = numpy.in1d(dport, SERVER_PORTS)
+    return src_known & ~dst_known | (src_known == dst_known) & (sport < dport)
+
+def flow_table(packets):
+    '''Build the flow table (a FLOW_DTYPE array, in order of first packet)
+    from decode_packets output'''
+    keep = packets['transport']
+    time = packets['time'][keep]
+    n = len(time)
+    if n == 0:
+        return numpy.empty(0, dtype=FLOW_DTYPE)
+    t0 = packets['time'][0]
+    wirelen = packets['wirelen'][keep]
+    proto = packets['proto'][keep]
+    src, dst = packets['src'][keep], packets['dst'][keep]
+    sport, dport = packets['sport'][keep], packets['dport'][keep]
+    flags = packets['flags'][keep]
+    payload = packets['payload'][keep]
+    payload_first = packets['payload_first'][keep]
+    v4 = packets['v4'][keep]
+
+    down = is_downstream(sport, dport)
+    up = ~down
+    client = numpy.where(down[:, None], dst, src)
+    server = numpy.where(down[:, None], src, dst)
+    client_port = numpy.where(down, dport, sport)
+    server_port = numpy.where(down, sport, dport)
+
+    # flow key: proto, client address and port, server address and port
+    key = numpy.empty((n, 37), dtype=numpy.uint8)
+    key[:, 0] = proto
+    key[:, 1:17] = client
+    key[:, 17] = client_port >> 8
+    key[:, 18] = client_port & 0xff
+    key[:, 19:35] = server
+    key[:, 35] = server_port >> 8
+    key[:, 36] = server_port & 0xff
+    key = numpy.ascontiguousarray(key).view(numpy.dtype((numpy.void, 37))).ravel()
+    _, index, ids = numpy.unique(key, return_index=True, return_inverse=True)
+
+    # number flows in order of their first packet
+    order = numpy.argsort(index, kind='mergesort')
+    rank = numpy.empty(len(order), dtype=numpy.int64)
+    rank[order] = numpy.arange(len(order))
+    ids = rank[ids]
+    index = index[order]
+    nflows = len(index)
+
+    flows = numpy.zeros(nflows, dtype=FLOW_DTYPE)
+    flows['proto'] = proto[index]
+    flows['client_port'] = client_port[index]
+    flows['server_port'] = server_port[index]
+    flows['server'] = [_address(server[i], v4[i]) for i in index]
+    flows['start'] = _first(ids, time, numpy.ones(n, dtype=bool), nflows) - t0
+    flows['end'] = -_first(ids, -time, numpy.ones(n, dtype=bool), nflows) - t0
+    flows['packets'] = numpy.bincount(ids, minlength=nflows)
+    flows['bytes_up'] = numpy.bincount(ids, weights=wirelen * up, minlength=nflows)
+    flows['bytes_down'] = numpy.bincount(ids, weights=wirelen * down, minlength=nflows)
+
+    is_tcp = proto == TCP
+    has_payload = payload > 0
+
+    # DNS: first query to first response
+    dns = (proto == UDP) & (server_port == DNS_PORT)
+    flows['dns'] = _first(ids, time, dns & down, nflows) - _first(ids, time, dns & up, nflows)
+
+    # TCP handshake: SYN to SYN/ACK
+    syn = _first(ids, time, is_tcp & up & (flags & (SYN | ACK) == SYN), nflows)
+    synack = _first(ids, time, is_tcp & down & (flags & (SYN | ACK) == (SYN | ACK)), nflows)
+    flows['handshake'] = synack - syn
+
+    # TLS: ClientHello to first application data
+    hello = _first(ids, time, is_tcp & up & has_payload & (payload_first == TLS_HANDSHAKE), nflows)
+    appdata = _first(ids, time, is_tcp & up & has_payload & (payload_first == TLS_APPLICATION_DATA), nflows)
+    tls = ~numpy.isnan(hello)
+    flows['tls'] = appdata - hello
+
+    # TTFB: request to first response bytes
+    request = numpy.where(tls, appdata, _first(ids, time, is_tcp & up & has_payload, nflows))
+    after = is_tcp & down & has_payload & (time >= numpy.nan_to_num(request[ids])) & \
+        ~numpy.isnan(request[ids])
+    flows['ttfb'] = _first(ids, time, after, nflows) - request
+    return flows
+
+
+def summarize_flows(flows, total_bytes):
+    '''Per-page breakdown of a trace, as a dict, from its flow table'''
+    def median(values):
+        values = values[~numpy.isnan(values)]
+        return float(numpy.median(values)) if len(values) > 0 else None
+
+    tcp = flows[flows['proto'] == TCP]
+    dns = flows[(flows['proto'] == UDP) & (flows['server_port'] == DNS_PORT)]
+    dns_times = dns['dns'][~numpy.isnan(dns['dns'])]
+    proxy = flows['server_port'] == PROXY_PORT
+    proxy_bytes = int(flows['bytes_up'][proxy].sum() + flows['bytes_down'][proxy].sum())
+    return dict(
+        connections=len(tcp),
+        tls_connections=int((~numpy.isnan(tcp['tls'])).sum()),
+        dns_queries=len(dns),
+        dns_seconds=float(dns_times.sum()) if len(dns_times) > 0 else None,
+        handshake_seconds=median(tcp['handshake']),
+        tls_seconds=median(tcp['tls']),
+        ttfb_seconds=median(tcp['ttfb']),
+        proxy_bytes=proxy_bytes,
+        proxy_share=float(proxy_bytes) / total_bytes if total_bytes > 0 else None,
+    )
+
+
+def analyze_flows(filepath):
+    '''Return (duration seconds, total bytes, per-page summary, flow table)
+    for a trace, reading it once'''
+    trace = PcapTrace(filepath, keep_data=True)
+    try:
+        flows = flow_table(decode_packets(trace))
+        seconds, total_bytes = trace.duration_seconds, trace.total_bytes
+    finally:
+        trace.close()
+    return seconds, total_bytes, summarize_flows(flows, total_bytes), flows
@@ -0,0 +1,104 @@
+#! /usr/bin/env python
+
+'''Crash-safe record of a campaign's trials.
+
+The journal is the trace directory's trials.jsonl: each attempt at a (url,
+trial) appends its trial record (see timing.py) as one JSON line, and the
+line is fsync'd -- after the trace itself -- before the next trial can count
+on it, so a campaign cut short by a crash, reboot or lost adb connection
+knows exactly which trials it has. The latest line for a trial wins; each
+attempt names its own trace, so no attempt overwrites another's. A line torn
+by a crash mid-write is ignored.
+'''
+
+import os
+import json
+import logging
+import threading
+
+
+def fsync_path(path):
+    '''Flush a file (or directory) that is already written to disk'''
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+class CampaignJournal(object):
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._latest = {}    # (url, trial) -> latest record
+        self._attempts = {}  # (url, trial) -> number of records
+        self._torn = False   # the last line was cut off mid-write
+        if os.path.exists(path):
+            self._read()
+        else:
+            open(path, 'a').close()
+            # make the new journal's directory entry durable too
+            fsync_path(os.path.dirname(os.path.abspath(path)))
+
+    def _read(self):
+        with open(self.path, 'r') as f:
+            lines = f.read().split('\n')
+        f.closed
+        # a complete journal ends with a newline, leaving '' last
+        self._torn = lines[-1] != ''
+        for i, line in enumerate(lines):
+            if line.strip() == '':
+                continue
+            try:
+                self._add(json.loads(line))
+            except (ValueError, KeyError, TypeError):
+                logging.warn('Ignoring unreadable line %i of %s', i + 1, self.path)
+
+    def _add(self, record):
+        job = (record['url'], record['trial'])
+        self._latest[job] = record
+        self._attempts[job] = self._attempts.get(job, 0) + 1
+
+    def _trace_path(self, record):
+        if record.get('trace') is None:
+            return None
+        return os.path.join(os.path.dirname(self.path), record['trace'])
+
+    def record(self, record):
+        '''Append a trial record (TrialTimer.record). If it succeeded, its
+        trace (named relative to the journal's directory) is flushed to disk
+        before the journal says it exists.'''
+        trace = self._trace_path(record)
+        if record['outcome'] == 'ok' and trace is not None:
+            fsync_path(trace)
+        line = json.dumps(record, sort_keys=True) + '\n'
+        with self._lock:
+            with open(self.path, 'a') as f:
+                if self._torn:
+                    # start a new line after a crash's partial one
+                    f.write('\n')
+                f.write(line)
+                f.flush()
+                os.fsync(f.fileno())
+            f.closed
+            self._torn = False
+            self._add(record)
+
+    def attempts(self, url, trial):
+        '''How many attempts at a trial the journal lists'''
+        with self._lock:
+            return self._attempts.get((url, trial), 0)
+
+    def trace(self, url, trial):
+        '''The path of the trace of a trial's latest attempt, if it succeeded'''
+        with self._lock:
+            record = self._latest.get((url, trial))
+        if record is None or record['outcome'] != 'ok':
+            return None
+        return self._trace_path(record)
+
+    def _get_completed(self):
+        with self._lock:
+            return set(job for job, record in self._latest.iteritems()
+                if record['outcome'] == 'ok')
+    completed = property(_get_completed)
@@ -3,9 +3,14 @@ TCPDUMP=/data/local/tmp/tcpdump_armv7
 # start tcpdump. 
 # 	$1 = interface
 # 	$2 = the output pcap file path
+# 	$3 = (optional) bytes to keep per packet, e.g., 128 for headers only
 start_tcpdump()
 {
-	su -c "$TCPDUMP -i $1 -w $2" &
+	if [ -n "$3" ]; then
+		su -c "$TCPDUMP -i $1 -s $3 -w $2" &
+	else
+		su -c "$TCPDUMP -i $1 -w $2" &
+	fi
 }
 
 # stop tcpdump
@@ -10,6 +10,7 @@ IFACE="rmnet0"
 MOBILE=0
 PAUSE_AFTER=0
 CLOSE_AFTER=0
+SNAPLEN=""
 VIMEO=0
 
 
@@ -20,7 +21,7 @@ setup()
 {
 	local OPTARG=$2
 
-	while getopts "vmi:p:c:" opt; do
+	while getopts "vmi:p:c:s:" opt; do
 		case $opt in
 			v)
 				VIMEO=1
@@ -37,6 +38,9 @@ setup()
 			c)
 				CLOSE_AFTER=$OPTARG
 				;;
+			s)
+				SNAPLEN=$OPTARG
+				;;
 			\?)
 				printf "\nInvalid option: -$OPTARG\n" >&2
 				help
@@ -73,7 +77,7 @@ su -c "rm -rf /data/data/com.android.chrome/cache"  # clear Chrome cache
 su -c "rm -rf /data/data/com.android.chrome/files"  # close Chrome tabs
 
 # Start tcpdump
-start_tcpdump $IFACE $PCAP
+start_tcpdump $IFACE $PCAP $SNAPLEN
 
 # Load page
 echo -e `date +%s`"\t$URL" >> $LOG
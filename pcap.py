@@ -0,0 +1,274 @@
+#! /usr/bin/env python
+
+'''In-process reader for pcap and pcapng traces.
+
+Only record headers are decoded; packet payloads stay in the memory-mapped
+file and are addressed by offset. Records are returned as NumPy structured
+arrays (see RECORD_DTYPE) so per-trace statistics never touch a Python object
+per packet.
+'''
+
+import os
+import mmap
+import struct
+import logging
+import numpy
+
+# classic pcap magic numbers (as read little-endian)
+PCAP_MAGIC_USEC = 0xa1b2c3d4
+PCAP_MAGIC_NSEC = 0xa1b23c4d
+PCAP_MAGIC_USEC_SWAPPED = 0xd4c3b2a1
+PCAP_MAGIC_NSEC_SWAPPED = 0x4d3cb2a1
+
+# pcapng block types
+PCAPNG_SHB = 0x0a0d0d0a
+PCAPNG_IDB = 0x00000001
+PCAPNG_PB = 0x00000002   # obsolete packet block
+PCAPNG_SPB = 0x00000003
+PCAPNG_EPB = 0x00000006
+PCAPNG_BYTE_ORDER_MAGIC = 0x1a2b3c4d
+
+PCAP_GLOBAL_HEADER_LEN = 24
+PCAP_RECORD_HEADER_LEN = 16
+
+RECORD_DTYPE = numpy.dtype([
+    ('timestamp', 'f8'),    # seconds since the epoch
+    ('caplen', 'u4'),       # bytes stored in the file
+    ('wirelen', 'u4'),      # original length of the packet on the wire
+    ('offset', 'u8'),       # file offset of the first packet byte
+    ('linktype', 'u2'),     # LINKTYPE_* of the capturing interface
+])
+
+DEFAULT_CHUNK_RECORDS = 65536
+
+
+class PcapError(Exception):
+    pass
+
+
+def _open_mmap(filepath):
+    '''Return (file, mmap) for filepath, or (file, None) if it is empty'''
+    f = open(filepath, 'rb')
+    if os.fstat(f.fileno()).st_size == 0:
+        return f, None
+    return f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+
+def _iter_pcap_records(buf, chunk_records):
+    size = len(buf)
+    if size < PCAP_GLOBAL_HEADER_LEN:
+        raise PcapError('truncated pcap global header')
+
+    magic = struct.unpack_from('<I', buf, 0)[0]
+    if magic in (PCAP_MAGIC_USEC, PCAP_MAGIC_NSEC):
+        endian = '<'
+    elif magic in (PCAP_MAGIC_USEC_SWAPPED, PCAP_MAGIC_NSEC_SWAPPED):
+        endian = '>'
+    else:
+        raise PcapError('unrecognized magic number 0x%08x' % magic)
+    ts_scale = 1e-9 if magic in (PCAP_MAGIC_NSEC, PCAP_MAGIC_NSEC_SWAPPED) else 1e-6
+    linktype = struct.unpack_from(endian + 'I', buf, 20)[0] & 0xffff
+
+    header = struct.Struct(endian + 'IIII')
+    chunk = numpy.empty(chunk_records, dtype=RECORD_DTYPE)
+    n = 0
+    pos = PCAP_GLOBAL_HEADER_LEN
+    while pos + PCAP_RECORD_HEADER_LEN <= size:
+        sec, frac, caplen, wirelen = header.unpack_from(buf, pos)
+        pos += PCAP_RECORD_HEADER_LEN
+        if pos + caplen > size:
+            # tcpdump was killed mid-write; tshark drops this record too
+            logging.debug('Ignoring truncated final record at offset %i', pos)
+            break
+        chunk[n] = (sec + frac * ts_scale, caplen, wirelen, pos, linktype)
+        n += 1
+        pos += caplen
+        if n == chunk_records:
+            yield chunk
+            chunk = numpy.empty(chunk_records, dtype=RECORD_DTYPE)
+            n = 0
+    if n > 0:
+        yield chunk[:n]
+
+
+def _if_tsresol(buf, endian, pos, end):
+    '''Parse the if_tsresol option of an IDB; return seconds per tick'''
+    while pos + 4 <= end:
+        code, length = struct.unpack_from(endian + 'HH', buf, pos)
+        pos += 4
+        if code == 0:   # opt_endofopt
+            break
+        if code == 9 and length >= 1:
+            value = ord(buf[pos:pos+1])
+            if value & 0x80:
+                return 2.0 ** -(value & 0x7f)
+            return 10.0 ** -value
+        pos += (length + 3) & ~3
+    return 1e-6
+
+
+def _iter_pcapng_records(buf, chunk_records):
+    size = len(buf)
+    chunk = numpy.empty(chunk_records, dtype=RECORD_DTYPE)
+    n = 0
+    pos = 0
+    endian = '<'
+    interfaces = []  # (linktype, seconds per tick) for each IDB in section
+    while pos + 12 <= size:
+        block_type = struct.unpack_from(endian + 'I', buf, pos)[0]
+        if block_type == PCAPNG_SHB:
+            # byte order is only known once the SHB's magic is read
+            bom = struct.unpack_from('<I', buf, pos + 8)[0]
+            if bom == PCAPNG_BYTE_ORDER_MAGIC:
+                endian = '<'
+            elif bom == 0x4d3c2b1a:
+                endian = '>'
+            else:
+                raise PcapError('bad pcapng byte-order magic 0x%08x' % bom)
+            interfaces = []
+        block_len = struct.unpack_from(endian + 'I', buf, pos + 4)[0]
+        if block_len < 12 or pos + block_len > size:
+            logging.debug('Ignoring truncated final block at offset %i', pos)
+            break
+        body = pos + 8
+
+        if block_type == PCAPNG_IDB:
+            linktype = struct.unpack_from(endian + 'H', buf, body)[0]
+            interfaces.append((linktype,
+                _if_tsresol(buf, endian, body + 8, pos + block_len - 4)))
+        elif block_type in (PCAPNG_EPB, PCAPNG_PB):
+            if block_type == PCAPNG_EPB:
+                iface, ts_high, ts_low, caplen, wirelen = \
+                    struct.unpack_from(endian + 'IIIII', buf, body)
+            else:
+                iface, _, ts_high, ts_low, caplen, wirelen = \
+                    struct.unpack_from(endian + 'HHIIII', buf, body)
+            if iface >= len(interfaces):
+                raise PcapError('packet block at offset %i names interface %i, '
+                    'but only %i are described' % (pos, iface, len(interfaces)))
+            linktype, tick = interfaces[iface]
+            chunk[n] = (((ts_high << 32) | ts_low) * tick, caplen, wirelen,
+                body + 20, linktype)
+            n += 1
+        elif block_type == PCAPNG_SPB:
+            # simple packet blocks carry no timestamp; reuse the previous one
+            wirelen = struct.unpack_from(endian + 'I', buf, body)[0]
+            if len(interfaces) == 0:
+                raise PcapError('simple packet block at offset %i precedes '
+                    'any interface description' % pos)
+            linktype, _ = interfaces[0]
+            caplen = min(wirelen, block_len - 16)
+            ts = chunk[n-1]['timestamp'] if n > 0 else 0.0
+            chunk[n] = (ts, caplen, wirelen, body + 4, linktype)
+            n += 1
+
+        pos += block_len
+        if n == chunk_records:
+            yield chunk
+            chunk = numpy.empty(chunk_records, dtype=RECORD_DTYPE)
+            n = 0
+    if n > 0:
+        yield chunk[:n]
+
+
+def _iter_buffer_records(buf, chunk_records):
+    if len(buf) >= 4 and struct.unpack_from('<I', buf, 0)[0] == PCAPNG_SHB:
+        return _iter_pcapng_records(buf, chunk_records)
+    return _iter_pcap_records(buf, chunk_records)
+
+
+def iter_records(filepath, chunk_records=DEFAULT_CHUNK_RECORDS, with_data=False):
+    '''Yield the record headers of a pcap/pcapng file as structured arrays of
+    at most chunk_records entries each (memory use is bounded by chunk size).
+    With with_data, yield (records, data) pairs instead, data being the
+    memory-mapped file as a uint8 array addressed by record offset.'''
+    f, buf = _open_mmap(filepath)
+    try:
+        if buf is None:
+            return
+        if with_data:
+            # data (and any slice of it) holds a reference to the mmap, which
+            # is unmapped once the last of them is gone; closing it here would
+            # leave them pointing at unmapped memory
+            data = numpy.frombuffer(buf, dtype=numpy.uint8)
+            for chunk in _iter_buffer_records(buf, chunk_records):
+                yield chunk, data
+        else:
+            for chunk in _iter_buffer_records(buf, chunk_records):
+                yield chunk
+            buf.close()
+    finally:
+        f.close()
+
+
+def read_records(filepath):
+    '''Return all record headers of a pcap/pcapng file as one structured array'''
+    chunks = list(iter_records(filepath))
+    if len(chunks) == 0:
+        return numpy.empty(0, dtype=RECORD_DTYPE)
+    return numpy.concatenate(chunks)
+
+
+class PcapTrace(object):
+    def __init__(self, filepath, keep_data=False):
+        '''If keep_data, the file stays mapped and packet bytes are available
+        as data (a uint8 array addressed by record offset) until close().
+        Arrays already taken from data stay valid after close(): the mapping
+        lasts until the last of them is gone.'''
+        self.filename = os.path.split(filepath)[1]
+        self._data = None
+        if not keep_data:
+            self._records = read_records(filepath)
+            return
+
+        f, buf = _open_mmap(filepath)
+        f.close()  # the mmap keeps its own handle on the file
+        if buf is None:
+            self._records = numpy.empty(0, dtype=RECORD_DTYPE)
+            self._data = numpy.empty(0, dtype=numpy.uint8)
+            return
+        chunks = list(_iter_buffer_records(buf, DEFAULT_CHUNK_RECORDS))
+        if len(chunks) == 0:
+            self._records = numpy.empty(0, dtype=RECORD_DTYPE)
+        else:
+            self._records = numpy.concatenate(chunks)
+        self._data = numpy.frombuffer(buf, dtype=numpy.uint8)
+
+    def close(self):
+        # drop our reference rather than closing the mmap under views of it
+        self._data = None
+
+    def _get_data(self):
+        if self._data is None:
+            raise PcapError('packet data of %s is not mapped' % self.filename)
+        return self._data
+    data = property(_get_data)
+
+    def _get_records(self):
+        return self._records
+    records = property(_get_records)
+
+    def _get_num_packets(self):
+        return len(self._records)
+    num_packets = property(_get_num_packets)
+
+    def _get_duration_seconds(self):
+        # same as tshark's io,stat "Duration": time of last packet
+        # relative to the first
+        if len(self._records) == 0:
+            return 0.0
+        timestamps = self._records['timestamp']
+        return float(timestamps[-1] - timestamps[0])
+    duration_seconds = property(_get_duration_seconds)
+
+    def _get_total_bytes(self):
+        # tshark counts frame.len, i.e., the original wire length
+        return int(self._records['wirelen'].sum(dtype=numpy.uint64))
+    total_bytes = property(_get_total_bytes)
+
+    def __repr__(self):
+        return self.__str__()
+
+    def __str__(self):
+        return '%s: %i packets, %i bytes, %f seconds' % \
+            (self.filename, self.num_packets, self.total_bytes, self.duration_seconds)
@@ -0,0 +1,68 @@
+#! /usr/bin/env python
+
+import os
+import sys
+import logging
+import argparse
+
+sys.path.append('../myplot/')
+import myplot
+
+from analyze import read_envelope
+
+DEFAULT_WIDTH = 2000  # points per series; about the plot's width in pixels
+
+
+def plot_current(logfile, t0, t1, width, filename, use_cache=True):
+    '''Plot the current of a power log from t0 to t1 seconds as its min/max
+    envelope and mean, at about width points per series (see
+    analyze.read_envelope; the whole log is only read if its envelope
+    pyramid isn't cached yet)'''
+    times, mins, maxs, means = read_envelope(logfile, t0, t1, width, use_cache)
+    logging.info('%s: plotting %i points', os.path.basename(logfile), len(times))
+    myplot.plot([times, times, times], [maxs, means, mins],
+        labels=['Max', 'Mean', 'Min'],
+        colors=['gray', 'black', 'gray'], linestyles=['-', '-', '-'],
+        xlabel='Time [s]', ylabel='Current [mA]',
+        xlim=(max(t0, times[0]) if len(times) > 0 else t0,
+              min(t1, times[-1]) if len(times) > 0 else t1),
+        height_scale=0.7, legend='upper right',
+        filename=filename)
+
+
+def main():
+    for logfile in args.logs:
+        t0 = args.start if args.start is not None else 0
+        t1 = args.end if args.end is not None else float('inf')
+        filename = os.path.join(args.outdir or os.path.dirname(logfile),
+            '%s-current.pdf' % os.path.splitext(os.path.basename(logfile))[0])
+        plot_current(logfile, t0, t1, args.width, filename, use_cache=not args.no_cache)
+
+
+if __name__ == "__main__":
+    # set up command line args
+    parser = argparse.ArgumentParser(formatter_class=argparse.ArgumentDefaultsHelpFormatter,\
+                                     description='Plot current over time from power monitor logs.')
+    parser.add_argument('logs', nargs='+', help='Power monitor file(s) to plot (PT4 or CSV).')
+    parser.add_argument('--start', type=float, help='Plot from this many seconds into the log (default: the start).')
+    parser.add_argument('--end', type=float, help='Plot up to this many seconds into the log (default: the end).')
+    parser.add_argument('--width', type=int, default=DEFAULT_WIDTH, help='Points to plot per series (about the plot\'s width in pixels).')
+    parser.add_argument('-o', '--outdir', help='Where to save the plots (default: next to each log).')
+    parser.add_argument('--no_cache', action='store_true', default=False, help='Don\'t read or write sidecar files (parsed samples, envelope pyramids).')
+    parser.add_argument('-q', '--quiet', action='store_true', default=False, help='only print errors')
+    parser.add_argument('-v', '--verbose', action='store_true', default=False, help='print debug info. --quiet wins if both are present')
+    args = parser.parse_args()
+
+    # set up logging
+    if args.quiet:
+        level = logging.WARNING
+    elif args.verbose:
+        level = logging.DEBUG
+    else:
+        level = logging.INFO
+    logging.basicConfig(
+        format = "%(levelname) -10s %(asctime)s %(module)s:%(lineno) -7s %(message)s",
+        level = level
+    )
+
+    main()
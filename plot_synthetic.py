@@ -9,57 +9,83 @@ import numpy
 sys.path.append('../myplot/')
 import myplot
 
-from analyze import PowerMonitorLog
+from analyze import load_many
 
+OBJECT_LOADS = 100  # loads of each object in loadobjects.sh
 
 
+def log_path(logdir, name):
+    '''Path of the power monitor log called name in logdir (PT4 or CSV)'''
+    for ext in ('.csv', '.pt4'):
+        path = os.path.join(logdir, name + ext)
+        if os.path.exists(path):
+            return path
+    return os.path.join(logdir, name + '.csv')
+
+def script_log_path(logdir, name):
+    '''Where the loadobjects.log of the run recorded in log name is saved'''
+    return os.path.join(logdir, name + '-loadobjects.log')
+
+def per_object(log, logdir, name):
+    '''(above-baseline energy in mAh, seconds) per object load. If the run's
+    loadobjects.log was saved (see script_log_path), the log is split into
+    its loads; otherwise the totals are divided by OBJECT_LOADS.'''
+    script_log = script_log_path(logdir, name)
+    if os.path.isfile(script_log):
+        segments = log.segment(script_log)
+        return numpy.mean(segments['above_baseline_energy_uAh']) / 1000.0, \
+            numpy.mean(segments['duration'])  # uAh -> mAh
+    return log.above_baseline_energy_uAh / 1000.0 / OBJECT_LOADS, \
+        log.duration_seconds / OBJECT_LOADS  # uAh -> mAh -> per object
 
 
 def main():
-    # will replace file paths with Log object
+    # will replace log names with Log object
     http_bytes_to_log = {
-        1000:'1kb-http.csv',
-        10000:'10kb-http.csv',
-        100000:'100kb-http.csv',
-        1000000:'1mb-http.csv',
-        10000000:'10mb-http.csv',
+        1000:'1kb-http',
+        10000:'10kb-http',
+        100000:'100kb-http',
+        1000000:'1mb-http',
+        10000000:'10mb-http',
     }
     http_cache_bytes_to_log = {
-        1000:'1kb-http-cache.csv',
-        10000:'10kb-http-cache.csv',
-        100000:'100kb-http-cache.csv',
-        1000000:'1mb-http-cache.csv',
-        10000000:'10mb-http-cache.csv',
+        1000:'1kb-http-cache',
+        10000:'10kb-http-cache',
+        100000:'100kb-http-cache',
+        1000000:'1mb-http-cache',
+        10000000:'10mb-http-cache',
     }
     https_bytes_to_log = {
-        1000:'1kb-https.csv',
-        10000:'10kb-https.csv',
-        100000:'100kb-https.csv',
-        1000000:'1mb-https.csv',
-        10000000:'10mb-https.csv',
+        1000:'1kb-https',
+        10000:'10kb-https',
+        100000:'100kb-https',
+        1000000:'1mb-https',
+        10000000:'10mb-https',
     }
 
 
-    # load files and make log objects
-    for size in http_bytes_to_log:
-        path = os.path.join(args.logdir, http_bytes_to_log[size])
-        log = PowerMonitorLog(path)
-        http_bytes_to_log[size] = log
-    
-    for size in http_bytes_to_log:
-        path = os.path.join(args.logdir, http_cache_bytes_to_log[size])
+    http_names = dict(http_bytes_to_log)
+    http_cache_names = dict(http_cache_bytes_to_log)
+    https_names = dict(https_bytes_to_log)
 
-        # do we have stats from cache load?
-        have_cache = os.path.exists(path)
-        if not have_cache: break
+    # do we have stats from cache load?
+    have_cache = all(os.path.exists(log_path(args.logdir, name))
+        for name in http_cache_names.values())
 
-        log = PowerMonitorLog(path)
-        http_cache_bytes_to_log[size] = log
-    
-    for size in https_bytes_to_log:
-        path = os.path.join(args.logdir, https_bytes_to_log[size])
-        log = PowerMonitorLog(path)
-        https_bytes_to_log[size] = log
+    # load all files at once (in parallel) and make log objects
+    tables = [http_bytes_to_log, https_bytes_to_log]
+    if have_cache:
+        tables.append(http_cache_bytes_to_log)
+    names = [table[size] for table in tables for size in sorted(table)]
+    paths = [log_path(args.logdir, name) for name in names]
+    segment_args = dict((path, (script_log_path(args.logdir, name),))
+        for name, path in zip(names, paths)
+        if os.path.isfile(script_log_path(args.logdir, name)))
+    logs = dict(zip(names, load_many(paths, segment_args=segment_args,
+        processes=args.processes)))
+    for table in tables:
+        for size in table:
+            table[size] = logs[table[size]]
 
     # plot stuff
     sizes = sorted(http_bytes_to_log.keys())
@@ -73,18 +99,18 @@ def main():
     http_cache_duration = []
     https_duration = []
     for size in sizes:
-        http_log = http_bytes_to_log[size]
-        http_extra_energy.append(http_log.above_baseline_energy_uAh / 1000.0 / 100.0)  # uAh -> mAh -> per object
-        http_duration.append(http_log.duration_seconds / 100.0)  # per object time, not total
+        energy, duration = per_object(http_bytes_to_log[size], args.logdir, http_names[size])
+        http_extra_energy.append(energy)
+        http_duration.append(duration)
         
         if have_cache:
-            http_cache_log = http_cache_bytes_to_log[size]
-            http_cache_extra_energy.append(http_cache_log.above_baseline_energy_uAh / 1000.0 / 100.0)  # uAh -> mAh -> per object
-            http_cache_duration.append(http_cache_log.duration_seconds / 100.0)  # per-object time, not total
+            energy, duration = per_object(http_cache_bytes_to_log[size], args.logdir, http_cache_names[size])
+            http_cache_extra_energy.append(energy)
+            http_cache_duration.append(duration)
 
-        https_log = https_bytes_to_log[size]
-        https_extra_energy.append(https_log.above_baseline_energy_uAh / 1000.0 / 100.0)  # uAh -> mAh -> per object
-        https_duration.append(https_log.duration_seconds / 100.0)  # per-object time, not total
+        energy, duration = per_object(https_bytes_to_log[size], args.logdir, https_names[size])
+        https_extra_energy.append(energy)
+        https_duration.append(duration)
 
     if have_cache:
         myplot.plot([xsizes, xsizes, xsizes, xsizes, xsizes, xsizes],
@@ -173,6 +199,7 @@ if __name__ == "__main__":
     parser = argparse.ArgumentParser(formatter_class=argparse.ArgumentDefaultsHelpFormatter,\
                                      description='Plot power results from synthetic benchmarks.')
     parser.add_argument('logdir', default='.', help='Directory of power monitor files.')
+    parser.add_argument('-j', '--processes', type=int, help='Number of logs to load at once. Defaults to one per CPU.')
     parser.add_argument('-q', '--quiet', action='store_true', default=False, help='only print errors')
     parser.add_argument('-v', '--verbose', action='store_true', default=False, help='print debug info. --quiet wins if both are present')
     args = parser.parse_args()
@@ -7,155 +7,299 @@ import glob
 import logging
 import argparse
 import subprocess
-import cPickle
 import time
+import threading
+import Queue
 import string
 import numpy
-from collections import defaultdict
+from functools import partial
 from multiprocessing import Pool
 
 sys.path.append('../myplot')
 import myplot
 
-ADB = '/usr/bin/env adb'
-TCPDUMP = '/data/local/tmp/tcpdump_armv7'   # location of tcpdump binary on phone
-REMOTE_TRACEDIR = '/data/local/tmp/traces'  # temp dir on phone for storing pcap traces
+from adb import ADB, close_sessions
+from capture import CAPTURES, HEADERS_SNAPLEN, StreamedCapture
+from pcap import PcapTrace
+from flows import analyze_flows
+from results import TRACE_CACHE_FILE, RESULTS_FILE, TraceCache, ResultStore, open_results, group_stats
+from scheduler import CampaignScheduler
+from completion import DETECTORS, FixedWait, NetworkQuiescence
+from convergence import ConvergenceTracker
+from timing import TRIALS_LOG, TrialTimer
+from journal import CampaignJournal
+from transport import TRANSPORTS, AdbTransport, SimulatedTransport
+
 TSHARK = '/usr/bin/env tshark'
 
 def sanitize_url(url):
     return re.sub(r'[/\;,><&*:%=+@!#^()|?^]', '-', url)
 
-def load_page(url, device, numtrials=10):
-    '''Load a URL numtrials times and return a list of correspnding pcap traces'''
-    logging.info('Loading URL %s %i times', url, numtrials)
-    
-    for i in range(0, numtrials):
-        # cleanup: kill tcpdump, kill browser, clear cache on phone
-        try:
-            # kill tcpdump
-            cmd = '%s -s %s shell su -c "killall tcpdump_armv7"' % (ADB, device)
-            logging.debug(cmd)
-            subprocess.check_output(cmd, shell=True)
-
-            # kill chrome
-            cmd = '%s -s %s shell am force-stop com.android.chrome' % (ADB, device)
-            logging.debug(cmd)
-            subprocess.check_output(cmd.split())
-
-            # kill background processes
-            cmd = '%s -s %s shell am kill-all' % (ADB, device)
-            logging.debug(cmd)
-            subprocess.check_output(cmd.split())
-
-            # clear cache
-            cmd = '%s -s %s shell su -c "rm -rf /data/data/com.android.chrome/cache"' % (ADB, device)
-            logging.debug(cmd)
-            subprocess.check_output(cmd, shell=True)
-
-            # close tabs
-            cmd = '%s -s %s shell su -c "rm -rf /data/data/com.android.chrome/files"' % (ADB, device)
-            logging.debug(cmd)
-            subprocess.check_output(cmd, shell=True)
-
-            #cmd = '%s -s %s shell pm clear com.android.chrome' % (ADB, device)
-            #logging.debug(cmd)
-            #subprocess.check_output(cmd.split())
-        except Exception as e:
-            logging.error('Error clearing browser cache on phone. Skipping this trial. (%s)', e)
-            time.sleep(5)
-            continue
-
-
-        ## click "Accept" on Chrome's agreement screen
-        #try:
-        #    launch = '%s -s %s shell am start com.android.chrome' % (ADB, device)
-        #    tap = '%s -s %s shell input tap 200 750' % (ADB, device)
-
-        #    subprocess.check_output(launch.split())
-        #    time.sleep(6)
-        #    subprocess.check_output(tap.split())  # accept agreement
-        #    time.sleep(2)
-        #    subprocess.check_output(tap.split())  # don't sign in
-        #except Exception as e:
-        #    logging.error('Error dismissing Chrome agreement. Skipping this trial. (%s)', e)
-        #    time.sleep(5)
-        #    continue
-                
-
-
-        # start tcpdump on phone
-        remote_trace_file = os.path.join(REMOTE_TRACEDIR, '%s-%i.pcap' % (sanitize_url(url), i))
-        tcpdump_proc = None
-        try:
-            cmd = '%s -s %s shell "mkdir -p %s"' % (ADB, device, REMOTE_TRACEDIR)
-            logging.debug(cmd)
-            subprocess.check_output(cmd, shell=True)
-
-            cmd = '%s -s %s shell "su -c \'/data/local/tmp/tcpdump_armv7 -i rmnet0 -w %s port 80 or port 443 or port 10750\'"'\
-                % (ADB, device, remote_trace_file)
-            logging.debug(cmd)
-            tcpdump_proc = subprocess.Popen(cmd, shell=True)
-        except Exception as e:
-            logging.error('Error starting tcpdump on phone. Skipping this trial. (%s)', e)
-            if tcpdump_proc:
-                logging.getLogger(__name__).debug('Stopping tcpdump')
-                tcpdump_proc.kill()
-                tcpdump_proc.wait()
-            time.sleep(5)
-            continue
-
-        # load page
+def trace_path(url, i, attempt=0):
+    '''Where the trace of an attempt at trial i of url is saved:
+    "<url>-<i>.pcap" for the first attempt, "<url>-<i>.<attempt>.pcap" after'''
+    name = '%s-%i' % (sanitize_url(url), i)
+    if attempt > 0:
+        name += '.%i' % attempt
+    return os.path.join(args.outdir, 'traces', name + '.pcap')
+
+def new_trace_path(url, i):
+    '''A trace path for a new attempt at trial i of url that doesn't overwrite
+    the trace of an earlier attempt (in this campaign or an interrupted one)'''
+    attempt = get_journal().attempts(url, i)
+    while os.path.exists(trace_path(url, i, attempt)):
+        attempt += 1
+    return trace_path(url, i, attempt)
+
+_journals = {}  # path -> CampaignJournal
+_journals_lock = threading.Lock()
+
+def get_journal():
+    '''The CampaignJournal of the output directory (trials.jsonl next to the
+    traces), opened on first use'''
+    path = os.path.join(args.outdir, 'traces', TRIALS_LOG)
+    with _journals_lock:
+        if path not in _journals:
+            if not os.path.isdir(os.path.dirname(path)):
+                os.makedirs(os.path.dirname(path))
+            _journals[path] = CampaignJournal(path)
+        return _journals[path]
+
+def record_completion(timer, reason, seconds):
+    '''Note which condition ended a trial's page load wait, in its trial record'''
+    logging.debug('[%s] %s trial %i: load wait ended by %s after %.1f seconds',
+        timer.device, timer.url, timer.trial, reason, seconds)
+    timer.complete(reason, seconds)
+
+def load_page_trial(url, device, i, detector=None, capture_class=StreamedCapture,
+                    transport_class=AdbTransport):
+    '''Load a URL once (trial number i), saving a pcap trace. detector
+    decides when the page is done loading (default: wait 15 seconds);
+    capture_class is a capture mode from capture.py; transport_class is how
+    the device is driven (see transport.py).
+    The trial's record (outcome and phase timings) goes in the campaign
+    journal, trials.jsonl next to the traces. Returns True if the trial
+    completed.'''
+    timer = TrialTimer(url, i, device)
+    ok = False
+    try:
+        ok = _load_page_trial(url, device, i, detector,
+            transport_class(device, capture_class), timer)
+        return ok
+    finally:
         try:
-            # lanuch browser
-            cmd = '%s -s %s shell am start -a android.intent.action.VIEW -d %s com.android.chrome'\
-                % (ADB, device, url)
-            logging.debug(cmd)
-            subprocess.check_output(cmd.split())
-
-            # pause while page loads TODO: can we find out when load is complete?
-            time.sleep(15)
+            get_journal().record(timer.record(ok))
         except Exception as e:
-            logging.error('Error loading page. Skipping this trial. (%s)', e)
-            time.sleep(5)
-            continue
-        finally:
-            if tcpdump_proc:
-                logging.getLogger(__name__).debug('Stopping tcpdump')
-                tcpdump_proc.kill()
-                tcpdump_proc.wait()
+            logging.error('Error writing %s trial %i to the campaign journal: %s', url, i, e)
 
-        # get pcap trace and remove from phone
-        try:
-            # copy trace from phone
-            cmd = '%s -s %s pull %s %s' % \
-                (ADB, device, remote_trace_file, os.path.join(args.outdir, 'traces'))
-            logging.debug(cmd)
-            subprocess.check_output(cmd.split())
+def _back_off(timer, transport):
+    '''Reset the transport and pause after a failure (e.g., to let adb recover)'''
+    transport.reset()
+    with timer.phase('backoff'):
+        time.sleep(transport.backoff_seconds)
+
+def _load_page_trial(url, device, i, detector, transport, timer):
+    if detector is None:
+        detector = FixedWait()
+
+    # cleanup: kill tcpdump, kill browser, kill background processes, clear
+    # cache and close tabs on phone
+    try:
+        with timer.phase('cleanup'):
+            transport.cleanup()
+    except Exception as e:
+        logging.error('Error clearing browser cache on phone. Skipping this trial. (%s)', e)
+        _back_off(timer, transport)
+        return False
+
+
+    ## click "Accept" on Chrome's agreement screen
+    #try:
+    #    session.run('am start com.android.chrome')
+    #    time.sleep(6)
+    #    session.run('input tap 200 750')  # accept agreement
+    #    time.sleep(2)
+    #    session.run('input tap 200 750')  # don't sign in
+    #except Exception as e:
+    #    logging.error('Error dismissing Chrome agreement. Skipping this trial. (%s)', e)
+    #    time.sleep(5)
+    #    return False
             
-            # remove from phone
-            cmd = '%s -s %s shell "rm %s"' % (ADB, device, remote_trace_file)
-            logging.debug(cmd)
-            subprocess.check_output(cmd, shell=True)
-        except Exception as e:
-            logging.error('Error retreiving trace from phone: %s', e)
-            time.sleep(5)
-            continue
 
+
+    # start capturing packets on phone
+    trace_file = new_trace_path(url, i)
+    timer.trace = os.path.basename(trace_file)
+    capture = transport.capture(trace_file)
+    try:
+        with timer.phase('capture_start'):
+            capture.start()
+    except Exception as e:
+        logging.error('Error starting tcpdump on phone. Skipping this trial. (%s)', e)
+        discard_capture(capture)
+        _back_off(timer, transport)
+        return False
+
+    # load page
+    try:
+        # lanuch browser
+        with timer.phase('launch'):
+            transport.launch(url)
+
+        # pause while page loads
+        wait_start = time.time()
+        with timer.phase('wait'):
+            reason = detector.wait(capture.captured_bytes)
+        record_completion(timer, reason, time.time() - wait_start)
+    except Exception as e:
+        logging.error('Error loading page. Skipping this trial. (%s)', e)
+        discard_capture(capture)
+        _back_off(timer, transport)
+        return False
+    finally:
         # make sure tcpdump is dead
         try:
-            cmd = '%s -s %s shell su -c "killall tcpdump_armv7"' % (ADB, device)
-            logging.debug(cmd)
-            subprocess.check_output(cmd, shell=True)
+            logging.getLogger(__name__).debug('Stopping tcpdump')
+            with timer.phase('capture_stop'):
+                capture.stop()
         except Exception as e:
             logging.error('Error killing tcpdump: %s', e)
 
+    # get pcap trace (and remove it from phone)
+    try:
+        with timer.phase('fetch'):
+            capture.fetch()
+    except Exception as e:
+        logging.error('Error retreiving trace from phone: %s', e)
+        discard_capture(capture)
+        _back_off(timer, transport)
+        return False
 
-def analyze_trace(trace):
-    '''Gather statistics from a pcap trace'''
-    logging.debug('Analyzing trace %s', trace)
-
-    url = '-'.join(os.path.splitext(os.path.split(trace)[1])[0].split('-')[:-1])
+    return True
 
+def discard_capture(capture):
+    '''Remove what a failed trial captured so it isn't analyzed'''
+    try:
+        capture.discard()
+    except Exception as e:
+        logging.debug('Error discarding capture: %s', e)
+
+
+def list_devices():
+    '''Return the IDs of the devices listed (and online) in "adb devices"'''
+    cmd = '%s devices' % ADB
+    logging.debug(cmd)
+    output = subprocess.check_output(cmd.split())
+    devices = []
+    for line in output.strip().split('\n')[1:]:
+        fields = line.strip().split('\t')
+        if len(fields) == 2 and fields[1] == 'device':
+            devices.append(fields[0])
+    return devices
+
+def make_detector():
+    '''Build the page load completion detector selected on the command line'''
+    if args.wait == FixedWait.name:
+        return FixedWait(args.fixed_wait)
+    return NetworkQuiescence(min_wait=args.min_wait, idle_seconds=args.idle_seconds,
+        idle_rate=args.idle_rate, timeout=args.timeout)
+
+def adaptive_trial_done(tracker, url, trial, trace):
+    '''Feed a finished trial's PLT and size, from its trace (None if it
+    failed), to a ConvergenceTracker; returns the trials to run next'''
+    result = None
+    if trace is not None:
+        try:
+            pcap = PcapTrace(trace)
+            result = (pcap.duration_seconds, pcap.total_bytes)
+        except Exception as e:
+            logging.error('Error reading trace of %s (trial %i): %s', url, trial, e)
+    return tracker.finish(url, trial, result)
+
+def trial_done(url, trial, ok, tracker=None, pipeline=None, done=None):
+    '''Hand a finished trial's trace to the analysis pipeline and, in
+    adaptive mode, the ConvergenceTracker; returns the trials to run next,
+    except those in done (see skip_completed)'''
+    trace = get_journal().trace(url, trial) if ok else None
+    if trace is not None and pipeline is not None:
+        pipeline.submit(trace)
+    if tracker is not None:
+        return skip_completed(adaptive_trial_done(tracker, url, trial, trace), done or set(), tracker)
+    return []
+
+def completed_trials(journal):
+    '''The (url, trial) pairs journal says finished, whose traces are still there'''
+    done = set()
+    for url, trial in journal.completed:
+        trace = journal.trace(url, trial)
+        if trace is not None and os.path.exists(trace):
+            done.add((url, trial))
+    return done
+
+def skip_completed(jobs, done, tracker=None):
+    '''Drop the (url, trial) jobs in done. In adaptive mode, their results go
+    to the ConvergenceTracker instead, and the jobs it hands out in turn are
+    checked the same way.'''
+    pending = list(reversed(jobs))
+    todo = []
+    while len(pending) > 0:
+        url, trial = pending.pop()
+        if (url, trial) not in done:
+            todo.append((url, trial))
+        elif tracker is not None:
+            pending.extend(reversed(adaptive_trial_done(tracker, url, trial,
+                get_journal().trace(url, trial))))
+    return todo
+
+def run_campaign(urls, devices, numtrials=10, max_attempts=1, detector=None,
+                 capture_class=StreamedCapture, tracker=None, pipeline=None,
+                 transport_class=AdbTransport, resume=False):
+    '''Load each URL numtrials times, spreading the trials over devices. With
+    a ConvergenceTracker, load each URL until its results converge instead.
+    With an AnalysisPipeline, each trace is analyzed as soon as it's captured.
+    To resume an interrupted campaign, set resume to skip the trials the
+    campaign journal says finished (their traces are analyzed again if
+    their results aren't in the store).'''
+    if tracker is None:
+        logging.info('Loading %i URLs %i times each on %i device(s)', len(urls), numtrials, len(devices))
+        jobs = [(url, i) for url in urls for i in range(0, numtrials)]
+    else:
+        logging.info('Loading %i URLs %i-%i times each (until the PLT and size CIs are within %.0f%%) on %i device(s)',
+            len(urls), tracker.min_trials, tracker.max_trials, tracker.target_width * 100, len(devices))
+        jobs = [job for url in urls for job in tracker.start(url)]
+    done = set()
+    if resume:
+        journal = get_journal()
+        done = completed_trials(journal)
+        jobs = skip_completed(jobs, done, tracker)
+        logging.info('Resuming: %i trials already finished, %i to run', len(done), len(jobs))
+        if pipeline is not None:
+            # finished trials whose analysis didn't make it into the store
+            traces = pipeline.unanalyzed(sorted(journal.trace(url, trial) for url, trial in done))
+            if len(traces) > 0:
+                logging.info('Analyzing %i finished traces missing from the result store', len(traces))
+            for trace in traces:
+                pipeline.submit(trace)
+    scheduler = CampaignScheduler(devices, partial(load_page_trial, detector=detector,
+        capture_class=capture_class, transport_class=transport_class),
+        max_attempts=max_attempts,
+        on_done=partial(trial_done, tracker=tracker, pipeline=pipeline, done=done))
+    try:
+        scheduler.run(jobs)
+    finally:
+        close_sessions()
+    scheduler.report()
+
+def default_campaign(tracedir):
+    '''Name a campaign after its trace directory (or the directory holding
+    it, if it is the "traces" subdirectory probe.py creates)'''
+    path = os.path.abspath(tracedir)
+    if os.path.basename(path) == 'traces':
+        path = os.path.dirname(path)
+    return os.path.basename(path)
+
+def _analyze_trace_tshark(trace):
+    '''Get (duration, bytes) for a trace from tshark's io,stat output'''
     output = None
     try:
         cmd = '%s -q -z io,stat,0 -r %s' % (TSHARK, trace)
@@ -164,83 +308,210 @@ def analyze_trace(trace):
     except subprocess.CalledProcessError as e:
         logging.debug('tshark errored: %s', e)  # always error; problem with tcpdump_armv7?
         output = e.output
-    except Exception as e:
-        logging.error('Error analyzing trace %s: %s', trace, e)
-        return None, None, None
-        
+
     lines = output.split('\n')
     seconds = float(lines[4].split(':')[1].split('secs')[0].strip())
     bytes = int(lines[10].split('|')[3].strip())
-    return url, seconds, bytes
+    return seconds, bytes
 
-def analyze_traces(traces):
-    url_to_plts = defaultdict(list)
-    url_to_sizes = defaultdict(list)
-    results = []
+def trace_url(trace):
+    '''The (sanitized) URL a trace was captured for, from its file name'''
+    return '-'.join(os.path.splitext(os.path.split(trace)[1])[0].split('-')[:-1])
+
+def trace_trial(trace):
+    '''The trial number of a trace, from its file name'''
+    try:
+        return int(os.path.splitext(os.path.split(trace)[1])[0].split('-')[-1].split('.')[0])
+    except ValueError:
+        return None
+
+def trace_attempt(trace):
+    '''The attempt number of a trace, from its file name (see trace_path)'''
+    try:
+        return int(os.path.splitext(os.path.split(trace)[1])[0].split('-')[-1].split('.')[1])
+    except (ValueError, IndexError):
+        return 0
+
+def analyze_trace(trace, use_tshark=False):
+    '''Gather statistics from a pcap trace. Returns (url, plt, size,
+    breakdown), where breakdown is (per-page summary, flow table) or None
+    with tshark.'''
+    logging.debug('Analyzing trace %s', trace)
+
+    url = trace_url(trace)
+
+    try:
+        if use_tshark:
+            seconds, bytes = _analyze_trace_tshark(trace)
+            breakdown = None
+        else:
+            seconds, bytes, summary, flows = analyze_flows(trace)
+            breakdown = (summary, flows)
+    except Exception as e:
+        logging.error('Error analyzing trace %s: %s', trace, e)
+        return None, None, None, None
+
+    return url, seconds, bytes, breakdown
+
+def _analyze_trace_job(job):
+    '''analyze_trace for Pool.imap_unordered: job is (trace, use_tshark);
+    returns (trace, result) since results come back in completion order'''
+    trace, use_tshark = job
+    return trace, analyze_trace(trace, use_tshark)
+
+def analyze_traces(traces, campaign, use_tshark=False, use_hash=False):
+    # only analyze traces that are new or changed since the last run
+    cache = TraceCache(os.path.join(args.tracedir, TRACE_CACHE_FILE))
+    stale = cache.refresh(traces, use_hash)
+    logging.info('Analyzing %i new or changed traces (%i cached)',
+        len(stale), len(traces) - len(stale))
     
-    # process traces individually in separate processes
+    # process traces individually in separate processes, taking each
+    # result as soon as it is ready
+    # each result is a tuple: (url, plt, size, breakdown)
     pool = Pool()
     try:
-        results = pool.map_async(analyze_trace, traces).get(0xFFFF)
+        results = pool.imap_unordered(_analyze_trace_job,
+            [(trace, use_tshark) for trace in stale])
+        for _ in stale:
+            # wait with a timeout so KeyboardInterrupt gets through
+            trace, result = results.next(0xFFFF)
+            url, plt, size, breakdown = result
+            cache.update(trace, (plt, size, breakdown) if url else None)
     except KeyboardInterrupt:
+        pool.terminate()
         sys.exit()
-
-    # each result is a tuple: (url, plt, size)
-    for result in results:
-        url, plt, size = result
-        if url:
-            url_to_plts[url].append(plt)
-            url_to_sizes[url].append(size)
-
-    # save the two dicts to a pickled results file
-    with open(os.path.join(args.tracedir, 'results.pickle'), 'w') as f:
-        cPickle.dump((url_to_plts, url_to_sizes), f)
-    f.closed
-
-def compare_results(result_files):
-    '''Takes pickled result files (produced by analyze_traces) and plots stuff'''
-
-    filename_to_plt_list_dict = {}  # filename -> url -> list of PLTs  (seconds)
-    filename_to_size_list_dict = {}  # filename -> url -> list of sizes  (bytes)
-
-    for result_file in result_files:
-        with open(result_file, 'r') as f:
-            url_to_plts, url_to_sizes = cPickle.load(f)
-        f.closed
-
-        filename_to_plt_list_dict[result_file] = url_to_plts
-        filename_to_size_list_dict[result_file] = url_to_sizes
-
-
-    # collapse stats for each URL into mean and median
-    filename_to_plt_mean_dict = defaultdict(dict)  #filename -> url -> mean PLT
-    filename_to_plt_median_dict = defaultdict(dict)  #filename -> url -> median PLT
-    for filename, plt_list_dict in filename_to_plt_list_dict.iteritems():
-        for url, plt_list in plt_list_dict.iteritems():
-            filename_to_plt_mean_dict[filename][url] = numpy.mean(plt_list)
-            filename_to_plt_median_dict[filename][url] = numpy.median(plt_list)
-
-    filename_to_size_mean_dict = defaultdict(dict)  # filename -> url -> mean size
-    filename_to_size_median_dict = defaultdict(dict)  # filename -> url -> median size
-    for filename, size_list_dict in filename_to_size_list_dict.iteritems():
-        for url, size_list in size_list_dict.iteritems():
-            filename_to_size_mean_dict[filename][url] = numpy.mean(size_list) / 1000000.0  # bytes -> MB
-            filename_to_size_median_dict[filename][url] = numpy.median(size_list) / 1000000.0  # bytes -> MB
-
-
-    # plot CDFs
+    finally:
+        pool.close()
+        pool.join()
+    cache.save()
+
+    # a trial retried after it succeeded (without --resume) has several
+    # traces; its latest attempt counts
+    latest = {}
+    for trace in sorted(traces, key=trace_attempt):
+        trial = trace_trial(trace)
+        latest[(trace_url(trace), trial) if trial is not None else trace] = trace
+
+    rows = []
+    flows = []
+    for trace in sorted(latest.values()):
+        result = cache.result(trace)
+        if result:
+            plt, size, breakdown = result
+            url, trial = trace_url(trace), trace_trial(trace)
+            rows.append((url, trial, plt, size, breakdown[0] if breakdown else None))
+            if breakdown:
+                flows.append((url, trial, breakdown[1]))
+
+    # save one row per trial (and one per flow) to the result store
+    store = ResultStore(os.path.join(args.tracedir, RESULTS_FILE))
+    store.replace_campaign(campaign, rows, flows)
+    store.close()
+
+
+class AnalysisPipeline(object):
+    '''Analyze traces while a campaign is still capturing. Each finished
+    trace is submitted to a pool of analysis processes; a writer thread takes
+    results in completion order and appends them to the trace directory's
+    result store (and analysis cache, so a later -t run finds them done).
+    At most max_pending traces wait for analysis; submit() blocks beyond
+    that, so capture can't outrun analysis without bound.'''
+    def __init__(self, tracedir, campaign, use_tshark=False, workers=None,
+                 max_pending=16):
+        self.tracedir = tracedir
+        self.campaign = campaign
+        self.use_tshark = use_tshark
+        self.analyzed = 0
+        self._slots = threading.BoundedSemaphore(max_pending)
+        self._queue = Queue.Queue()
+        # create (or upgrade) the store's tables here, so the writer thread
+        # and unanalyzed() don't race to do it
+        ResultStore(os.path.join(tracedir, RESULTS_FILE)).close()
+        # fork the workers before the caller starts any threads
+        self._pool = Pool(workers)
+        self._writer = threading.Thread(target=self._write_results, name='analysis-writer')
+        self._writer.daemon = True
+        self._writer.start()
+
+    def submit(self, trace):
+        self._slots.acquire()
+        self._queue.put((trace, self.use_tshark))
+
+    def unanalyzed(self, traces):
+        '''The traces whose trials have no results in the campaign yet (e.g.,
+        captured just before an interrupted campaign stopped)'''
+        store = ResultStore(os.path.join(self.tracedir, RESULTS_FILE))
+        try:
+            columns = store.query(['url', 'trial'], campaign=self.campaign)
+        finally:
+            store.close()
+        stored = set(zip(columns['url'], columns['trial']))
+        return [trace for trace in traces if (trace_url(trace), trace_trial(trace)) not in stored]
+
+    def _write_results(self):
+        # SQLite connections stay in the thread that opened them
+        store = ResultStore(os.path.join(self.tracedir, RESULTS_FILE))
+        cache = TraceCache(os.path.join(self.tracedir, TRACE_CACHE_FILE))
+        try:
+            for trace, result in self._pool.imap_unordered(_analyze_trace_job,
+                    iter(self._queue.get, None)):
+                url, plt, size, breakdown = result
+                try:
+                    cache.add(trace, (plt, size, breakdown) if url else None)
+                    if url:
+                        store.add_trial(self.campaign, url, trace_trial(trace), plt, size,
+                            breakdown[0] if breakdown else None,
+                            breakdown[1] if breakdown else None)
+                        self.analyzed += 1
+                except Exception as e:
+                    logging.error('Error saving results of %s: %s', trace, e)
+                finally:
+                    self._slots.release()
+        finally:
+            cache.save()
+            store.close()
+
+    def close(self):
+        '''Wait for the submitted traces to be analyzed and stored'''
+        self._queue.put(None)
+        self._writer.join()
+        self._pool.close()
+        self._pool.join()
+        logging.info('Analyzed %i traces into %s (campaign %s)', self.analyzed,
+            os.path.join(self.tracedir, RESULTS_FILE), self.campaign)
+
+def compare_results(result_files, urls=None):
+    '''Takes result files (produced by analyze_traces) and plots stuff. Only
+    the URLs in urls are compared, if given.'''
+
+    # collapse stats for each URL into mean and median; each campaign in the
+    # result files is a series in the plots
     mean_plts = []
     median_plts = []
     mean_sizes = []
     median_sizes = []
     labels = []
-    for filename in result_files:
-        name = os.path.splitext(os.path.split(filename)[1])[0]
-        labels.append(string.replace(string.replace(name, 'SPDY', 'Compression Proxy'), 'NoProxy', 'No Proxy'))
-        mean_plts.append(filename_to_plt_mean_dict[filename].values())
-        median_plts.append(filename_to_plt_median_dict[filename].values())
-        mean_sizes.append(filename_to_size_mean_dict[filename].values())
-        median_sizes.append(filename_to_size_median_dict[filename].values())
+    for result_file in result_files:
+        store = open_results(result_file)
+        campaigns = store.campaigns()
+        for campaign in campaigns:
+            columns = store.query(['url', 'plt', 'bytes'], campaign=campaign, urls=urls)
+            _, plt_means, plt_medians = group_stats(columns['url'], columns['plt'])
+            _, size_means, size_medians = group_stats(columns['url'], columns['bytes'])
+
+            # label an SQLite store's series by campaign, and a legacy pickle
+            # by its file name (e.g., SPDY.pickle vs. NoProxy.pickle)
+            if result_file.endswith('.pickle'):
+                name = os.path.splitext(os.path.basename(result_file))[0]
+            else:
+                name = campaign
+            labels.append(string.replace(string.replace(name, 'SPDY', 'Compression Proxy'), 'NoProxy', 'No Proxy'))
+            mean_plts.append(list(plt_means))
+            median_plts.append(list(plt_medians))
+            mean_sizes.append(list(size_means / 1000000.0))  # bytes -> MB
+            median_sizes.append(list(size_medians / 1000000.0))  # bytes -> MB
+        store.close()
 
     # mean PLTs
     myplot.cdf(mean_plts, height_scale=0.7,
@@ -264,7 +535,7 @@ def compare_results(result_files):
 
     combined_sizes = []
     combined_labels = []
-    for i in range(len(result_files)):
+    for i in range(len(labels)):
         combined_sizes.append(mean_sizes[i])
         combined_labels.append('%s (Mean)' % labels[i])
         combined_sizes.append(median_sizes[i])
@@ -291,38 +562,60 @@ def main():
     if args.load_pages:
         urls += args.load_pages
 
-    # get android device ID
-    if not args.device and len(urls) > 0:
-        # use the first device ID listed in "adb devices"
+    # get android device IDs
+    devices = args.devices
+    if not devices and args.transport == SimulatedTransport.name:
+        devices = ['sim-%i' % i for i in range(args.sim_devices)]
+    if not devices and len(urls) > 0:
+        # use every device listed in "adb devices"
         try:
-            cmd = '%s devices' % ADB
-            logging.debug(cmd)
-            output = subprocess.check_output(cmd.split())
-            devices = output.strip().split('\n')[1:]
-            devices = map(lambda x: x.split('\t')[0], devices)
-
-            if len(devices) == 0:
-                logging.warn('No devices found')
-            elif len(devices) > 1:
-                logging.warn('Multiple devices found. Using the first one (%s).' % devices[0])
-                args.device = devices[0]
-            else:
-                args.device = devices[0]
+            devices = list_devices()
         except Exception as e:
             logging.error('Error listing Android devices: %s', e)
             sys.exit(1)
 
+        if len(devices) == 0:
+            logging.warn('No devices found')
+        elif len(devices) > 1:
+            logging.info('Multiple devices found. Using all of them (%s).' % ', '.join(devices))
+
     # load URLs (if there are any)
-    if args.device:
-        for url in urls:
-            load_page(url, args.device, args.numtrials)
+    if devices and len(urls) > 0:
+        tracker = None
+        if args.target_ci is not None:
+            tracker = ConvergenceTracker(args.min_trials, args.max_trials, args.target_ci,
+                args.confidence)
+        pipeline = None
+        if not args.no_analysis:
+            tracedir = os.path.join(args.outdir, 'traces')
+            pipeline = AnalysisPipeline(tracedir,
+                args.campaign or default_campaign(tracedir), args.tshark,
+                max_pending=args.analysis_queue)
+        capture_class = CAPTURES[args.capture]
+        if args.headers_only:
+            capture_class = partial(capture_class, snaplen=args.snaplen)
+        transport_class = TRANSPORTS[args.transport]
+        if args.transport == SimulatedTransport.name:
+            transport_class = partial(transport_class, latency=args.sim_latency,
+                failure_rate=args.sim_failure_rate, load_seconds=args.sim_load_seconds)
+        journal = get_journal()
+        if not args.resume and len(journal.completed) > 0:
+            logging.warn('%s lists %i finished trials from an earlier run; loading them again (use --resume to skip them)',
+                journal.path, len(journal.completed))
+        try:
+            run_campaign(urls, devices, args.numtrials, args.attempts, make_detector(),
+                capture_class, tracker, pipeline, transport_class, args.resume)
+        finally:
+            if pipeline is not None:
+                pipeline.close()
 
     if args.tracedir and os.path.isdir(args.tracedir):
         traces = glob.glob(args.tracedir + '/*.pcap')
-        analyze_traces(traces)
+        campaign = args.campaign or default_campaign(args.tracedir)
+        analyze_traces(traces, campaign, args.tshark, args.hash)
 
     if args.resultfiles:
-        compare_results(args.resultfiles)
+        compare_results(args.resultfiles, args.urls)
 
 
 
@@ -334,9 +627,35 @@ if __name__ == "__main__":
     parser.add_argument('-f', '--url_file', default=None, help='Profile the URLs in the specified file (one URL per line)')
     parser.add_argument('-o', '--outdir', default='.', help='Destination directory for traces and plots.')
     parser.add_argument('-n', '--numtrials', default=10, type=int, help='Number of times to load each URL.')
+    parser.add_argument('--target_ci', type=float, help='Load each URL until the confidence intervals of its mean PLT and size are at most this fraction of the mean (e.g., 0.1), instead of --numtrials times.')
+    parser.add_argument('--min_trials', default=5, type=int, help='Fewest times to load each URL (--target_ci).')
+    parser.add_argument('--max_trials', default=30, type=int, help='Most times to load each URL (--target_ci).')
+    parser.add_argument('--confidence', default=0.95, type=float, help='Confidence level of the intervals (--target_ci).')
+    parser.add_argument('-c', '--capture', choices=sorted(CAPTURES.keys()), default=StreamedCapture.name, help='How to get traces off the phone: stream them to the host as they are captured, or write them to the phone and pull them afterwards.')
+    parser.add_argument('--headers_only', action='store_true', default=False, help='Only capture the first --snaplen bytes of each packet (headers). Traces get much smaller; page load times and byte counts are unaffected.')
+    parser.add_argument('--snaplen', default=HEADERS_SNAPLEN, type=int, help='Bytes to keep per packet (--headers_only).')
+    parser.add_argument('-w', '--wait', choices=sorted(DETECTORS.keys()), default=NetworkQuiescence.name, help='How to decide a page has finished loading: wait --fixed_wait seconds, or until the capture goes quiet.')
+    parser.add_argument('--fixed_wait', default=15, type=float, help='Seconds to wait for a page load (--wait fixed).')
+    parser.add_argument('--min_wait', default=3, type=float, help='Minimum seconds to wait for a page load (--wait network).')
+    parser.add_argument('--idle_seconds', default=2, type=float, help='Seconds the capture must stay quiet before a page counts as loaded (--wait network).')
+    parser.add_argument('--idle_rate', default=0, type=float, help='Capture growth (bytes/second) at or below which the network counts as quiet (--wait network).')
+    parser.add_argument('--timeout', default=30, type=float, help='Maximum seconds to wait for a page load (--wait network).')
+    parser.add_argument('--no_analysis', action='store_true', default=False, help='Don\'t analyze traces while capturing them (analyze them later with -t).')
+    parser.add_argument('--analysis_queue', default=16, type=int, help='Most captured traces waiting for analysis before trials pause to let it catch up.')
     parser.add_argument('-t', '--tracedir', help='Directory of pcap traces to analyze.')
-    parser.add_argument('-r', '--resultfiles', nargs='+', help='Pickled result files to compare.')
-    parser.add_argument('-s', '--device', help='Specific android device ID (from "adb devices").')
+    parser.add_argument('--hash', action='store_true', default=False, help='When a trace\'s size or mtime changes, check its contents (SHA-1) before re-analyzing it.')
+    parser.add_argument('--tshark', action='store_true', default=False, help='Analyze traces with tshark instead of the built-in pcap reader.')
+    parser.add_argument('--campaign', help='Campaign name to store analysis results under. Defaults to the name of the trace directory.')
+    parser.add_argument('-r', '--resultfiles', nargs='+', help='Result files to compare (results.sqlite, or pickled results from older versions).')
+    parser.add_argument('-u', '--urls', nargs='+', help='Only compare these URLs (as they appear in trace names).')
+    parser.add_argument('-s', '--devices', nargs='+', help='Specific android device ID(s) (from "adb devices"). Defaults to all attached devices.')
+    parser.add_argument('--resume', action='store_true', default=False, help='Continue an interrupted campaign in the same output directory: skip the trials its journal says finished, and run the ones that failed or never ran.')
+    parser.add_argument('--transport', choices=sorted(TRANSPORTS.keys()), default=AdbTransport.name, help='How to drive the devices: over adb, or simulate them in-process (synthetic traces, no hardware needed).')
+    parser.add_argument('--sim_devices', default=10, type=int, help='Number of virtual devices, if no -s is given (--transport sim).')
+    parser.add_argument('--sim_latency', default=0.05, type=float, help='Mean seconds each device operation takes (--transport sim).')
+    parser.add_argument('--sim_failure_rate', default=0.0, type=float, help='Fraction of device operations that fail (--transport sim).')
+    parser.add_argument('--sim_load_seconds', default=1.0, type=float, help='Mean seconds a page takes to load (--transport sim).')
+    parser.add_argument('--attempts', default=1, type=int, help='Number of times to try each trial (on any device) before giving up on it.')
     parser.add_argument('-q', '--quiet', action='store_true', default=False, help='only print errors')
     parser.add_argument('-v', '--verbose', action='store_true', default=False, help='print debug info. --quiet wins if both are present')
     args = parser.parse_args()
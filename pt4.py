@@ -0,0 +1,170 @@
+#! /usr/bin/env python
+
+'''In-process reader for Monsoon Power Monitor PT4 files.
+
+The file is memory-mapped and the raw sample records are viewed as a NumPy
+array, so samples are decoded in bulk rather than one Python object at a time.
+Decoded samples are structured arrays with SAMPLE_DTYPE fields: time (seconds
+since the start of the capture), main, usb and aux current (mA) and main
+voltage (V). Missing channels and dropped samples are NaN.
+
+The layout follows Monsoon's PT4 documentation (and Brown's pt4utils).
+'''
+
+import os
+import mmap
+import struct
+import numpy
+
+# fixed-size file header (little-endian, no padding)
+HEADER_FORMAT = '<i20siq20siifif3i30s10siiqHHHHHHHHQQ'
+HEADER_FIELDS = ('head_size', 'name', 'battery_size', 'capture_date',
+    'serial_number', 'calibration_status', 'vout_setting', 'vout_value',
+    'hardware_rate', 'software_rate', 'power_field', 'current_field',
+    'voltage_field', 'capture_setting', 'sw_version', 'run_mode',
+    'exit_code', 'total_count', 'status_offset', 'status_size',
+    'sample_offset', 'sample_size', 'initial_main_voltage',
+    'initial_usb_voltage', 'initial_aux_voltage', 'capture_data_mask',
+    'sample_count', 'missing_count')
+
+DEFAULT_SAMPLE_OFFSET = 1024
+DEFAULT_SAMPLE_RATE = 5000
+
+# bits of capture_data_mask: which current channels each record contains
+CHANNEL_MAIN = 0x1000
+CHANNEL_USB = 0x2000
+CHANNEL_AUX = 0x4000
+
+MISSING_RAW_CURRENT = -32767   # 0x8001 as int16
+MISSING_RAW_VOLTAGE = 0xffff
+COARSE_MASK = 1
+COARSE_SCALE_MA = 0.250        # coarse samples: 1 unit = 250 uA
+FINE_SCALE_MA = 0.001          # fine samples: 1 unit = 1 uA
+VOLTAGE_SCALE_V = 125e-6       # 1 unit = 125 uV
+
+SAMPLE_DTYPE = numpy.dtype([
+    ('time', 'f8'),
+    ('main', 'f4'),
+    ('usb', 'f4'),
+    ('aux', 'f4'),
+    ('voltage', 'f4'),
+])
+
+DEFAULT_CHUNK_SAMPLES = 1000000
+
+
+class Pt4Error(Exception):
+    pass
+
+
+def read_header(buf):
+    '''Return the PT4 file header as a dict'''
+    size = struct.calcsize(HEADER_FORMAT)
+    if len(buf) < size:
+        raise Pt4Error('truncated PT4 header')
+    header = dict(zip(HEADER_FIELDS, struct.unpack_from(HEADER_FORMAT, buf, 0)))
+    for key in ('name', 'serial_number', 'capture_setting', 'sw_version'):
+        header[key] = header[key].split(b'\0')[0].decode('ascii', 'replace')
+    return header
+
+
+def _raw_dtype(capture_data_mask):
+    '''dtype of one on-disk sample record for the given channel mask'''
+    fields = []
+    if capture_data_mask & CHANNEL_MAIN:
+        fields.append(('main', '<i2'))
+    if capture_data_mask & CHANNEL_USB:
+        fields.append(('usb', '<i2'))
+    if capture_data_mask & CHANNEL_AUX:
+        fields.append(('aux', '<i2'))
+    fields.append(('voltage', '<u2'))
+    return numpy.dtype(fields)
+
+
+def _convert_current(raw):
+    '''Raw int16 current samples -> mA (NaN where missing)'''
+    coarse = (raw & COARSE_MASK) != 0
+    current = numpy.where(coarse, (raw & ~COARSE_MASK) * COARSE_SCALE_MA,
+        raw * FINE_SCALE_MA).astype(numpy.float32)
+    current[raw == MISSING_RAW_CURRENT] = numpy.nan
+    return current
+
+
+def _convert(raw, first_index, rate):
+    samples = numpy.empty(len(raw), dtype=SAMPLE_DTYPE)
+    samples['time'] = (numpy.arange(len(raw)) + first_index) / float(rate)
+    for channel in ('main', 'usb', 'aux'):
+        if channel in raw.dtype.names:
+            samples[channel] = _convert_current(raw[channel])
+        else:
+            samples[channel] = numpy.nan
+    voltage = raw['voltage']
+    samples['voltage'] = voltage * VOLTAGE_SCALE_V
+    samples['voltage'][voltage == MISSING_RAW_VOLTAGE] = numpy.nan
+    return samples
+
+
+class Pt4File(object):
+    '''A memory-mapped PT4 file. Samples are decoded on request.'''
+    def __init__(self, filepath):
+        self.filename = os.path.split(filepath)[1]
+        self._file = open(filepath, 'rb')
+        self._mmap = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        self.header = read_header(self._mmap)
+
+        self._raw_dtype = _raw_dtype(self.header['capture_data_mask'])
+        sample_size = self.header['sample_size'] or self._raw_dtype.itemsize
+        if sample_size != self._raw_dtype.itemsize:
+            raise Pt4Error('sample size %i does not match channel mask 0x%04x' %
+                (sample_size, self.header['capture_data_mask']))
+        offset = self.header['sample_offset'] or DEFAULT_SAMPLE_OFFSET
+        count = (len(self._mmap) - offset) // sample_size
+        self._raw = numpy.frombuffer(self._mmap, dtype=self._raw_dtype,
+            count=count, offset=offset)
+
+    def close(self):
+        self._raw = None
+        self._mmap.close()
+        self._file.close()
+
+    def _get_sample_rate(self):
+        return self.header['hardware_rate'] or DEFAULT_SAMPLE_RATE
+    sample_rate = property(_get_sample_rate)
+
+    def _get_num_samples(self):
+        return len(self._raw)
+    num_samples = property(_get_num_samples)
+
+    def _get_duration_seconds(self):
+        # time of the last sample relative to the first, as for CSV logs
+        return max(self.num_samples - 1, 0) / float(self.sample_rate)
+    duration_seconds = property(_get_duration_seconds)
+
+    def samples(self, start=0, stop=None):
+        '''Decode samples [start, stop) into a SAMPLE_DTYPE array'''
+        start, stop, _ = slice(start, stop).indices(self.num_samples)
+        return _convert(self._raw[start:stop], start, self.sample_rate)
+
+    def iter_chunks(self, chunk_samples=DEFAULT_CHUNK_SAMPLES):
+        '''Yield decoded samples chunk_samples at a time'''
+        for start in range(0, self.num_samples, chunk_samples):
+            yield self.samples(start, start + chunk_samples)
+
+
+def read_samples(filepath):
+    '''Decode all samples in a PT4 file into a SAMPLE_DTYPE array'''
+    pt4 = Pt4File(filepath)
+    try:
+        return pt4.samples()
+    finally:
+        pt4.close()
+
+
+def iter_samples(filepath, chunk_samples=DEFAULT_CHUNK_SAMPLES):
+    '''Yield the decoded samples of a PT4 file chunk_samples at a time'''
+    pt4 = Pt4File(filepath)
+    try:
+        for chunk in pt4.iter_chunks(chunk_samples):
+            yield chunk
+    finally:
+        pt4.close()
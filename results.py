@@ -0,0 +1,309 @@
+#! /usr/bin/env python
+
+'''Persistent storage for trace analysis results.'''
+
+import os
+import sqlite3
+import hashlib
+import logging
+import argparse
+import cPickle
+import numpy
+
+from flows import FLOW_DTYPE
+
+TRACE_CACHE_FILE = 'analysis_cache.pickle'
+TRACE_CACHE_VERSION = 2
+RESULTS_FILE = 'results.sqlite'
+
+# per-page breakdown columns of the results table (see flows.summarize_flows)
+PAGE_COLUMNS = [('connections', 'INTEGER'), ('tls_connections', 'INTEGER'),
+    ('dns_queries', 'INTEGER'), ('dns_seconds', 'REAL'),
+    ('handshake_seconds', 'REAL'), ('tls_seconds', 'REAL'),
+    ('ttfb_seconds', 'REAL'), ('proxy_bytes', 'INTEGER'), ('proxy_share', 'REAL')]
+
+# most URLs bound in one query; SQLite allows 999 variables per statement
+# by default, and the campaign takes one
+MAX_QUERY_URLS = 900
+
+FLOW_COLUMNS = [(name, 'TEXT' if FLOW_DTYPE[name].kind == 'S' else
+    'REAL' if FLOW_DTYPE[name].kind == 'f' else 'INTEGER') for name in FLOW_DTYPE.names]
+
+
+def file_hash(path, blocksize=1 << 20):
+    '''SHA-1 of a file's contents'''
+    h = hashlib.sha1()
+    with open(path, 'rb') as f:
+        block = f.read(blocksize)
+        while block:
+            h.update(block)
+            block = f.read(blocksize)
+    f.closed
+    return h.hexdigest()
+
+
+class TraceCache(object):
+    '''Per-trace analysis results, kept in a pickle in the trace directory.
+
+    Entries are keyed by trace file name and remember the file's size and
+    mtime (and, if hashing is on, its SHA-1). A trace only needs analyzing if
+    it is new or its size or mtime changed -- and, with hashing, only if no
+    cached trace has the same contents.'''
+    def __init__(self, path):
+        self.path = path
+        self._entries = {}  # name -> dict(size, mtime, hash, result)
+        if os.path.isfile(path):
+            try:
+                with open(path, 'rb') as f:
+                    version, entries = cPickle.load(f)
+                f.closed
+                if version == TRACE_CACHE_VERSION:
+                    self._entries = entries
+            except Exception as e:
+                logging.warn('Ignoring unreadable analysis cache %s: %s', path, e)
+
+    def __len__(self):
+        return len(self._entries)
+
+    def refresh(self, traces, use_hash=False):
+        '''Bring the cache in line with traces: forget traces that are gone,
+        reuse results for unchanged ones, and return the traces that still
+        need to be analyzed'''
+        names = dict((os.path.basename(trace), trace) for trace in traces)
+        for name in self._entries.keys():
+            if name not in names:
+                del self._entries[name]
+
+        changed = []
+        for name, trace in sorted(names.items()):
+            st = os.stat(trace)
+            entry = self._entries.get(name)
+            if entry is not None and entry['size'] == st.st_size and entry['mtime'] == st.st_mtime:
+                if use_hash and entry['hash'] is None:
+                    entry['hash'] = file_hash(trace)  # once, for traces cached without one
+                continue
+            changed.append((name, trace, st))
+
+        by_hash = {}
+        if use_hash:
+            for entry in self._entries.values():
+                if entry['hash'] is not None:
+                    by_hash[entry['hash']] = entry
+
+        stale = []
+        for name, trace, st in changed:
+            digest = file_hash(trace) if use_hash else None
+            if digest is not None and digest in by_hash:
+                # same contents as a trace we've already analyzed
+                self._entries[name] = dict(by_hash[digest], size=st.st_size, mtime=st.st_mtime)
+                continue
+
+            self._entries[name] = dict(size=st.st_size, mtime=st.st_mtime, hash=digest, result=None)
+            stale.append(trace)
+        return stale
+
+    def add(self, trace, result, use_hash=False):
+        '''Record the result of a trace analyzed outside of refresh()'''
+        st = os.stat(trace)
+        self._entries[os.path.basename(trace)] = dict(size=st.st_size,
+            mtime=st.st_mtime, hash=file_hash(trace) if use_hash else None,
+            result=result)
+
+    def update(self, trace, result):
+        self._entries[os.path.basename(trace)]['result'] = result
+
+    def result(self, trace):
+        entry = self._entries.get(os.path.basename(trace))
+        return entry['result'] if entry is not None else None
+
+    def save(self):
+        # write a temp file and rename it so a crash can't leave half a cache
+        tmp = self.path + '.tmp'
+        with open(tmp, 'wb') as f:
+            cPickle.dump((TRACE_CACHE_VERSION, self._entries), f, cPickle.HIGHEST_PROTOCOL)
+        f.closed
+        os.rename(tmp, self.path)
+
+
+class ResultStore(object):
+    '''Per-trial page load results in an SQLite database: one row per
+    (campaign, url, trial) with the page load time (seconds), bytes
+    transferred and the page's breakdown (PAGE_COLUMNS), plus a flows table
+    with one row per connection of each trial. Rows are indexed by URL, so a
+    subset of URLs (or just the columns needed) can be read without loading
+    the whole file.'''
+    def __init__(self, path=':memory:'):
+        self.path = path
+        self._db = sqlite3.connect(path)
+        self._page_columns = [name for name, _ in PAGE_COLUMNS]
+        self._db.execute('''CREATE TABLE IF NOT EXISTS results (
+            campaign TEXT NOT NULL,
+            url TEXT NOT NULL,
+            trial INTEGER,
+            plt REAL,
+            bytes INTEGER)''')
+        # stores written before breakdowns existed lack their columns
+        existing = [row[1] for row in self._db.execute('PRAGMA table_info(results)')]
+        for name, kind in PAGE_COLUMNS:
+            if name not in existing:
+                self._db.execute('ALTER TABLE results ADD COLUMN %s %s' % (name, kind))
+        self._db.execute('''CREATE TABLE IF NOT EXISTS flows (
+            campaign TEXT NOT NULL,
+            url TEXT NOT NULL,
+            trial INTEGER,
+            %s)''' % ',\n            '.join('%s %s' % column for column in FLOW_COLUMNS))
+        self._db.execute('CREATE INDEX IF NOT EXISTS results_url ON results (url)')
+        self._db.execute('CREATE INDEX IF NOT EXISTS results_campaign_url ON results (campaign, url)')
+        self._db.execute('CREATE INDEX IF NOT EXISTS flows_campaign_url ON flows (campaign, url)')
+        self._db.commit()
+
+    def close(self):
+        self._db.close()
+
+    def _insert(self, campaign, rows, flows):
+        self._db.executemany('INSERT INTO results (campaign, url, trial, plt, bytes, %s) VALUES (%s)' %
+            (', '.join(self._page_columns), ', '.join('?' * (5 + len(self._page_columns)))),
+            ((campaign, url, trial, plt, size) +
+                tuple((breakdown or {}).get(name) for name in self._page_columns)
+                for url, trial, plt, size, breakdown in rows))
+        self._db.executemany('INSERT INTO flows VALUES (%s)' %
+            ', '.join('?' * (3 + len(FLOW_COLUMNS))),
+            ((campaign, url, trial) + tuple(_sql_value(value) for value in flow)
+                for url, trial, table in flows for flow in table.tolist()))
+
+    def replace_campaign(self, campaign, rows, flows=()):
+        '''Replace all results for campaign with rows of (url, trial, plt,
+        bytes, breakdown), where breakdown is a dict of PAGE_COLUMNS values (or
+        None), and flows with (url, trial, flow table) for each trial'''
+        with self._db:
+            self._db.execute('DELETE FROM results WHERE campaign = ?', (campaign,))
+            self._db.execute('DELETE FROM flows WHERE campaign = ?', (campaign,))
+            self._insert(campaign, rows, flows)
+
+    def add_trial(self, campaign, url, trial, plt, size, breakdown=None, flows=None):
+        '''Add (or replace) the results of one trial'''
+        with self._db:
+            for table in ('results', 'flows'):
+                self._db.execute('DELETE FROM %s WHERE campaign = ? AND url = ? AND trial = ?' % table,
+                    (campaign, url, trial))
+            self._insert(campaign, [(url, trial, plt, size, breakdown)],
+                [(url, trial, flows)] if flows is not None else [])
+
+    def campaigns(self):
+        return [row[0] for row in
+            self._db.execute('SELECT DISTINCT campaign FROM results ORDER BY campaign')]
+
+    def _select(self, table, columns, campaign, urls):
+        sql = 'SELECT %s FROM %s' % (', '.join(columns), table)
+        where = []
+        params = []
+        if campaign is not None:
+            where.append('campaign = ?')
+            params.append(campaign)
+        if urls is None:
+            if len(where) > 0:
+                sql += ' WHERE ' + ' AND '.join(where)
+            rows = self._db.execute(sql, params).fetchall()
+        else:
+            # one query per batch of URLs, to stay under SQLite's limit on
+            # bound variables
+            urls = list(urls)
+            rows = []
+            for i in range(0, len(urls), MAX_QUERY_URLS):
+                batch = urls[i:i+MAX_QUERY_URLS]
+                rows.extend(self._db.execute(sql + ' WHERE ' + ' AND '.join(where +
+                    ['url IN (%s)' % ', '.join('?' * len(batch))]),
+                    params + batch).fetchall())
+        return dict((column, numpy.array([row[i] for row in rows]))
+            for i, column in enumerate(columns))
+
+    def query(self, columns, campaign=None, urls=None):
+        '''Return a dict of column name -> NumPy array for the rows matching
+        campaign and urls (None matches everything)'''
+        return self._select('results', columns, campaign, urls)
+
+    def query_flows(self, columns, campaign=None, urls=None):
+        '''Like query, for the per-flow table'''
+        return self._select('flows', columns, campaign, urls)
+
+    def import_pickle(self, pickle_path, campaign=None):
+        '''Load a results.pickle written by older versions of analyze_traces.
+        Those don't record trial numbers; trials are numbered in list order.'''
+        if campaign is None:
+            campaign = os.path.splitext(os.path.split(pickle_path)[1])[0]
+        with open(pickle_path, 'rb') as f:
+            url_to_plts, url_to_sizes = cPickle.load(f)
+        f.closed
+
+        rows = []
+        for url, plts in url_to_plts.iteritems():
+            for trial, (plt, size) in enumerate(zip(plts, url_to_sizes[url])):
+                rows.append((url, trial, plt, size, None))
+        self.replace_campaign(campaign, rows)
+        return campaign
+
+
+def _sql_value(value):
+    '''NaN (a phase that wasn't seen) is stored as NULL'''
+    if isinstance(value, float) and value != value:
+        return None
+    return value
+
+
+def open_results(result_file):
+    '''Open a result file for reading: an SQLite store, or a legacy pickle
+    (imported into memory, under a campaign named after the file)'''
+    if result_file.endswith('.pickle'):
+        store = ResultStore()
+        store.import_pickle(result_file)
+        return store
+    return ResultStore(result_file)
+
+
+def group_stats(keys, values):
+    '''Mean and median of values for each distinct key. Returns (unique
+    keys, means, medians).'''
+    unique, codes = numpy.unique(keys, return_inverse=True)
+    values = numpy.asarray(values, dtype=numpy.float64)
+    counts = numpy.bincount(codes)
+    means = numpy.bincount(codes, weights=values) / counts
+
+    # sort by (key, value); each key's median is in the middle of its run
+    order = numpy.lexsort((values, codes))
+    ordered = values[order]
+    starts = numpy.cumsum(counts) - counts
+    medians = (ordered[starts + (counts - 1) // 2] + ordered[starts + counts // 2]) / 2.0
+    return unique, means, medians
+
+
+def main():
+    store = ResultStore(args.store)
+    for pickle_path in args.pickles:
+        campaign = store.import_pickle(pickle_path)
+        logging.info('Imported %s as campaign %s', pickle_path, campaign)
+    store.close()
+
+
+if __name__ == "__main__":
+    # set up command line args
+    parser = argparse.ArgumentParser(formatter_class=argparse.ArgumentDefaultsHelpFormatter,\
+                                     description='Import pickled results (from older versions of probe.py) into a result store.')
+    parser.add_argument('pickles', nargs='+', help='results.pickle file(s) to import; each becomes a campaign named after the file.')
+    parser.add_argument('-o', '--store', default=RESULTS_FILE, help='Result store (SQLite) to import into.')
+    parser.add_argument('-q', '--quiet', action='store_true', default=False, help='only print errors')
+    parser.add_argument('-v', '--verbose', action='store_true', default=False, help='print debug info. --quiet wins if both are present')
+    args = parser.parse_args()
+
+    # set up logging
+    if args.quiet:
+        level = logging.WARNING
+    elif args.verbose:
+        level = logging.DEBUG
+    else:
+        level = logging.INFO
+    logging.basicConfig(
+        format = "%(levelname) -10s %(asctime)s %(module)s:%(lineno) -7s %(message)s",
+        level = level
+    )
+
+    main()
@@ -0,0 +1,146 @@
+#! /usr/bin/env python
+
+'''Run a campaign of (url, trial) jobs on several Android devices at once.
+
+Jobs sit in one shared queue and each device gets a worker thread that pulls
+the next job whenever it is idle, so fast devices naturally take work that
+slow ones haven't reached. A device that fails too many trials in a row is
+taken out of rotation.
+'''
+
+import time
+import logging
+import threading
+import Queue
+
+
+class DeviceStats(object):
+    def __init__(self, device):
+        self.device = device
+        self.succeeded = 0
+        self.failed = 0
+        self.busy_seconds = 0.0
+        self.retired = False
+
+    def _get_trials_per_hour(self):
+        if self.busy_seconds == 0:
+            return 0.0
+        return self.succeeded * 3600.0 / self.busy_seconds
+    trials_per_hour = property(_get_trials_per_hour)
+
+    def __repr__(self):
+        return self.__str__()
+
+    def __str__(self):
+        return '%s: %i ok, %i failed, %.1f trials/hour%s' % (self.device,
+            self.succeeded, self.failed, self.trials_per_hour,
+            ' (retired)' if self.retired else '')
+
+
+class CampaignScheduler(object):
+    def __init__(self, devices, run_trial, max_attempts=1,
+                 max_consecutive_failures=3, on_done=None):
+        '''run_trial(url, device, trial) runs one trial and returns True if it
+        succeeded. A failed job is put back on the queue until it has been
+        tried max_attempts times. A device is retired after
+        max_consecutive_failures failures in a row. If given, on_done(url,
+        trial, ok) is called once a job is finished for good (it succeeded or
+        ran out of attempts) and returns more (url, trial) jobs to run.'''
+        self._devices = list(devices)
+        self._run_trial = run_trial
+        self._on_done = on_done
+        self._max_attempts = max_attempts
+        self._max_consecutive_failures = max_consecutive_failures
+        self._queue = Queue.Queue()
+        self._lock = threading.Lock()
+        self._in_flight = 0  # jobs being run (which may come back on failure)
+        self.stats = dict((device, DeviceStats(device)) for device in self._devices)
+        self.abandoned = []  # jobs that ran out of attempts
+
+    def run(self, jobs):
+        '''Run an iterable of (url, trial) jobs; returns per-device stats'''
+        for url, trial in jobs:
+            self._queue.put((url, trial, 0))
+
+        threads = []
+        for device in self._devices:
+            thread = threading.Thread(target=self._worker, args=(device,),
+                name='device-%s' % device)
+            thread.daemon = True
+            thread.start()
+            threads.append(thread)
+
+        # join with a timeout so KeyboardInterrupt still reaches us
+        while any(thread.is_alive() for thread in threads):
+            for thread in threads:
+                thread.join(1)
+
+        leftover = self._queue.qsize()
+        if leftover > 0:
+            logging.error('All devices retired; %i jobs were not run', leftover)
+        return self.stats
+
+    def _worker(self, device):
+        stats = self.stats[device]
+        consecutive_failures = 0
+        while True:
+            with self._lock:
+                try:
+                    url, trial, attempts = self._queue.get_nowait()
+                    self._in_flight += 1
+                except Queue.Empty:
+                    if self._in_flight == 0:
+                        return
+                    # a job running on another device may still be requeued
+                    url = None
+            if url is None:
+                time.sleep(0.5)
+                continue
+
+            start = time.time()
+            try:
+                ok = self._run_trial(url, device, trial)
+            except Exception as e:
+                logging.error('[%s] Unexpected error loading %s (trial %i): %s',
+                    device, url, trial, e)
+                ok = False
+            elapsed = time.time() - start
+
+            more = []
+            if self._on_done is not None and (ok or attempts + 1 >= self._max_attempts):
+                try:
+                    more = self._on_done(url, trial, ok)
+                except Exception as e:
+                    logging.error('Error scheduling more trials of %s: %s', url, e)
+
+            with self._lock:
+                # queue follow-up jobs before this one stops counting as in
+                # flight, so idle workers don't exit in between
+                for next_url, next_trial in more:
+                    self._queue.put((next_url, next_trial, 0))
+                self._in_flight -= 1
+                stats.busy_seconds += elapsed
+                if ok:
+                    stats.succeeded += 1
+                    consecutive_failures = 0
+                    continue
+
+                stats.failed += 1
+                consecutive_failures += 1
+                if attempts + 1 < self._max_attempts:
+                    self._queue.put((url, trial, attempts + 1))
+                else:
+                    self.abandoned.append((url, trial))
+
+                if consecutive_failures >= self._max_consecutive_failures:
+                    logging.warn('[%s] %i failures in a row; taking device out of rotation',
+                        device, consecutive_failures)
+                    stats.retired = True
+                    return
+
+    def report(self):
+        '''Log per-device throughput'''
+        for device in self._devices:
+            logging.info('%s', self.stats[device])
+        if len(self.abandoned) > 0:
+            logging.warn('%i trials failed on every attempt', len(self.abandoned))
@@ -0,0 +1,234 @@
+#! /usr/bin/env python
+
+'''Deterministic synthetic inputs for exercising the analysis offline.
+
+Packet traces look like rmnet0 captures of a page load (raw IP): a DNS
+lookup, then num_flows TCP connections, each with a handshake, a TLS
+ClientHello (port 443) or plain request, and a response of bytes_per_flow
+bytes in MSS-sized segments. Power logs are a baseline current with noise and
+occasional bursts, optionally framed by signal_spikes-style bookends (with
+loads timed like loadpages.sh's in between), written as Monsoon CSV or PT4
+files. The same arguments (and seed) always produce the
+same file.
+'''
+
+import struct
+import logging
+import argparse
+import numpy
+
+import pt4
+from flows import DNS_PORT, TLS_PORT, PROXY_PORT, SYN, ACK, TLS_HANDSHAKE, TLS_APPLICATION_DATA
+
+LINKTYPE_RAW = 101
+CLIENT = '\x0a\x00\x00\x02'     # 10.0.0.2
+RESOLVER = '\x08\x08\x08\x08'   # 8.8.8.8
+PSH = 0x08
+
+# bookend timing, as in loadcommon.sh and loadpages.sh: signal_spikes runs
+# three bursts of CPU work, sleeping SPIKE_PAUSE_SECONDS after each, and the
+# script sleeps SCRIPT_GAP_SECONDS between a bookend and the loads
+SPIKE_LEAD_SECONDS = 1.0
+SPIKE_BURST_SECONDS = 1.0
+SPIKE_PAUSE_SECONDS = 2.0
+SCRIPT_GAP_SECONDS = 5.0
+
+PCAP_HEADER = struct.pack('<IHHiIII', 0xa1b2c3d4, 2, 4, 0, 0, 65535, LINKTYPE_RAW)
+PCAP_RECORD = struct.Struct('<IIII')
+IPV4_HEADER = struct.Struct('>BBHHHBBH4s4s')
+TCP_HEADER = struct.Struct('>HHIIBBHHH')
+UDP_HEADER = struct.Struct('>HHHH')
+
+
+def _ipv4(src, dst, proto, l4):
+    return IPV4_HEADER.pack(0x45, 0, 20 + len(l4), 0, 0, 64, proto, 0, src, dst) + l4
+
+def _tcp(src, dst, sport, dport, flags, payload=''):
+    return _ipv4(src, dst, 6, TCP_HEADER.pack(sport, dport, 0, 0, 5 << 4, flags,
+        65535, 0, 0) + payload)
+
+def _udp(src, dst, sport, dport, payload):
+    return _ipv4(src, dst, 17, UDP_HEADER.pack(sport, dport, 8 + len(payload), 0) + payload)
+
+
+def trace_packets(num_flows=10, bytes_per_flow=100000, mss=1400, rtt=0.05,
+                  bandwidth=1e6, proxy_share=0.0, tls=True, seed=0):
+    '''Return the packets of a synthetic page load as (time, bytes) pairs,
+    in time order. bandwidth (bytes/second) paces each flow's response;
+    proxy_share of the flows go to the proxy port instead.'''
+    rng = numpy.random.RandomState(seed)
+    packets = []
+    t = 1400000000.0
+    packets.append((t, _udp(CLIENT, RESOLVER, 40000, DNS_PORT, 'q' * 32)))
+    packets.append((t + rtt, _udp(RESOLVER, CLIENT, DNS_PORT, 40000, 'r' * 64)))
+
+    segment = '\0' * mss
+    for i in range(num_flows):
+        server = struct.pack('>I', 0x5db8d800 + i)
+        sport = 50000 + i
+        if rng.random_sample() < proxy_share:
+            dport = PROXY_PORT
+        else:
+            dport = TLS_PORT if tls else 80
+        secure = dport == TLS_PORT
+        t = packets[1][0] + rng.uniform(0, 2 * rtt * num_flows)
+
+        packets.append((t, _tcp(CLIENT, server, sport, dport, SYN)))
+        t += rtt
+        packets.append((t, _tcp(server, CLIENT, dport, sport, SYN | ACK)))
+        packets.append((t, _tcp(CLIENT, server, sport, dport, ACK)))
+        if secure:
+            packets.append((t, _tcp(CLIENT, server, sport, dport, PSH | ACK,
+                chr(TLS_HANDSHAKE) + '\x03\x01' + 'h' * 200)))
+            t += rtt
+            packets.append((t, _tcp(server, CLIENT, dport, sport, PSH | ACK,
+                chr(TLS_HANDSHAKE) + '\x03\x03' + 's' * 1000)))
+            t += rtt  # key exchange and Finished
+            request = chr(TLS_APPLICATION_DATA) + '\x03\x03' + 'g' * 300
+        else:
+            request = 'GET / HTTP/1.1\r\n\r\n'
+        packets.append((t, _tcp(CLIENT, server, sport, dport, PSH | ACK, request)))
+        t += rtt
+
+        # response segments, paced at bandwidth
+        gap = mss / float(bandwidth)
+        for n in range(max(bytes_per_flow // mss, 1)):
+            packets.append((t + n * gap, _tcp(server, CLIENT, dport, sport, ACK, segment)))
+            if n % 2 == 1:
+                packets.append((t + n * gap, _tcp(CLIENT, server, sport, dport, ACK)))
+
+    packets.sort(key=lambda packet: packet[0])
+    return packets
+
+def write_pcap(path, **kwargs):
+    '''Write a synthetic page load trace (see trace_packets); returns the
+    number of packets'''
+    packets = trace_packets(**kwargs)
+    with open(path, 'wb') as f:
+        f.write(PCAP_HEADER)
+        for t, data in packets:
+            sec = int(t)
+            f.write(PCAP_RECORD.pack(sec, int(round((t - sec) * 1e6)), len(data), len(data)))
+            f.write(data)
+    f.closed
+    return len(packets)
+
+
+def bookend_bursts(seconds):
+    '''Start times of the six signal_spikes bursts framing a synthetic log
+    of seconds: three from SPIKE_LEAD_SECONDS in, and three ending with the
+    log (the last one's pause included)'''
+    period = SPIKE_BURST_SECONDS + SPIKE_PAUSE_SECONDS
+    return numpy.append(SPIKE_LEAD_SECONDS + period * numpy.arange(3),
+        seconds - period * numpy.arange(3, 0, -1))
+
+def load_starts(seconds, load_seconds):
+    '''Start times of the loads between the bookends of a synthetic log of
+    seconds, one every load_seconds: the first SPIKE_PAUSE_SECONDS +
+    SCRIPT_GAP_SECONDS after the opening bookend's last burst, and the last
+    one running until SCRIPT_GAP_SECONDS before the closing bookend's
+    first'''
+    bursts = bookend_bursts(seconds)
+    first = bursts[2] + SPIKE_BURST_SECONDS + SPIKE_PAUSE_SECONDS + SCRIPT_GAP_SECONDS
+    end = bursts[3] - SCRIPT_GAP_SECONDS
+    return first + load_seconds * numpy.arange(max(int((end - first) // load_seconds), 1))
+
+def current_profile(rate=5000, seconds=60, baseline_mA=100.0, bursts=10,
+                    bookends=False, load_seconds=None, seed=0):
+    '''Return (times, currents) of a synthetic power log: baseline_mA plus
+    noise, with bursts of higher current at random times. With bookends, the
+    log starts and ends with signal_spikes bursts (see bookend_bursts); with
+    load_seconds too, the random bursts are replaced by loads (see
+    load_starts), each a step of 50, 100 or 150 mA above baseline_mA.'''
+    rng = numpy.random.RandomState(seed)
+    n = int(rate * seconds)
+    times = numpy.arange(n) / float(rate)
+    currents = baseline_mA + rng.normal(0, baseline_mA * 0.05, n)
+    if bookends and load_seconds is not None:
+        starts = load_starts(seconds, load_seconds)
+        ends = numpy.append(starts[1:], bookend_bursts(seconds)[3] - SCRIPT_GAP_SECONDS)
+        for i, (start, end) in enumerate(zip(starts, ends)):
+            currents[(times >= start) & (times < end)] += 50.0 * (1 + i % 3)
+    else:
+        for start in rng.uniform(0, seconds, bursts):
+            length = rng.uniform(0.5, 3.0)
+            currents[(times >= start) & (times < start + length)] += rng.uniform(100, 300)
+    if bookends:
+        for offset in bookend_bursts(seconds):
+            currents[(times >= offset) & (times < offset + SPIKE_BURST_SECONDS)] = baseline_mA * 6
+    return times, currents
+
+def write_power_csv(path, **kwargs):
+    '''Write a synthetic Monsoon CSV log (see current_profile); returns the
+    number of samples'''
+    times, currents = current_profile(**kwargs)
+    values = numpy.column_stack((times, currents, numpy.ones(len(times)) * 4.0))
+    with open(path, 'w') as f:
+        f.write('Time(s),Main(mA),Main Voltage(V)\n')
+        numpy.savetxt(f, values, fmt='%.6f,%.4f,%.2f')
+    f.closed
+    return len(times)
+
+def write_power_pt4(path, rate=5000, **kwargs):
+    '''Write a synthetic PT4 log (main channel only; see current_profile);
+    returns the number of samples'''
+    times, currents = current_profile(rate=rate, **kwargs)
+    n = len(times)
+    header = struct.pack(pt4.HEADER_FORMAT, pt4.DEFAULT_SAMPLE_OFFSET, 'synthetic',
+        0, 0, '', 0, 0, 4.0, rate, 0.0, 0, 0, 0, '', '', 0, 0, n, 0, 0,
+        pt4.DEFAULT_SAMPLE_OFFSET, 4, 0, 0, 0, pt4.CHANNEL_MAIN, n, 0)
+    raw = numpy.empty(n, dtype=[('main', '<i2'), ('voltage', '<u2')])
+    # coarse samples (low bit set), in COARSE_SCALE_MA steps
+    steps = numpy.round(currents / pt4.COARSE_SCALE_MA).astype(numpy.int16)
+    raw['main'] = (steps & ~pt4.COARSE_MASK) | pt4.COARSE_MASK
+    raw['voltage'] = int(4.0 / pt4.VOLTAGE_SCALE_V)
+    with open(path, 'wb') as f:
+        f.write(header.ljust(pt4.DEFAULT_SAMPLE_OFFSET, '\0'))
+        f.write(raw.tostring())
+    f.closed
+    return n
+
+
+def main():
+    if args.kind == 'pcap':
+        n = write_pcap(args.output, num_flows=args.flows, bytes_per_flow=args.flow_bytes,
+            proxy_share=args.proxy_share, seed=args.seed)
+        logging.info('Wrote %i packets to %s', n, args.output)
+    else:
+        write = write_power_csv if args.kind == 'csv' else write_power_pt4
+        n = write(args.output, rate=args.rate, seconds=args.seconds,
+            bookends=args.bookends, load_seconds=args.load_seconds, seed=args.seed)
+        logging.info('Wrote %i samples to %s', n, args.output)
+
+
+if __name__ == "__main__":
+    # set up command line args
+    parser = argparse.ArgumentParser(formatter_class=argparse.ArgumentDefaultsHelpFormatter,\
+                                     description='Generate synthetic traces and power monitor logs.')
+    parser.add_argument('kind', choices=['pcap', 'csv', 'pt4'], help='What to generate.')
+    parser.add_argument('output', help='File to write.')
+    parser.add_argument('--flows', default=10, type=int, help='TCP connections in the trace (pcap).')
+    parser.add_argument('--flow_bytes', default=100000, type=int, help='Response bytes per connection (pcap).')
+    parser.add_argument('--proxy_share', default=0.0, type=float, help='Fraction of connections to the proxy port (pcap).')
+    parser.add_argument('--rate', default=5000, type=int, help='Samples per second (csv, pt4).')
+    parser.add_argument('--seconds', default=60, type=float, help='Log duration (csv, pt4).')
+    parser.add_argument('--bookends', action='store_true', default=False, help='Frame the log with signal_spikes bursts (csv, pt4).')
+    parser.add_argument('--load_seconds', type=float, help='Time loads this long between the bookends, as loadpages.sh would, instead of random bursts (csv, pt4; with --bookends).')
+    parser.add_argument('--seed', default=0, type=int, help='Random seed.')
+    parser.add_argument('-q', '--quiet', action='store_true', default=False, help='only print errors')
+    parser.add_argument('-v', '--verbose', action='store_true', default=False, help='print debug info. --quiet wins if both are present')
+    args = parser.parse_args()
+
+    # set up logging
+    if args.quiet:
+        level = logging.WARNING
+    elif args.verbose:
+        level = logging.DEBUG
+    else:
+        level = logging.INFO
+    logging.basicConfig(
+        format = "%(levelname) -10s %(asctime)s %(module)s:%(lineno) -7s %(message)s",
+        level = level
+    )
+
+    main()
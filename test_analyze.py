@@ -0,0 +1,91 @@
+#! /usr/bin/env python
+
+'''Checks of analyze.py against synthetic power logs (see synthetic.py).
+
+Run with: python -m unittest test_analyze
+'''
+
+import os
+import shutil
+import tempfile
+import unittest
+import numpy
+
+import synthetic
+from analyze import PowerMonitorLog, read_window, window_stats
+
+SCRIPT_EPOCH = 1400000000  # when the synthetic run's log starts
+
+
+class SegmentTest(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def write_run(self, seconds, load_seconds):
+        '''Write a power log with bookends and loads timed like loadpages.sh's,
+        and the loadpages.log of the same run; return their paths'''
+        log_path = os.path.join(self.dir, 'run.csv')
+        synthetic.write_power_csv(log_path, rate=1000, seconds=seconds, bookends=True,
+            load_seconds=load_seconds)
+        script_path = os.path.join(self.dir, 'loadpages.log')
+        with open(script_path, 'w') as f:
+            f.write('%i\t========== Script Launched: ./loadpages.sh http urls ==========\n' % SCRIPT_EPOCH)
+            for i, start in enumerate(synthetic.load_starts(seconds, load_seconds)):
+                f.write('%i\thttp://example.com/%i\n' % (SCRIPT_EPOCH + start, i))
+        f.closed
+        return log_path, script_path
+
+    def test_boundaries_follow_script_timing(self):
+        log_path, script_path = self.write_run(59, 5)
+        segments = PowerMonitorLog(log_path, use_cache=False).segment(script_path)
+        starts = synthetic.load_starts(59, 5)
+        self.assertEqual(len(segments), len(starts))
+        # bursts are found to within the analysis' smoothing window
+        numpy.testing.assert_allclose(segments['start'], starts, atol=0.3)
+        numpy.testing.assert_allclose(segments['duration'], 5, atol=0.3)
+
+    def test_loads_get_their_own_charge(self):
+        log_path, script_path = self.write_run(89, 20)
+        segments = PowerMonitorLog(log_path, use_cache=False).segment(script_path)
+        # each load is a step of 50, 100 or 150 mA above the 100 mA baseline
+        expected = 100.0 + 50.0 * (1 + numpy.arange(len(segments)) % 3)
+        numpy.testing.assert_allclose(segments['charge_mC'] / segments['duration'],
+            expected, atol=5)
+
+
+class WindowTest(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def test_read_window_matches_log_window(self):
+        # a log with dropouts: non-positive samples don't count, but the
+        # span they're in does
+        times, currents = synthetic.current_profile(rate=1000, seconds=20)
+        currents[::7] = 0
+        currents[::11] = -5
+        path = os.path.join(self.dir, 'dropouts.csv')
+        with open(path, 'w') as f:
+            f.write('Time(s),Main(mA),Main Voltage(V)\n')
+            numpy.savetxt(f, numpy.column_stack((times, currents, numpy.ones(len(times)) * 4.0)),
+                fmt='%.6f,%.4f,%.2f')
+        f.closed
+
+        log = PowerMonitorLog(path, use_cache=False)
+        times, currents, seconds_per_sample = read_window(path, 5, 12, use_cache=False)
+        stats = window_stats(times, currents, seconds_per_sample, log.baseline)
+        expected = log.window(5, 12)
+        self.assertEqual(sorted(stats.keys()), sorted(expected.keys()))
+        for key in expected:
+            self.assertAlmostEqual(stats[key], expected[key], places=9, msg=key)
+        # and a window over the whole log charges what the log does
+        self.assertAlmostEqual(log.window(0, numpy.inf)['energy_uAh'], log.total_energy_uAh, places=9)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,166 @@
+#! /usr/bin/env python
+
+'''Per-trial phase timing.
+
+Each trial records when each of its phases (cleanup, capture start, browser
+launch, page wait, capture stop, fetch, error back-off, ...) started and
+ended, which condition ended its page load wait and after how long, how the
+trial turned out and, if it failed, in which phase and with what exception.
+probe.py appends the records as JSON lines to trials.jsonl in the trace
+directory, which is also its campaign journal (see journal.py); run this
+script on that file to see where a campaign's time went, per device and per
+URL.
+'''
+
+import json
+import time
+import logging
+import argparse
+from contextlib import contextmanager
+
+TRIALS_LOG = 'trials.jsonl'
+
+
+class TrialTimer(object):
+    def __init__(self, url, trial, device):
+        self.url = url
+        self.trial = trial
+        self.device = device
+        self.start = time.time()
+        self.phases = []    # dicts of name, start, end
+        self.error = None   # dict of phase, error (class name), message
+        self.completion = None    # what ended the page load wait (see completion.py)
+        self.wait_seconds = None  # how long the wait took
+        self.trace = None   # file name of the trial's trace
+
+    @contextmanager
+    def phase(self, name):
+        '''Time the enclosed block as phase name. The first exception raised
+        out of a phase is recorded as the trial's error.'''
+        start = time.time()
+        try:
+            yield
+        except Exception as e:
+            if self.error is None:
+                self.error = dict(phase=name, error=type(e).__name__, message=str(e))
+            raise
+        finally:
+            self.phases.append(dict(name=name, start=start, end=time.time()))
+
+    def complete(self, reason, seconds):
+        '''Note that the page load wait was ended by reason after seconds'''
+        self.completion = reason
+        self.wait_seconds = seconds
+
+    def record(self, ok):
+        return dict(url=self.url, trial=self.trial, device=self.device,
+            start=self.start, end=time.time(), outcome='ok' if ok else 'failed',
+            phases=self.phases, error=self.error, completion=self.completion,
+            wait_seconds=self.wait_seconds, trace=self.trace)
+
+def read_records(paths):
+    records = []
+    for path in paths:
+        with open(path, 'r') as f:
+            for line in f:
+                line = line.strip()
+                if line == '':
+                    continue
+                try:
+                    records.append(json.loads(line))
+                except ValueError:
+                    logging.warn('Skipping malformed line in %s', path)
+        f.closed
+    return records
+
+
+def summarize(records, key):
+    '''Time spent per phase for each value of key ('device' or 'url').
+    Returns {value: {'trials', 'failed', 'seconds', 'phases': {phase:
+    seconds}}}; time in a trial outside any phase counts as phase "other".'''
+    summary = {}
+    for record in records:
+        entry = summary.setdefault(record[key],
+            dict(trials=0, failed=0, seconds=0.0, phases={}))
+        wall = record['end'] - record['start']
+        entry['trials'] += 1
+        entry['failed'] += record['outcome'] != 'ok'
+        entry['seconds'] += wall
+        timed = 0.0
+        for phase in record['phases']:
+            seconds = phase['end'] - phase['start']
+            entry['phases'][phase['name']] = entry['phases'].get(phase['name'], 0.0) + seconds
+            timed += seconds
+        entry['phases']['other'] = entry['phases'].get('other', 0.0) + max(wall - timed, 0.0)
+    return summary
+
+def error_counts(records):
+    '''{(phase, error class): number of trials} for failed trials'''
+    counts = {}
+    for record in records:
+        if record['error'] is not None:
+            error = (record['error']['phase'], record['error']['error'])
+            counts[error] = counts.get(error, 0) + 1
+    return counts
+
+def completion_counts(records):
+    '''{completion reason: (number of trials, total wait seconds)} for trials
+    whose page load wait finished'''
+    counts = {}
+    for record in records:
+        if record.get('completion') is not None:
+            trials, seconds = counts.get(record['completion'], (0, 0.0))
+            counts[record['completion']] = (trials + 1, seconds + record['wait_seconds'])
+    return counts
+
+def format_summary(summary, key):
+    lines = []
+    for value, entry in sorted(summary.items(), key=lambda item: -item[1]['seconds']):
+        lines.append('%s %s: %i trials (%i failed), %.1f seconds' % (key, value,
+            entry['trials'], entry['failed'], entry['seconds']))
+        for phase, seconds in sorted(entry['phases'].items(), key=lambda item: -item[1]):
+            share = seconds / entry['seconds'] * 100 if entry['seconds'] > 0 else 0
+            lines.append('  %-14s %10.1f s  %5.1f%%' % (phase, seconds, share))
+    return '\n'.join(lines)
+
+
+def main():
+    records = read_records(args.logs)
+    logging.info('%i trials', len(records))
+    for key in args.by:
+        print format_summary(summarize(records, key), key)
+    completions = completion_counts(records)
+    if len(completions) > 0:
+        print 'PAGE LOAD WAITS ENDED BY'
+        for reason, (count, seconds) in sorted(completions.items(), key=lambda item: -item[1][0]):
+            print '  %-14s %6i trials, mean %.1f s' % (reason, count, seconds / count)
+    errors = error_counts(records)
+    if len(errors) > 0:
+        print 'ERRORS'
+        for (phase, error), count in sorted(errors.items(), key=lambda item: -item[1]):
+            print '  %-14s %-20s %i' % (phase, error, count)
+
+
+if __name__ == "__main__":
+    # set up command line args
+    parser = argparse.ArgumentParser(formatter_class=argparse.ArgumentDefaultsHelpFormatter,\
+                                     description='Summarize where campaign time went, from per-trial phase timings.')
+    parser.add_argument('logs', nargs='+', help='trials.jsonl file(s) written by probe.py.')
+    parser.add_argument('-b', '--by', nargs='+', choices=['device', 'url'], default=['device', 'url'], help='Group trials by device and/or URL.')
+    parser.add_argument('-q', '--quiet', action='store_true', default=False, help='only print errors')
+    parser.add_argument('-v', '--verbose', action='store_true', default=False, help='print debug info. --quiet wins if both are present')
+    args = parser.parse_args()
+
+    # set up logging
+    if args.quiet:
+        level = logging.WARNING
+    elif args.verbose:
+        level = logging.DEBUG
+    else:
+        level = logging.INFO
+    logging.basicConfig(
+        format = "%(levelname) -10s %(asctime)s %(module)s:%(lineno) -7s %(message)s",
+        level = level
+    )
+
+    main()
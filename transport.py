@@ -0,0 +1,154 @@
+#! /usr/bin/env python
+
+'''How the probe drives a device during a trial.
+
+A transport performs a trial's device operations: cleanup (kill tcpdump and
+the browser, clear the browser's cache and tabs), launching a URL, and packet
+capture, through a capture object with the interface of those in capture.py
+(start, captured_bytes, stop, fetch, discard). reset() drops any connection
+state after an error.
+
+  adb: a real phone, over the device's persistent adb shell session
+  sim: an in-process stand-in that takes a configurable time for each
+       operation, fails a given fraction of them and writes synthetic traces
+       (see synthetic.py), for exercising and profiling campaigns -- the
+       scheduler, retries, analysis -- on many virtual devices at once
+'''
+
+import time
+import zlib
+import pipes
+import logging
+import threading
+import numpy
+
+import synthetic
+from adb import get_session, close_session
+from capture import StreamedCapture
+
+
+class AdbTransport(object):
+    name = 'adb'
+    backoff_seconds = 5  # pause after a failure, to let adb recover
+
+    def __init__(self, device, capture_class=StreamedCapture):
+        self.device = device
+        self._capture_class = capture_class
+
+    def cleanup(self):
+        # all in one round trip
+        get_session(self.device).run(' && '.join([
+            '{ su -c "killall tcpdump_armv7" || true; }',  # may not be running
+            'am force-stop com.android.chrome',
+            'am kill-all',
+            'su -c "rm -rf /data/data/com.android.chrome/cache /data/data/com.android.chrome/files"',
+        ]))
+
+    def launch(self, url):
+        get_session(self.device).run('am start -a android.intent.action.VIEW -d %s com.android.chrome'
+            % pipes.quote(url))
+
+    def capture(self, trace_file):
+        return self._capture_class(self.device, trace_file)
+
+    def reset(self):
+        close_session(self.device)
+
+
+class SimulatedDeviceError(Exception):
+    pass
+
+
+class SimulatedTransport(object):
+    '''A virtual device. Each operation takes latency seconds (+/- 50%) and
+    fails with probability failure_rate. A launched page "loads" for
+    load_seconds (+/- 50%), during which captured_bytes grows; its trace
+    is a synthetic page load whose number of flows and bytes depend on the
+    URL.'''
+    name = 'sim'
+
+    def __init__(self, device, capture_class=None, latency=0.05, failure_rate=0.0,
+                 load_seconds=1.0, backoff_seconds=0, seed=None):
+        # capture_class is ignored: the simulated capture stands in for all modes
+        self.device = device
+        self.latency = latency
+        self.failure_rate = failure_rate
+        self.load_seconds = load_seconds
+        self.backoff_seconds = backoff_seconds
+        self._rng = numpy.random.RandomState(seed)
+        self.url = None
+        self.launched = None  # time the current page was launched
+
+    def operate(self, operation):
+        '''Take the time of one device operation, failing it at random'''
+        time.sleep(self.latency * self._rng.uniform(0.5, 1.5))
+        if self._rng.random_sample() < self.failure_rate:
+            raise SimulatedDeviceError('simulated %s failure on %s' % (operation, self.device))
+
+    def cleanup(self):
+        self.operate('cleanup')
+        self.url = self.launched = None
+
+    def launch(self, url):
+        self.operate('launch')
+        self.url = url
+        self.launched = time.time()
+
+    def capture(self, trace_file):
+        return SimulatedCapture(self, trace_file)
+
+    def reset(self):
+        pass
+
+    def page(self, trace_file):
+        '''(flows, bytes per flow, bandwidth, load seconds, seed) of the page
+        load recorded in trace_file: the same page always has about the same
+        size, and each trial varies'''
+        page = zlib.crc32(self.url or '') & 0xffffffff
+        trial = zlib.crc32(trace_file) & 0xffffffff
+        rng = numpy.random.RandomState(trial)
+        flows = 5 + page % 30
+        flow_bytes = 2000 + (page >> 8) % 60000
+        return flows, flow_bytes, 1e6 * rng.lognormal(0, 0.3), \
+            self.load_seconds * rng.uniform(0.5, 1.5), trial
+
+
+class SimulatedCapture(object):
+    def __init__(self, transport, trace_file):
+        self.transport = transport
+        self.trace_file = trace_file
+        self._page = None
+        self._lock = threading.Lock()
+
+    def start(self):
+        self.transport.operate('capture start')
+
+    def captured_bytes(self):
+        '''Grows linearly while the page loads, then stays put'''
+        if self.transport.launched is None:
+            return 0
+        with self._lock:
+            if self._page is None:
+                self._page = self.transport.page(self.trace_file)
+        flows, flow_bytes, _, load_seconds, _ = self._page
+        done = min((time.time() - self.transport.launched) / load_seconds, 1.0)
+        return int(done * flows * flow_bytes)
+
+    def stop(self):
+        self.transport.operate('capture stop')
+
+    def fetch(self):
+        self.transport.operate('fetch')
+        flows, flow_bytes, bandwidth, _, seed = self.transport.page(self.trace_file)
+        synthetic.write_pcap(self.trace_file, num_flows=flows, bytes_per_flow=flow_bytes,
+            bandwidth=bandwidth, seed=seed)
+        logging.debug('[%s] wrote synthetic trace %s', self.transport.device, self.trace_file)
+
+    def discard(self):
+        pass
+
+
+TRANSPORTS = {
+    AdbTransport.name: AdbTransport,
+    SimulatedTransport.name: SimulatedTransport,
+}
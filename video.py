@@ -0,0 +1,296 @@
+#! /usr/bin/env python
+
+'''Streaming analysis of the long traces loadvideo.sh captures.
+
+A video session's trace can run to hundreds of megabytes, so it is read a
+chunk of records at a time (see pcap.iter_records) and folded into running
+results, in memory that grows with the session's length in seconds, bursts
+and flows rather than with its packets:
+
+  throughput: wire bytes (all, and server to phone) per bin_seconds
+  bursts:     ON periods -- runs of server payload packets less than
+              off_seconds apart carrying at least min_burst_bytes; the gaps
+              between them are OFF periods
+  idle gaps:  stretches of idle_seconds or more with no packets at all
+  flows:      packets and bytes each way per connection (as in flows.py)
+
+Given the session's loadvideo.log (or else assuming the script's fixed
+delay), results are lined up with when play was clicked and when the video
+was paused (-p) or the browser closed (-c).
+'''
+
+import sys
+import json
+import logging
+import argparse
+import numpy
+
+from pcap import DEFAULT_CHUNK_RECORDS, iter_records
+from flows import TCP, decode_records, flow_table, is_downstream
+from analyze import read_script_log
+
+# loadvideo.sh starts tcpdump, loads the page and clicks play this long after
+PLAY_DELAY_SECONDS = 20
+PLAY_EVENT = 'Clicked play'
+
+DEFAULT_BIN_SECONDS = 1.0
+DEFAULT_OFF_SECONDS = 1.0
+DEFAULT_IDLE_SECONDS = 1.0
+DEFAULT_MIN_BURST_BYTES = 10000
+
+
+class VideoTrace(object):
+    '''Running analysis of a video session trace. Feed it decoded chunks of
+    packets (flows.decode_records output) in order with add(), then call
+    finish().'''
+    def __init__(self, bin_seconds=DEFAULT_BIN_SECONDS, off_seconds=DEFAULT_OFF_SECONDS,
+                 idle_seconds=DEFAULT_IDLE_SECONDS, min_burst_bytes=DEFAULT_MIN_BURST_BYTES,
+                 play=None, stop_after=None, stop_event=None):
+        '''play is the epoch time play was clicked (default:
+        PLAY_DELAY_SECONDS after the first packet); stop_after is how many
+        seconds later the video was paused or the browser closed (stop_event
+        says which), if it was.'''
+        self.bin_seconds = bin_seconds
+        self.off_seconds = off_seconds
+        self.idle_seconds = idle_seconds
+        self.min_burst_bytes = min_burst_bytes
+        self.play = play
+        self.stop_after = stop_after
+        self.stop_event = stop_event
+
+        self.start = None       # epoch time of the first packet
+        self.end = None         # ... and of the last
+        self.packets = 0
+        self.bytes = 0
+        self.bytes_down = 0
+        self.throughput = numpy.zeros(0)        # bytes per bin
+        self.throughput_down = numpy.zeros(0)   # server to phone bytes per bin
+        self.bursts = []        # (start, end, bytes, packets), epoch times
+        self.idle_gaps = []     # (start, seconds)
+        self.phase_bytes = None # server to phone bytes before play, while playing, after stop
+        self._flows = {}        # (proto, client port, server, server port) -> [start, end, packets, up, down]
+        self._burst = None      # [start, end, bytes, packets] of the burst in progress
+
+    def _phase_bounds(self):
+        play = self.play if self.play is not None else self.start + PLAY_DELAY_SECONDS
+        stop = play + self.stop_after if self.stop_after else numpy.inf
+        return numpy.array([play, stop])
+
+    def add(self, packets):
+        '''Fold in a chunk of decoded packets'''
+        time = packets['time']
+        if len(time) == 0:
+            return
+        wirelen = packets['wirelen']
+        down = packets['transport'] & is_downstream(packets['sport'], packets['dport'])
+        if self.start is None:
+            self.start = time[0]
+            self.phase_bytes = numpy.zeros(3)
+
+        # idle gaps, including the one since the previous chunk
+        prev = numpy.concatenate(([self.end if self.end is not None else time[0]], time[:-1]))
+        gaps = numpy.flatnonzero(time - prev >= self.idle_seconds)
+        self.idle_gaps.extend(zip(prev[gaps], time[gaps] - prev[gaps]))
+
+        self.end = time[-1]
+        self.packets += len(time)
+        self.bytes += int(wirelen.sum())
+        self.bytes_down += int(wirelen[down].sum())
+
+        # throughput bins
+        bins = ((time - self.start) / self.bin_seconds).astype(numpy.int64)
+        nbins = bins[-1] + 1
+        if nbins > len(self.throughput):
+            self.throughput = numpy.append(self.throughput, numpy.zeros(nbins - len(self.throughput)))
+            self.throughput_down = numpy.append(self.throughput_down,
+                numpy.zeros(nbins - len(self.throughput_down)))
+        self.throughput[:nbins] += numpy.bincount(bins, weights=wirelen, minlength=nbins)
+        self.throughput_down[:nbins] += numpy.bincount(bins[down], weights=wirelen[down],
+            minlength=nbins)
+
+        phases = numpy.searchsorted(self._phase_bounds(), time[down], side='right')
+        self.phase_bytes += numpy.bincount(phases, weights=wirelen[down], minlength=3)
+
+        data = down & (packets['payload'] > 0)
+        self._add_bursts(time[data], wirelen[data])
+        self._add_flows(flow_table(packets), time[0])
+
+    def _add_bursts(self, time, wirelen):
+        if len(time) == 0:
+            return
+        if self._burst is None:
+            self._burst = [time[0], time[0], 0, 0]
+        prev = numpy.concatenate(([self._burst[1]], time[:-1]))
+        breaks = numpy.flatnonzero(time - prev >= self.off_seconds)
+        edges = numpy.concatenate(([0], breaks, [len(time)]))
+        cumulative = numpy.concatenate(([0], numpy.cumsum(wirelen)))
+        for k in range(len(edges) - 1):
+            lo, hi = edges[k], edges[k + 1]
+            if k > 0:
+                self._close_burst()
+                self._burst = [time[lo], time[lo], 0, 0]
+            if hi > lo:
+                self._burst[1] = time[hi - 1]
+                self._burst[2] += int(cumulative[hi] - cumulative[lo])
+                self._burst[3] += hi - lo
+
+    def _close_burst(self):
+        # short exchanges (e.g., keep-alives) don't count as ON periods
+        if self._burst is not None and self._burst[2] >= self.min_burst_bytes:
+            self.bursts.append(tuple(self._burst))
+        self._burst = None
+
+    def _add_flows(self, flows, t0):
+        for flow in flows:
+            key = (int(flow['proto']), int(flow['client_port']), flow['server'], int(flow['server_port']))
+            entry = self._flows.get(key)
+            if entry is None:
+                self._flows[key] = [flow['start'] + t0, flow['end'] + t0, int(flow['packets']),
+                    int(flow['bytes_up']), int(flow['bytes_down'])]
+            else:
+                entry[1] = flow['end'] + t0
+                entry[2] += int(flow['packets'])
+                entry[3] += int(flow['bytes_up'])
+                entry[4] += int(flow['bytes_down'])
+
+    def finish(self):
+        '''Close the burst in progress; returns self'''
+        self._close_burst()
+        return self
+
+    def _get_flows(self):
+        '''Flows as dicts, largest first'''
+        flows = [dict(proto='tcp' if key[0] == TCP else 'udp', client_port=key[1],
+                server=key[2], server_port=key[3], start=entry[0], end=entry[1],
+                packets=entry[2], bytes_up=entry[3], bytes_down=entry[4])
+            for key, entry in self._flows.iteritems()]
+        flows.sort(key=lambda flow: -(flow['bytes_up'] + flow['bytes_down']))
+        return flows
+    flows = property(_get_flows)
+
+    def summary(self):
+        '''All results as a dict (times in seconds since the first packet)'''
+        if self.start is None:
+            return dict(packets=0)
+        t0 = self.start
+        play, stop = self._phase_bounds()
+        on_seconds = sum(end - start for start, end, _, _ in self.bursts)
+        after_stop = [burst for burst in self.bursts if burst[1] > stop]
+        return dict(
+            packets=self.packets, bytes=self.bytes, bytes_down=self.bytes_down,
+            seconds=self.end - t0,
+            play=play - t0,
+            stop=stop - t0 if numpy.isfinite(stop) else None,
+            stop_event=self.stop_event,
+            bytes_before_play=int(self.phase_bytes[0]),
+            bytes_playing=int(self.phase_bytes[1]),
+            bytes_after_stop=int(self.phase_bytes[2]) if numpy.isfinite(stop) else None,
+            # how long downloading went on after the pause/close
+            download_after_stop_seconds=max(after_stop[-1][1] - stop, 0)
+                if len(after_stop) > 0 else (0.0 if numpy.isfinite(stop) else None),
+            bin_seconds=self.bin_seconds,
+            throughput=list(self.throughput),
+            throughput_down=list(self.throughput_down),
+            on_seconds=on_seconds,
+            off_seconds=max(self.end - t0 - on_seconds, 0),
+            bursts=[dict(start=start - t0, end=end - t0, bytes=nbytes, packets=npackets)
+                for start, end, nbytes, npackets in self.bursts],
+            idle_gaps=[dict(start=start - t0, seconds=seconds) for start, seconds in self.idle_gaps],
+            flows=[dict(flow, start=flow['start'] - t0, end=flow['end'] - t0) for flow in self.flows],
+        )
+
+
+def play_time(script_log, run=-1):
+    '''Epoch time play was clicked, from a session's loadvideo.log'''
+    epochs, events = read_script_log(script_log, run)
+    if PLAY_EVENT not in events:
+        raise ValueError('no "%s" line in %s' % (PLAY_EVENT, script_log))
+    return epochs[events.index(PLAY_EVENT)]
+
+def analyze_video(filepath, chunk_records=DEFAULT_CHUNK_RECORDS, **kwargs):
+    '''Analyze a video session trace chunk by chunk; kwargs are passed to
+    VideoTrace. Returns the finished VideoTrace.'''
+    video = VideoTrace(**kwargs)
+    for records, data in iter_records(filepath, chunk_records, with_data=True):
+        video.add(decode_records(records, data))
+    return video.finish()
+
+
+def main():
+    play = play_time(args.script_log, args.run) if args.script_log else None
+    stop_event = 'pause' if args.pause else 'close' if args.close else None
+    video = analyze_video(args.trace, args.chunk_records, bin_seconds=args.bin,
+        off_seconds=args.off, idle_seconds=args.idle, min_burst_bytes=args.min_burst,
+        play=play, stop_after=args.pause or args.close, stop_event=stop_event)
+    summary = video.summary()
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(summary, f, indent=1, sort_keys=True)
+        f.closed
+        logging.info('Wrote %s', args.output)
+
+    if summary['packets'] == 0:
+        print 'No packets in %s' % args.trace
+        return
+    print '========== %s ==========' % args.trace
+    print '%i packets, %i bytes (%i to phone), %f seconds' % (summary['packets'],
+        summary['bytes'], summary['bytes_down'], summary['seconds'])
+    print 'PLAY at %.1f s' % summary['play']
+    print '  Bytes before play:\t%i' % summary['bytes_before_play']
+    if summary['stop'] is not None:
+        print '  Bytes while playing:\t%i' % summary['bytes_playing']
+        print '%s at %.1f s' % (summary['stop_event'].upper(), summary['stop'])
+        print '  Bytes after %s:\t%i' % (summary['stop_event'], summary['bytes_after_stop'])
+        print '  Downloading until:\t%.1f s after %s' % (summary['download_after_stop_seconds'],
+            summary['stop_event'])
+    else:
+        print '  Bytes after play:\t%i' % summary['bytes_playing']
+    print 'BURSTS: %i ON periods, %.1f s ON, %.1f s OFF' % (len(summary['bursts']),
+        summary['on_seconds'], summary['off_seconds'])
+    for burst in summary['bursts']:
+        print '  %8.1f - %8.1f s\t%i bytes' % (burst['start'], burst['end'], burst['bytes'])
+    print 'IDLE GAPS (%.1f s or more): %i' % (args.idle, len(summary['idle_gaps']))
+    for gap in summary['idle_gaps']:
+        print '  %8.1f s\t%.1f s' % (gap['start'], gap['seconds'])
+    print 'FLOWS: %i (largest %i)' % (len(summary['flows']), min(args.flows, len(summary['flows'])))
+    for flow in summary['flows'][:args.flows]:
+        print '  %s %s:%i\t%i bytes down, %i bytes up' % (flow['proto'], flow['server'],
+            flow['server_port'], flow['bytes_down'], flow['bytes_up'])
+    sys.stdout.flush()
+
+
+if __name__ == "__main__":
+    # set up command line args
+    parser = argparse.ArgumentParser(formatter_class=argparse.ArgumentDefaultsHelpFormatter,\
+                                     description='Analyze a video session trace captured by loadvideo.sh.')
+    parser.add_argument('trace', help='The session\'s pcap trace.')
+    parser.add_argument('-s', '--script_log', help='The session\'s loadvideo.log, to line results up with when play was clicked (otherwise assumed %i seconds into the trace).' % PLAY_DELAY_SECONDS)
+    parser.add_argument('--run', type=int, default=-1, help='Which run in --script_log to use (0 is the first; negative counts from the end).')
+    group = parser.add_mutually_exclusive_group()
+    group.add_argument('-p', '--pause', type=float, help='The session paused the video this many seconds after play (loadvideo.sh -p).')
+    group.add_argument('-c', '--close', type=float, help='The session closed the browser this many seconds after play (loadvideo.sh -c).')
+    parser.add_argument('--bin', type=float, default=DEFAULT_BIN_SECONDS, help='Seconds per throughput bin.')
+    parser.add_argument('--off', type=float, default=DEFAULT_OFF_SECONDS, help='Gap (seconds) between server packets that ends an ON period.')
+    parser.add_argument('--idle', type=float, default=DEFAULT_IDLE_SECONDS, help='Shortest gap (seconds) with no packets to report as idle.')
+    parser.add_argument('--min_burst', type=int, default=DEFAULT_MIN_BURST_BYTES, help='Fewest bytes for a run of server packets to count as an ON period.')
+    parser.add_argument('--flows', type=int, default=10, help='Number of flows to list.')
+    parser.add_argument('--chunk_records', type=int, default=DEFAULT_CHUNK_RECORDS, help='Packets to read at a time.')
+    parser.add_argument('-o', '--output', help='Also write all results (including throughput per bin) here as JSON.')
+    parser.add_argument('-q', '--quiet', action='store_true', default=False, help='only print errors')
+    parser.add_argument('-v', '--verbose', action='store_true', default=False, help='print debug info. --quiet wins if both are present')
+    args = parser.parse_args()
+
+    # set up logging
+    if args.quiet:
+        level = logging.WARNING
+    elif args.verbose:
+        level = logging.DEBUG
+    else:
+        level = logging.INFO
+    logging.basicConfig(
+        format = "%(levelname) -10s %(asctime)s %(module)s:%(lineno) -7s %(message)s",
+        level = level
+    )
+
+    main()